@@ -50,12 +50,23 @@ const App = () => {
       setCurrentMessage('');
       
       try {
-        const response = await chatAPI.sendMessage(messageToSend);
-        setChatMessages(prev => [...prev, {
-          type: 'ai',
-          content: response.data.response,
-          timestamp: new Date().toLocaleTimeString()
-        }]);
+        // Show the answer while it is generated: add an empty AI message and grow it
+        let started = false;
+        await chatAPI.streamMessage(messageToSend, (text) => {
+          if (!started) {
+            started = true;
+            setChatMessages(prev => [...prev, {
+              type: 'ai',
+              content: text,
+              timestamp: new Date().toLocaleTimeString()
+            }]);
+            return;
+          }
+          setChatMessages(prev => {
+            const last = prev[prev.length - 1];
+            return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+          });
+        });
       } catch (error) {
         console.error('Chat error:', error);
         setChatMessages(prev => [...prev, {
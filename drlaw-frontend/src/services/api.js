@@ -11,7 +11,43 @@ const api = axios.create({
 
 export const chatAPI = {
   sendMessage: (message) => api.post('/chat', { message }),
-  uploadDocument: (file) => api.post('/upload', { file: file.name }),
+  // multipart upload of the file itself; docType ("statute" or "judgment") is optional.
+  // The multipart Content-Type (the browser adds the boundary) overrides the JSON default.
+  uploadDocument: (file, docType) => {
+    const form = new FormData();
+    form.append('file', file);
+    if (docType) form.append('doc_type', docType);
+    return api.post('/upload', form, { headers: { 'Content-Type': 'multipart/form-data' } });
+  },
+  uploadStatus: (jobId) => api.get(`/upload/${jobId}`),
+  // Server-Sent Events from /chat/stream; onText gets each piece of the answer as it arrives
+  streamMessage: async (message, onText) => {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message }),
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Chat stream failed: ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let end;
+      while ((end = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, end);
+        buffer = buffer.slice(end + 2);
+        const event = (block.match(/^event: (.*)$/m) || [])[1];
+        const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || '{}');
+        if (event === 'error') throw new Error(data.detail);
+        if (data.text) onText(data.text);
+      }
+    }
+  },
 };
 
 export default api;
\ No newline at end of file
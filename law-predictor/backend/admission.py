@@ -0,0 +1,169 @@
+import os
+import math
+import time
+import asyncio
+import itertools
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+import numpy as np
+from backends import pool
+
+# Admission control in front of Ollama. At most LLM_CONCURRENCY generations run at once, each
+# traffic class has its own cap, and waiting requests are served by priority:
+# interactive chat first, then /predict, then bulk /predict/batch. Endpoints that never call the
+# LLM (/predict_case, /health, /ready, /metrics) and cache hits never go through here.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", str(2 * len(pool.backends))))  # 2 per Ollama backend
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))  # waiting requests ahead before answering 429
+LLM_BACKLOG_MAX = int(os.getenv("LLM_BACKLOG_MAX", "64"))  # queued /predict/batch items before new batches get 429
+LLM_MAX_WAIT_S = float(os.getenv("LLM_MAX_WAIT_S", "60"))  # estimated wait before answering 503
+LLM_SERVICE_ESTIMATE_S = float(os.getenv("LLM_SERVICE_ESTIMATE_S", "15"))  # initial guess of one generation
+# class -> (priority, concurrency cap); lower priority numbers are served first
+TRAFFIC_CLASSES = {
+    "chat": (0, int(os.getenv("LLM_CAP_CHAT", str(LLM_CONCURRENCY)))),
+    "predict": (1, int(os.getenv("LLM_CAP_PREDICT", str(LLM_CONCURRENCY)))),
+    "batch": (2, int(os.getenv("LLM_CAP_BATCH", "1"))),
+}
+
+class Overloaded(Exception):
+    """Raised instead of queueing when the LLM is saturated; maps to a 429/503 with Retry-After"""
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code, self.detail, self.retry_after = status_code, detail, retry_after
+
+class _Waiter:
+    def __init__(self, cls, priority, seq, shed=True):
+        self.cls, self.priority, self.seq, self.shed = cls, priority, seq, shed
+        self.granted = asyncio.get_running_loop().create_future()
+        self.since = time.perf_counter()
+
+class LLMScheduler:
+    def __init__(self, capacity=LLM_CONCURRENCY, max_queue=LLM_QUEUE_MAX, max_wait_s=LLM_MAX_WAIT_S,
+                 classes=TRAFFIC_CLASSES, service_estimate_s=LLM_SERVICE_ESTIMATE_S, max_backlog=LLM_BACKLOG_MAX):
+        self.capacity, self.max_queue, self.max_wait_s = capacity, max_queue, max_wait_s
+        self.max_backlog = max_backlog
+        self.classes = classes
+        self.service_s = service_estimate_s  # moving average of how long a generation holds a slot
+        self.running = Counter()
+        self._queue = []  # waiters sorted by (priority, arrival)
+        self._seq = itertools.count()
+        self.admitted, self.rejected = Counter(), Counter()
+        self.waits = {cls: deque(maxlen=1000) for cls in classes}
+
+    def _runnable(self, cls):
+        return sum(self.running.values()) < self.capacity and self.running[cls] < self.classes[cls][1]
+
+    def ahead(self, cls, shed_only=False):
+        """Waiters a new request of this class would queue behind: those of the same or a higher priority"""
+        priority = self.classes[cls][0]
+        return sum(1 for w in self._queue if w.priority <= priority and (w.shed or not shed_only))
+
+    def backlog(self, cls):
+        """Waiters of this class queued with shed=False, which are never turned away once queued"""
+        return sum(1 for w in self._queue if w.cls == cls and not w.shed)
+
+    def estimated_wait(self, cls):
+        """Seconds a new request of this class would wait: the queue ahead of it, drained capacity at a time"""
+        ahead = self.ahead(cls)
+        if ahead == 0 and self._runnable(cls):
+            return 0.0
+        return (ahead + 1) * self.service_s / max(1, min(self.capacity, self.classes[cls][1]))
+
+    def check(self, cls):
+        """
+        Raise Overloaded if a request of this class would be turned away right now. Only the
+        queue ahead of it counts, so queued batch work never sheds chat or /predict. Waiters
+        queued with shed=False (the items of admitted batches) have their own bound, max_backlog.
+        """
+        wait = self.estimated_wait(cls)
+        if wait == 0.0:
+            return
+        retry_after = max(1, math.ceil(wait))
+        if self.backlog(cls) >= self.max_backlog:
+            self.rejected[cls] += 1
+            raise Overloaded(429, "Too many batch predictions are queued for the language model, retry later.", retry_after)
+        if self.ahead(cls, shed_only=True) >= self.max_queue:
+            self.rejected[cls] += 1
+            raise Overloaded(429, "Too many requests are waiting for the language model, retry shortly.", retry_after)
+        if wait > self.max_wait_s:
+            self.rejected[cls] += 1
+            raise Overloaded(503, f"The language model is busy (about {retry_after}s wait), retry shortly.", retry_after)
+
+    @asynccontextmanager
+    async def slot(self, cls, shed=True):
+        """
+        Hold one LLM slot for the duration of the block. With shed=True the request is
+        rejected (Overloaded) rather than queued when the queue is full or the wait too long.
+        """
+        priority = self.classes[cls][0]
+        if shed:
+            self.check(cls)
+        waiter = _Waiter(cls, priority, next(self._seq), shed)
+        if self._runnable(cls) and not any(w.priority <= priority for w in self._queue):
+            self._grant(waiter)
+        else:
+            self._queue.append(waiter)
+            self._queue.sort(key=lambda w: (w.priority, w.seq))
+        try:
+            await waiter.granted
+        except asyncio.CancelledError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif waiter.granted.done() and not waiter.granted.cancelled():
+                self._release(waiter, 0.0)  # granted just as the caller went away
+            raise
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.perf_counter() - t0)
+
+    def _grant(self, waiter):
+        self.running[waiter.cls] += 1
+        self.admitted[waiter.cls] += 1
+        self.waits[waiter.cls].append(time.perf_counter() - waiter.since)
+        if not waiter.granted.done():
+            waiter.granted.set_result(None)
+
+    def _release(self, waiter, held_s):
+        self.running[waiter.cls] -= 1
+        if held_s > 0:
+            self.service_s = 0.8 * self.service_s + 0.2 * held_s
+        self._dispatch()
+
+    def _dispatch(self):
+        for waiter in list(self._queue):
+            if sum(self.running.values()) >= self.capacity:
+                break
+            if waiter.granted.cancelled():
+                self._queue.remove(waiter)
+            elif self._runnable(waiter.cls):
+                self._queue.remove(waiter)
+                self._grant(waiter)
+
+    def stats(self):
+        def pct(samples, q):
+            return round(float(np.percentile(samples, q)) * 1000, 1) if samples else 0.0
+        return {
+            "capacity": self.capacity,
+            "running": sum(self.running.values()),
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "max_backlog": self.max_backlog,
+            "estimated_service_s": round(self.service_s, 2),
+            "classes": {
+                cls: {
+                    "priority": priority,
+                    "cap": cap,
+                    "running": self.running[cls],
+                    "queued": sum(1 for w in self._queue if w.cls == cls),
+                    "backlog": self.backlog(cls),
+                    "admitted": self.admitted[cls],
+                    "rejected": self.rejected[cls],
+                    "wait_ms_p50": pct(self.waits[cls], 50),
+                    "wait_ms_p99": pct(self.waits[cls], 99),
+                }
+                for cls, (priority, cap) in self.classes.items()
+            },
+        }
+
+scheduler = LLMScheduler()
@@ -0,0 +1,249 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+import httpx
+import numpy as np
+import ollama
+
+# Pool of Ollama daemons. OLLAMA_BACKENDS is a comma-separated list of hosts; the big chat model
+# and the small trend model can be given their own hosts (OLLAMA_BIG_BACKENDS /
+# OLLAMA_SMALL_BACKENDS) so long generations do not hold up the short ones.
+CHAT_MODEL = os.getenv("OLLAMA_CHAT_MODEL", "llama3.1:8b")
+TREND_MODEL = os.getenv("OLLAMA_TREND_MODEL", "llama3.2:3b")
+_DEFAULT_HOSTS = os.getenv("OLLAMA_BACKENDS", os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434"))
+BIG_HOSTS = [h.strip() for h in os.getenv("OLLAMA_BIG_BACKENDS", _DEFAULT_HOSTS).split(",") if h.strip()]
+SMALL_HOSTS = [h.strip() for h in os.getenv("OLLAMA_SMALL_BACKENDS", _DEFAULT_HOSTS).split(",") if h.strip()]
+EJECT_AFTER_FAILURES = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))  # consecutive failures
+EJECT_S = float(os.getenv("OLLAMA_EJECT_S", "30"))  # how long an ejected backend gets no traffic
+HEALTH_INTERVAL_S = float(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "10"))
+# How long Ollama keeps a model loaded after a call ("30m", seconds, or -1 for always). Ollama's
+# own default of 5 minutes means a reload, and a fresh prefill of the system prompt, after a quiet spell.
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+if KEEP_ALIVE.lstrip("-").isdigit():
+    KEEP_ALIVE = int(KEEP_ALIVE)  # plain numbers are seconds; Ollama only parses strings with a unit
+
+def backend_failure(e):
+    """Errors that say the daemon is unreachable or broken, as opposed to a bad request"""
+    if isinstance(e, (ConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(e, ollama.ResponseError) and (e.status_code >= 500 or e.status_code == 404)
+
+class NoBackend(RuntimeError):
+    """No Ollama backend is configured for a model"""
+
+class Backend:
+    def __init__(self, host, pool):
+        self.host, self.pool = host, pool
+        self.client = ollama.AsyncClient(host=host)
+        self._sync_client = None
+        self.outstanding = 0
+        self.requests = self.errors = self.ejections = 0
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0  # after failed requests; only time or a successful request ends it
+        self.unreachable = False  # the last health check failed; the next good one ends it
+        self.latency = deque(maxlen=500)
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            self._sync_client = ollama.Client(host=self.host)
+        return self._sync_client
+
+    @property
+    def healthy(self):
+        return not self.unreachable and time.monotonic() >= self.ejected_until
+
+    def succeeded(self, seconds):
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.unreachable = False
+        self.latency.append(seconds)
+
+    def failed(self):
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= EJECT_AFTER_FAILURES:
+            self.eject()
+
+    def eject(self):
+        if self.healthy:
+            self.ejections += 1
+            print(f"⚠️ Ollama backend {self.host} ejected for {EJECT_S:.0f}s")
+        self.ejected_until = time.monotonic() + EJECT_S
+
+    def stats(self):
+        def pct(q):
+            return round(float(np.percentile(self.latency, q)) * 1000, 1) if self.latency else 0.0
+        return {
+            "pool": self.pool,
+            "healthy": self.healthy,
+            "unreachable": self.unreachable,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "latency_ms_p50": pct(50),
+            "latency_ms_p99": pct(99),
+        }
+
+class BackendPool:
+    """
+    Routes each call to the backend of the model's pool with the fewest requests outstanding.
+    Backends that keep failing requests are ejected for EJECT_S; the health checks take out
+    daemons that stop answering, and bring them back, without waiting for user traffic to find out.
+    """
+    def __init__(self, big_hosts=BIG_HOSTS, small_hosts=SMALL_HOSTS):
+        self.backends = {}
+        self.pools = {"big": [], "small": []}
+        for pool, hosts in (("big", big_hosts), ("small", small_hosts)):
+            for host in hosts:
+                # a host listed for both models is one daemon with one outstanding count
+                backend = self.backends.setdefault(host, Backend(host, pool))
+                if backend.pool != pool:
+                    backend.pool = "shared"
+                self.pools[pool].append(backend)
+        self._health_task = None
+
+    def pool_for(self, model):
+        return self.pools["big" if model == CHAT_MODEL else "small"]
+
+    def pick(self, model, exclude=()):
+        candidates = [b for b in self.pool_for(model) if b not in exclude]
+        if not candidates:
+            raise NoBackend(f"No Ollama backend is configured for {model}; set OLLAMA_BACKENDS.")
+        healthy = [b for b in candidates if b.healthy]
+        if not healthy:
+            # everything is ejected: try the one that has been out the longest rather than fail outright
+            return min(candidates, key=lambda b: (b.ejected_until, b.unreachable))
+        least = min(b.outstanding for b in healthy)
+        return random.choice([b for b in healthy if b.outstanding == least])
+
+    async def chat(self, model, messages, **kwargs):
+        """Non-streamed chat on the least loaded backend; retried once elsewhere if the backend is down"""
+        kwargs.setdefault("keep_alive", KEEP_ALIVE)
+        tried = []
+        while True:
+            backend = self.pick(model, exclude=tried)
+            tried.append(backend)
+            backend.outstanding += 1
+            backend.requests += 1
+            t0 = time.perf_counter()
+            try:
+                response = await backend.client.chat(model=model, messages=messages, **kwargs)
+            except Exception as e:
+                if not backend_failure(e):
+                    raise
+                backend.failed()
+                if len(tried) >= min(2, len(self.pool_for(model))):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            backend.succeeded(time.perf_counter() - t0)
+            return response
+
+    def chat_sync(self, model, messages, **kwargs):
+        """chat() for callers without an event loop (run_ai_direct.py), over the same backends"""
+        kwargs.setdefault("keep_alive", KEEP_ALIVE)
+        tried = []
+        while True:
+            backend = self.pick(model, exclude=tried)
+            tried.append(backend)
+            backend.outstanding += 1
+            backend.requests += 1
+            t0 = time.perf_counter()
+            try:
+                response = backend.sync_client.chat(model=model, messages=messages, **kwargs)
+            except Exception as e:
+                if not backend_failure(e):
+                    raise
+                backend.failed()
+                if len(tried) >= min(2, len(self.pool_for(model))):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            backend.succeeded(time.perf_counter() - t0)
+            return response
+
+    async def chat_stream(self, model, messages, **kwargs):
+        """Streamed chat on the least loaded backend; the latency recorded is that of the whole stream"""
+        kwargs.setdefault("keep_alive", KEEP_ALIVE)
+        backend = self.pick(model)
+        backend.outstanding += 1
+        backend.requests += 1
+        t0 = time.perf_counter()
+        try:
+            async for part in await backend.client.chat(model=model, messages=messages, stream=True, **kwargs):
+                yield part
+        except Exception as e:
+            if backend_failure(e):
+                backend.failed()
+            raise
+        finally:
+            backend.outstanding -= 1
+        backend.succeeded(time.perf_counter() - t0)
+
+    async def warm_up(self, system_prompts):
+        """
+        Load each model on every backend of its pool and prefill its system prompt, so the
+        first user request neither waits for the load nor recomputes the shared prefix.
+        `system_prompts` maps model name -> system prompt. Returns seconds per backend/model.
+        """
+        async def one(backend, model, system_prompt):
+            t0 = time.perf_counter()
+            try:
+                await backend.client.chat(model=model, messages=[
+                    {'role': 'system', 'content': system_prompt},
+                    {'role': 'user', 'content': 'Hello'}
+                ], options={"num_predict": 1}, keep_alive=KEEP_ALIVE)
+            except Exception as e:
+                print(f"⚠️ Could not warm up {model} on {backend.host}: {e}")
+                return f"{backend.host} {model}", None
+            return f"{backend.host} {model}", round(time.perf_counter() - t0, 3)
+
+        jobs = [one(b, model, prompt) for model, prompt in system_prompts.items() for b in self.pool_for(model)]
+        return dict(await asyncio.gather(*jobs))
+
+    async def check(self, backend):
+        """
+        Probe the daemon. A failed probe takes the backend out until a probe succeeds; an
+        ejection for failed requests (5xx, a model that is not pulled) is left to run its
+        EJECT_S, since a daemon that answers ps() can still fail every chat.
+        """
+        try:
+            await asyncio.wait_for(backend.client.ps(), timeout=5)
+        except Exception:
+            if not backend.unreachable:
+                backend.ejections += 1
+                print(f"⚠️ Ollama backend {backend.host} is unreachable")
+            backend.unreachable = True
+            return False
+        if backend.unreachable:
+            print(f"✅ Ollama backend {backend.host} is back")
+        backend.unreachable = False
+        return True
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check(b) for b in self.backends.values()))
+            await asyncio.sleep(HEALTH_INTERVAL_S)
+
+    def start_health_checks(self):
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self):
+        return {host: b.stats() for host, b in self.backends.items()}
+
+pool = BackendPool()
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+from collections import Counter, deque
+import numpy as np
+import llm
+
+# Concurrent /predict queries are embedded and searched together: the first query of a
+# batch waits at most BATCH_MAX_WAIT_MS for others, a batch never exceeds BATCH_MAX_SIZE.
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+
+class BatchStats:
+    """Batch sizes and the time queries spent queued before their batch ran"""
+    def __init__(self, window=1000):
+        self.batches = 0
+        self.queries = 0
+        self.sizes = Counter()
+        self.queue_ms = deque(maxlen=window)
+        self.run_ms = deque(maxlen=window)
+
+    def record(self, size, queue_ms, run_ms):
+        self.batches += 1
+        self.queries += size
+        self.sizes[size] += 1
+        self.queue_ms.extend(queue_ms)
+        self.run_ms.append(run_ms)
+
+    def snapshot(self):
+        def pct(samples, q):
+            return round(float(np.percentile(samples, q)), 3) if samples else 0.0
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.sizes.items())),
+            "queue_ms_p50": pct(self.queue_ms, 50),
+            "queue_ms_p99": pct(self.queue_ms, 99),
+            "batch_ms_p50": pct(self.run_ms, 50),
+            "batch_ms_p99": pct(self.run_ms, 99),
+        }
+
+class QueryBatcher:
+    """
+    Collects queries from concurrent requests and runs them through `run_batch(qtexts, top_ks,
+    filters, snapshot=...)` (one encode, one index search per distinct filter) on the embedding
+    thread pool. Queries pinned to different index snapshots, around a reload, go in separate
+    calls. While a batch runs, the next one fills up, so batches grow with the load instead of
+    adding latency at low load.
+    """
+    def __init__(self, run_batch, max_wait_ms=BATCH_MAX_WAIT_MS, max_size=BATCH_MAX_SIZE):
+        self.run_batch = run_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_size = max_size
+        self.stats = BatchStats()
+        self._queue = None
+        self._worker = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, qtext, top_k, filters=None, snapshot=None):
+        """Result of run_batch for this one query, once its batch has run"""
+        if self._worker is None:
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((qtext, top_k, filters, snapshot, fut, time.perf_counter()))
+        return await fut
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # whatever queued up meanwhile goes too, up to max_size
+        while len(batch) < self.max_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            batch = [item for item in batch if not item[4].done()]  # callers that gave up
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[3]), []).append(item)
+            for group in groups.values():
+                await self._run_group(group)
+
+    async def _run_group(self, batch):
+        t0 = time.perf_counter()
+        try:
+            results = await llm.run_blocking(self.run_batch, [item[0] for item in batch], [item[1] for item in batch],
+                                             [item[2] for item in batch], snapshot=batch[0][3])
+        except Exception as e:
+            for item in batch:
+                if not item[4].done():
+                    item[4].set_exception(e)
+            return
+        t1 = time.perf_counter()
+        self.stats.record(len(batch), [(t0 - item[5]) * 1000 for item in batch], (t1 - t0) * 1000)
+        for item, rows in zip(batch, results):
+            if not item[4].done():
+                item[4].set_result(rows)
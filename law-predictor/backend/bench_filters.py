@@ -0,0 +1,43 @@
+import sys, time, argparse
+import numpy as np
+import serving
+from serving import state, search_filtered
+
+def latency(search, queries, k):
+    """Per-query latencies (ms) of searching the queries one at a time, as /predict does"""
+    times = []
+    for q in queries:
+        t0 = time.perf_counter()
+        search(q[None, :], k)
+        times.append((time.perf_counter() - t0) * 1000)
+    return np.array(times)
+
+def main(args):
+    serving.warm_up(encode=False)
+    if state.index is None or state.filters is None or state.vectors is None:
+        sys.exit("Needs an index ingested with metadata filters; run ingest.py first.")
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, state.index.d), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    specs = [{"doc_type": t} for t in state.filters.values("type")] + [{"court": c} for c in state.filters.values("court")]
+    specs += [{"court": "high court"}, {"date_from": args.date_from}]
+    print(f"🧪 {state.index.ntotal} vectors in {len(state.index)} shard(s), {len(queries)} queries, top-{args.k}")
+    print(f"\n{'filter':<40}{'vectors':>10}{'path':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    times = latency(lambda q, k: state.index.search(q, k), queries, args.k)
+    print(f"{'none':<40}{state.index.ntotal:>10}{'index':>8}{np.percentile(times, 50):>10.2f}{np.percentile(times, 99):>10.2f}")
+    for spec in specs:
+        selection = state.filters.select(spec)
+        for path, exact_max in (("exact", len(selection)), ("index", -1)):
+            if path == "index" and not state.index.supports_selector:
+                continue
+            serving.FILTER_EXACT_MAX = exact_max
+            times = latency(lambda q, k: search_filtered(q, k, selection), queries, args.k)
+            label = ", ".join(f"{k}={v}" for k, v in spec.items())
+            print(f"{label:<40}{len(selection):>10}{path:>8}{np.percentile(times, 50):>10.2f}{np.percentile(times, 99):>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search latency with and without metadata filters, by exact scan and by ID selector in the index")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--date-from", default="2018-01-01")
+    main(parser.parse_args())
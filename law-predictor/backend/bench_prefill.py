@@ -0,0 +1,78 @@
+import json, time, argparse
+import numpy as np
+import ollama
+from backends import KEEP_ALIVE, BIG_HOSTS, SMALL_HOSTS, CHAT_MODEL, TREND_MODEL
+from prompts import chat_messages, trend_prompt
+
+QUESTIONS = [
+    "What is the punishment for theft under IPC 379?",
+    "What are my chances of bail in a cheating case under section 420?",
+    "How is dowry harassment under 498A proved in court?",
+    "Can a murder charge under 302 be reduced to culpable homicide?",
+    "What evidence is needed for a breach of trust case under 406?",
+    "What is the limitation period for filing a defamation complaint?",
+]
+EVIDENCE = [{
+    "source_path": "Indian Penal Code",
+    "text": "Section 193: Whoever intentionally gives false evidence in any stage of a judicial proceeding, or fabricates false evidence for the purpose of being used in any stage of a judicial proceeding, shall be punished with imprisonment of either description for a term which may extend to seven years, and shall also be liable to fine.",
+}]
+
+def trend_prompt_before(question, evidence_list):
+    """The trend prompt as it was sent before its fixed instruction line moved into the system message"""
+    prompt = "You are a legal prediction assistant for Indian law.\n"
+    prompt += "Question:\n" + question + "\n\n"
+    prompt += "Evidence:\n"
+    for i, e in enumerate(evidence_list[:3], 1):
+        prompt += f"[{i}] {e.get('source_path','?')}\n{e.get('text','')[:500]}\n\n"
+    return [
+        {'role': 'system', 'content': 'You are a helpful legal assistant.'},
+        {'role': 'user', 'content': prompt}
+    ]
+
+# name -> (model, messages for a question); /chat's layout did not change, only residency matters for it
+PROMPTS = {
+    "chat": (CHAT_MODEL, lambda q: chat_messages(q, "")),
+    "trend, before": (TREND_MODEL, lambda q: trend_prompt_before(q, EVIDENCE)),
+    "trend, now": (TREND_MODEL, lambda q: trend_prompt(q, EVIDENCE)),
+}
+
+def run(client, model, build, keep_alive, n):
+    rows = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        r = client.chat(model=model, messages=build(QUESTIONS[i % len(QUESTIONS)]), options={"num_predict": 1}, keep_alive=keep_alive)
+        rows.append({
+            "wall_ms": (time.perf_counter() - t0) * 1000,
+            "load_ms": (r.get("load_duration") or 0) / 1e6,
+            "prompt_tokens": r.get("prompt_eval_count") or 0,
+            "prefill_ms": (r.get("prompt_eval_duration") or 0) / 1e6,
+        })
+    return {key: float(np.mean([row[key] for row in rows])) for key in rows[0]}
+
+def main(args):
+    print(f"🧪 {args.requests} requests per scenario")
+    scenarios = [(f"{name}, unloaded between calls", name, 0) for name in ("chat", "trend, now")]
+    scenarios += [(f"{name}, resident", name, args.keep_alive) for name in PROMPTS]
+    results = {}
+    for label, name, keep_alive in scenarios:
+        model, build = PROMPTS[name]
+        client = ollama.Client(host=args.chat_host if model == CHAT_MODEL else args.trend_host)
+        client.chat(model=model, messages=[{'role': 'user', 'content': 'warm-up'}], options={"num_predict": 1}, keep_alive=keep_alive)
+        results[label] = run(client, model, build, keep_alive, args.requests)
+
+    print(f"\n{'scenario':<40}{'wall ms':>10}{'load ms':>10}{'prompt tok':>12}{'prefill ms':>12}")
+    for label, r in results.items():
+        print(f"{label:<40}{r['wall_ms']:>10.1f}{r['load_ms']:>10.1f}{r['prompt_tokens']:>12.0f}{r['prefill_ms']:>12.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model load and prompt prefill time per LLM call against a real Ollama: "
+                                                 "unloaded vs resident, and the trend prompt before and after its fixed text moved into the system message")
+    parser.add_argument("--chat-host", default=BIG_HOSTS[0], help="Ollama serving the chat model")
+    parser.add_argument("--trend-host", default=SMALL_HOSTS[0], help="Ollama serving the trend model")
+    parser.add_argument("--keep-alive", default=KEEP_ALIVE)
+    parser.add_argument("--requests", type=int, default=6)
+    parser.add_argument("--json", help="Also write the results to this file")
+    main(parser.parse_args())
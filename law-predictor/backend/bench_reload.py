@@ -0,0 +1,76 @@
+import sys, time, argparse, threading
+from collections import Counter
+import numpy as np
+import snapshots
+import serving
+from serving import state
+
+QUESTIONS = [
+    "punishment for theft of a motor vehicle",
+    "bail in a cheating case under section 420",
+    "dowry harassment and cruelty by the husband",
+    "culpable homicide not amounting to murder",
+]
+
+def main(args):
+    names = snapshots.published()
+    if len(names) < 2:
+        sys.exit(f"Found {len(names)} published snapshot(s) in {snapshots.SNAPSHOT_DIR}; run ingest.py at least twice.")
+    serving.warm_up()
+    if state.index is None:
+        sys.exit("No index loaded.")
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies = {"steady": [], "reloading": []}
+    errors, versions = Counter(), Counter()
+    reloading = threading.Event()
+
+    def client(i):
+        n = 0
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                with state.pin() as snapshot:  # as the server's middleware does per request
+                    serving.retrieve(QUESTIONS[(i + n) % len(QUESTIONS)] + f" {n}", args.k)
+                with lock:
+                    latencies["reloading" if reloading.is_set() else "steady"].append((time.perf_counter() - t0) * 1000)
+                    versions[snapshot.version] += 1
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+            n += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    reload_s = []
+    try:
+        for i in range(args.reloads):
+            time.sleep(args.interval)
+            snapshots.publish(int(names[i % len(names)][1:]), [])  # only moves CURRENT: the snapshot exists
+            reloading.set()
+            t0 = time.perf_counter()
+            serving.reload_index()
+            reload_s.append(time.perf_counter() - t0)
+            reloading.clear()
+        time.sleep(args.interval)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        snapshots.publish(int(names[-1][1:]), [])
+
+    print(f"🧪 {args.clients} clients, {args.reloads} reloads across {', '.join(names)}, mean reload {np.mean(reload_s) * 1000:.1f} ms")
+    print(f"\n{'phase':<12}{'searches':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for phase, samples in latencies.items():
+        if samples:
+            print(f"{phase:<12}{len(samples):>10}{np.percentile(samples, 50):>10.2f}{np.percentile(samples, 99):>10.2f}{max(samples):>10.2f}")
+    print(f"\nserved by version: {dict(versions)}; errors: {dict(errors) or 'none'}; still draining: {[s.version for s in state.draining]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search latency and errors while the index is hot-reloaded between published snapshots")
+    parser.add_argument("--clients", type=int, default=2, help="Concurrent searches, as the EMBED_WORKERS threads run them")
+    parser.add_argument("--reloads", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between reloads")
+    parser.add_argument("--k", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+import os, sys, time, argparse, subprocess
+import numpy as np
+import vector_index
+from bench_startup import wait_for
+from serving import INDEX_PATH, FAISS_MMAP
+from shards import ShardedIndex, LocalShard, RemoteShard
+
+def latency(search, queries, k):
+    """Per-query latencies (ms) of searching the queries one at a time, as /predict does, and the results"""
+    times, ids = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        I = search(q[None, :], k)
+        times.append((time.perf_counter() - t0) * 1000)
+        ids.append(I[0])
+    return np.array(times), np.stack(ids)
+
+def report(label, times, ids, expected):
+    recall = vector_index.recall_at_k(ids, expected)
+    print(f"{label:<44}{np.percentile(times, 50):>10.2f}{np.percentile(times, 99):>10.2f}{recall:>16.3f}")
+
+def main(args):
+    paths = [p for p in vector_index.find_shards(INDEX_PATH) if os.path.exists(p)]
+    if len(paths) < 2:
+        sys.exit(f"Found {len(paths)} shard file(s) for {INDEX_PATH}; ingest with `python ingest.py --shards N` first.")
+    indexes = [vector_index.set_search_params(vector_index.read_index(p, mmap=FAISS_MMAP)) for p in paths]
+    vectors = vector_index.VectorStore(dimension=indexes[0].d).reader()
+    rng = np.random.default_rng(0)
+    ids = np.concatenate([vector_index.stored_ids(ix) for ix in indexes])
+    picks = np.sort(rng.choice(ids, size=min(args.queries, len(ids)), replace=False))
+    queries = np.asarray(vectors[picks]) + rng.standard_normal((len(picks), indexes[0].d), dtype=np.float32) * 0.05
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    print(f"🧪 {len(paths)} shards, {sum(ix.ntotal for ix in indexes)} vectors, {len(queries)} queries, top-{args.k}")
+
+    times, expected = latency(lambda q, k: vector_index.search_shards(indexes, q, k, vectors=vectors)[1], queries, args.k)
+    print(f"\n{'setup':<44}{'p50 ms':>10}{'p99 ms':>10}{'recall vs all':>16}")
+    report("one process, shards one after the other", times, expected, expected)
+    local = ShardedIndex([LocalShard(os.path.basename(p), ix, vectors) for p, ix in zip(paths, indexes)], timeout=args.timeout)
+    times, found = latency(lambda q, k: local.search(q, k)[1], queries, args.k)
+    report("one process, a thread per shard", times, found, expected)
+
+    procs = []
+    try:
+        urls = []
+        for i, path in enumerate(paths):
+            port = args.base_port + i
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "shard_server:app", "--port", str(port), "--log-level", "warning"],
+                env=dict(os.environ, FAISS_SHARD_PATH=path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            urls.append(f"http://127.0.0.1:{port}")
+        for url in urls:
+            if wait_for(url + "/info", lambda r: r.status_code == 200, time.perf_counter() + 60)[0] is None:
+                sys.exit(f"Shard server {url} did not start")
+        remote = ShardedIndex([RemoteShard(url, timeout=args.timeout) for url in urls], timeout=args.timeout)
+        times, found = latency(lambda q, k: remote.search(q, k)[1], queries, args.k)
+        report("a shard server process per shard", times, found, expected)
+
+        # one shard server gone: answers come from the others, flagged as partial
+        procs[-1].terminate()
+        procs[-1].wait()
+        left_out = set()
+        def partial(q, k):
+            _, I, missing = remote.search(q, k)
+            left_out.update(missing)
+            return I
+        times, found = latency(partial, queries, args.k)
+        report(f"shard servers, {os.path.basename(paths[-1])} down", times, found, expected)
+        print(f"\n⚠️ left out: {sorted(left_out)}; {remote.stats()['partial_searches']} partial searches")
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scatter-gather search over index shards: sequential, threads, and local shard-server processes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--base-port", type=int, default=8101, help="Shard servers listen on consecutive ports from here")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Per-shard timeout in seconds")
+    main(parser.parse_args())
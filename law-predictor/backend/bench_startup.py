@@ -0,0 +1,48 @@
+import sys, time, argparse, subprocess
+import requests
+
+def wait_for(url, ok, deadline):
+    """Poll `url` until ok(response) or the deadline; returns seconds waited or None"""
+    t0 = time.perf_counter()
+    while time.perf_counter() < deadline:
+        try:
+            r = requests.get(url, timeout=1)
+            if ok(r):
+                return time.perf_counter() - t0, r
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    return None, None
+
+def main(args):
+    base = f"http://127.0.0.1:{args.port}"
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"]
+    results = []
+    for run in range(args.runs):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd)
+        try:
+            deadline = t0 + args.timeout
+            first, _ = wait_for(base + "/health", lambda r: r.status_code == 200, deadline)
+            ready, resp = wait_for(base + "/ready", lambda r: r.status_code == 200, deadline)
+            ready_total = (time.perf_counter() - t0) if ready is not None else None
+            results.append((first, ready_total, resp.json() if resp is not None else None))
+            if ready_total is None:
+                print(f"run {run + 1}: did not become ready within {args.timeout}s")
+            else:
+                print(f"run {run + 1}: first /health after {first:.2f}s, /ready after {ready_total:.2f}s")
+        finally:
+            proc.terminate()
+            proc.wait()
+    done = [r for r in results if r[1] is not None]
+    if done:
+        print(f"\n⏱️ time to first request: {min(r[0] for r in done):.2f}s (best of {len(done)})")
+        print(f"⏱️ time to ready:         {min(r[1] for r in done):.2f}s (best of {len(done)})")
+        print(f"   warm-up stages of the last run: {done[-1][2]['timings_s']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start timings of the backend: first /health answer and /ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=180)
+    main(parser.parse_args())
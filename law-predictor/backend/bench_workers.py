@@ -0,0 +1,76 @@
+import os, sys, time, argparse, subprocess
+import requests
+from bench_startup import wait_for
+
+def children(pid):
+    """PIDs of the direct children of `pid` (the worker processes)"""
+    out = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as fh:
+                    if int(fh.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        out.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return sorted(out)
+
+def memory(pid):
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        fields = {line.split(":")[0]: int(line.split()[1]) for line in fh if line.endswith("kB\n")}
+    return fields.get("Rss", 0) / 1024, fields.get("Pss", 0) / 1024
+
+def measure(label, cmd, env, args):
+    base = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.perf_counter() + args.timeout
+        waited, _ = wait_for(base + "/ready", lambda r: r.status_code == 200, deadline)
+        if waited is None:
+            print(f"{label}: not ready within {args.timeout}s")
+            return None
+        # every worker has to finish loading and then search a few times, touching the index pages
+        for i in range(args.requests):
+            while time.perf_counter() < deadline:
+                try:
+                    if requests.post(base + "/predict", json={"question": f"punishment for theft case {i}"}, timeout=60).status_code != 503:
+                        break
+                except requests.RequestException:
+                    pass
+                time.sleep(0.2)
+        time.sleep(1)
+        workers = children(proc.pid)
+        rows = [(pid, *memory(pid)) for pid in workers]
+        master = memory(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"\n{label}")
+    print(f"{'process':<16}{'RSS MB':>10}{'PSS MB':>10}")
+    print(f"{'master':<16}{master[0]:>10.1f}{master[1]:>10.1f}")
+    for pid, rss, pss in rows:
+        print(f"{'worker ' + str(pid):<16}{rss:>10.1f}{pss:>10.1f}")
+    total = master[1] + sum(r[2] for r in rows)
+    print(f"{'total PSS':<16}{'':>10}{total:>10.1f}")
+    return total
+
+def main(args):
+    env = dict(os.environ)
+    before = measure(
+        f"uvicorn --workers {args.workers}, index read into memory, each worker loads its own copy",
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        dict(env, FAISS_MMAP="0", SERVE_PRELOAD="0"), args)
+    after = measure(
+        f"gunicorn preload, {args.workers} workers, index memory-mapped",
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers), "main:app"],
+        dict(env, FAISS_MMAP="1", SERVE_PRELOAD="1"), args)
+    if before and after:
+        print(f"\n📉 node memory (sum of PSS): {before:.0f} MB -> {after:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-worker RSS/PSS of multi-worker serving, separate loads vs preloaded + memory-mapped")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--requests", type=int, default=20, help="/predict calls to spread over the workers before measuring")
+    parser.add_argument("--timeout", type=float, default=300)
+    main(parser.parse_args())
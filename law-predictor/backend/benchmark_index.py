@@ -0,0 +1,114 @@
+import os, json, time, argparse
+import faiss
+import numpy as np
+import vector_index
+
+INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index/index.faiss")
+
+def load_corpus_vectors(path):
+    """Exact vectors of an ingested index, from the on-disk vector store when there is one"""
+    index = faiss.read_index(path)
+    mm = vector_index.VectorStore(dimension=index.d).reader()
+    if mm is not None and hasattr(index, "id_map"):
+        ids = np.sort(vector_index.stored_ids(index))
+        if len(ids) and ids[-1] < len(mm):
+            return np.asarray(mm[ids])
+    sub = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    ivf = faiss.try_extract_index_ivf(sub)
+    if ivf is not None:
+        ivf.make_direct_map()
+    if vector_index.describe(index) in vector_index.COMPRESSED_TYPES:
+        print("⚠️ Corpus index is compressed and has no vector store; the ground truth uses its decoded vectors")
+    return sub.reconstruct_n(0, sub.ntotal)
+
+class RerankedIndex:
+    """Search adaptor: compressed-index candidates re-ranked against the exact vectors"""
+    def __init__(self, index, vectors, factor):
+        self.index, self.vectors, self.factor = index, vectors, factor
+
+    def search(self, queries, k):
+        return vector_index.search(self.index, queries, k, vectors=self.vectors, rerank_factor=self.factor)
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+def benchmark(index, queries, truth, k):
+    """Single-query searches, like /predict does. Returns recall@k and latency percentiles."""
+    latencies, hits = [], 0
+    for qi in range(len(queries)):
+        t0 = time.perf_counter()
+        _, I = index.search(queries[qi:qi + 1], k)
+        latencies.append(time.perf_counter() - t0)
+        hits += len(set(I[0].tolist()) & set(truth[qi].tolist()))
+    return {
+        "recall@k": hits / (len(queries) * k),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+def main(args):
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        xb = rng.standard_normal((args.synthetic, args.dim), dtype=np.float32)
+    else:
+        xb = load_corpus_vectors(args.index)
+    xb = np.ascontiguousarray(xb, dtype="float32")
+    n, d = xb.shape
+    # Queries: corpus vectors with noise added, so the nearest neighbour is not trivially itself
+    picks = rng.choice(n, size=min(args.queries, n), replace=False)
+    xq = xb[picks] + rng.standard_normal((len(picks), d), dtype=np.float32) * args.noise * xb.std()
+    xq = np.ascontiguousarray(xq, dtype="float32")
+    ids = np.arange(n, dtype="int64")
+    print(f"📐 {n} vectors x {d} dims, {len(xq)} queries, k={args.k}")
+
+    flat = vector_index.build_index(d, vector_index.index_spec("flat"))
+    flat.add_with_ids(xb, ids)
+    _, truth = flat.search(xq, args.k)
+
+    results = {"flat": benchmark(flat, xq, truth, args.k)}
+    for kind in args.types:
+        spec = vector_index.fit_spec(vector_index.index_spec(kind, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m), n)
+        index = vector_index.build_index(d, spec)
+        t0 = time.perf_counter()
+        if not index.is_trained:
+            sample = xb[rng.choice(n, size=min(n, vector_index.train_size(spec)), replace=False)]
+            index.train(sample)
+        index.add_with_ids(xb, ids)
+        build_s = time.perf_counter() - t0
+        sweep = list(zip(args.nprobe, args.ef_search))
+        if not (kind.startswith("ivf") or kind == "hnsw"):
+            sweep = sweep[:1]  # nothing to tune at search time
+        for nprobe, ef in sweep:
+            vector_index.set_search_params(index, nprobe=nprobe, ef_search=ef)
+            label = vector_index.factory_string(spec)
+            label += f" nprobe={nprobe}" if kind.startswith("ivf") else f" efSearch={ef}" if kind == "hnsw" else ""
+            results[label] = dict(benchmark(index, xq, truth, args.k), build_s=build_s)
+            if kind in vector_index.COMPRESSED_TYPES and args.rerank_factor > 0:
+                reranked = RerankedIndex(index, xb, args.rerank_factor)
+                results[label + " +rerank"] = dict(benchmark(reranked, xq, truth, args.k), build_s=build_s)
+
+    print(f"\n{'index':<40}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, r in results.items():
+        print(f"{label:<40}{r['recall@k']:>10.3f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k and query latency of ANN index types against exact flat search")
+    parser.add_argument("--index", default=INDEX_PATH, help="Ingested index to take the corpus vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N random vectors instead")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--types", nargs="+", default=["ivf_flat", "ivf_pq", "hnsw", "sq8"], choices=vector_index.INDEX_TYPES[1:])
+    parser.add_argument("--rerank-factor", type=int, default=vector_index.RERANK_FACTOR,
+                        help="Also report compressed types re-ranked exactly over k * factor candidates (0 = off)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=vector_index.IVF_NLIST)
+    parser.add_argument("--pq-m", type=int, default=vector_index.PQ_M)
+    parser.add_argument("--hnsw-m", type=int, default=vector_index.HNSW_M)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64], help="IVF nprobe values to sweep")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256], help="HNSW efSearch values, paired with --nprobe")
+    parser.add_argument("--json", help="Also write the results to this file")
+    main(parser.parse_args())
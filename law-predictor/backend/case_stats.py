@@ -0,0 +1,126 @@
+import os
+import csv
+import re
+
+# Historical case statistics (case.txt), shared by main.py and predictor.py
+CASE_DATA_PATH = os.getenv("CASE_DATA_PATH", "./data/judgments/case.txt")
+
+def load_case_data():
+    """Load case data from case.txt file"""
+    case_data = []
+    case_file_path = CASE_DATA_PATH
+    
+    if os.path.exists(case_file_path):
+        try:
+            with open(case_file_path, 'r', encoding='utf-8') as f:
+                reader = csv.reader(f, delimiter='|')
+                header = next(reader)  # Skip header line
+                
+                for row in reader:
+                    if len(row) >= 5:
+                        case_data.append({
+                            'case_id': row[0].strip(),
+                            'case_type': row[1].strip(),
+                            'ipc_section': row[2].strip(),
+                            'winning_percentage': float(row[3].strip()),
+                            'outcome': row[4].strip()
+                        })
+            print(f"✅ Loaded {len(case_data)} case records from case.txt")
+        except Exception as e:
+            print(f"⚠️ Error loading case data: {e}")
+    else:
+        print(f"⚠️ Case data file not found at {case_file_path}")
+    
+    return case_data
+
+def find_relevant_cases(query, case_data, max_results=5):
+    """Find cases relevant to the user's query"""
+    query_lower = query.lower()
+    relevant_cases = []
+    
+    # Define keywords and their associated IPC sections
+    keywords_map = {
+        'fraud': ['420'], 'cheating': ['420'], 'dishonesty': ['420'],
+        'murder': ['302'], 'homicide': ['302'], 'killing': ['302'],
+        'false evidence': ['193'], 'perjury': ['193'], 'lying': ['193'],
+        'dowry': ['498a'], 'harassment': ['498a'], 'cruelty': ['498a'],
+        'rape': ['376'], 'sexual assault': ['376'],
+        'attempt to murder': ['307'], 'attempted murder': ['307'],
+        'assault': ['323', '324'], 'beating': ['323'], 'hurt': ['323', '324'],
+        'theft': ['379'], 'stealing': ['379'],
+        'breach of trust': ['406']
+    }
+    
+    for case in case_data:
+        relevance_score = 0
+        case_section = case['ipc_section'].lower()
+        case_type = case['case_type'].lower()
+        
+        # Direct IPC section matching
+        ipc_numbers = re.findall(r'\b(\d{2,3}[a-z]*)\b', query_lower)
+        for number in ipc_numbers:
+            if number in case_section:
+                relevance_score += 20
+        
+        # Keyword matching
+        for keyword, sections in keywords_map.items():
+            if keyword in query_lower:
+                for section in sections:
+                    if section in case_section:
+                        relevance_score += 15
+        
+        # Case type matching
+        if any(ctype in query_lower for ctype in ['civil', 'criminal']):
+            if any(ctype in case_type for ctype in ['civil', 'criminal'] if ctype in query_lower):
+                relevance_score += 10
+        
+        if relevance_score > 0:
+            case_with_score = case.copy()
+            case_with_score['relevance_score'] = relevance_score
+            relevant_cases.append(case_with_score)
+    
+    # Sort by relevance and return top results
+    relevant_cases.sort(key=lambda x: x['relevance_score'], reverse=True)
+    return relevant_cases[:max_results]
+
+def generate_case_context(relevant_cases):
+    """Generate context string from relevant cases"""
+    if not relevant_cases:
+        return ""
+    
+    context = "\n\n📊 **Historical Case Data Analysis:**\n"
+    
+    # Group cases by IPC section
+    section_stats = {}
+    for case in relevant_cases:
+        section = case['ipc_section']
+        if section not in section_stats:
+            section_stats[section] = []
+        section_stats[section].append(case)
+    
+    for section, cases in section_stats.items():
+        avg_winning = sum(case['winning_percentage'] for case in cases) / len(cases)
+        favorable_count = len([c for c in cases if c['outcome'] == 'Favorable'])
+        
+        context += f"\n🔹 **{section}** ({len(cases)} cases):\n"
+        context += f"   • Average Success Rate: **{avg_winning:.1f}%**\n"
+        context += f"   • Favorable Outcomes: {favorable_count}/{len(cases)}\n"
+    
+    # Overall statistics
+    total_cases = len(relevant_cases)
+    overall_avg = sum(case['winning_percentage'] for case in relevant_cases) / total_cases
+    
+    context += f"\n📈 **Overall Analysis** ({total_cases} similar cases):\n"
+    context += f"   • Combined Success Rate: **{overall_avg:.1f}%**\n"
+    
+    # Recommendation
+    if overall_avg >= 70:
+        recommendation = "🟢 **High probability of success**"
+    elif overall_avg >= 50:
+        recommendation = "🟡 **Moderate chances of success**"
+    else:
+        recommendation = "🔴 **Lower probability of success**"
+    
+    context += f"   • Recommendation: {recommendation}\n"
+    
+    return context
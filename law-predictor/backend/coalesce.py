@@ -0,0 +1,93 @@
+import asyncio
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+        # streamed flights: pieces so far, and an event set whenever one is added or it ends
+        self.pieces = []
+        self.finished = False
+        self.error = None
+        self.wake = asyncio.Event()
+
+    def notify(self):
+        self.wake.set()
+        self.wake = asyncio.Event()
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work: while a call for a key is in flight, further callers
+    with the same key wait for its result instead of starting their own. The shared work is
+    only cancelled when every caller waiting on it has gone away.
+    """
+    def __init__(self):
+        self._flights = {}
+        self.leaders = self.followers = 0
+
+    def _join(self, key, start):
+        flight = self._flights.get(key)
+        if flight is None or flight.task.done():
+            flight = _Flight(None)
+            flight.task = asyncio.ensure_future(start(flight))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._flights.pop(key, None) if self._flights.get(key) is flight else None)
+            self.leaders += 1
+        else:
+            self.followers += 1
+        flight.waiters += 1
+        return flight
+
+    def _leave(self, flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+
+    async def do(self, key, fn):
+        """Result of `await fn()`, shared with concurrent callers of the same key"""
+        flight = self._join(key, lambda _: fn())
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    async def stream(self, key, gen_fn):
+        """
+        Pieces of the async generator `gen_fn()`, shared with concurrent callers of the same
+        key. A caller joining late first gets the pieces it missed, so all see the same sequence.
+        """
+        flight = self._join(key, lambda f: self._produce(f, gen_fn))
+        try:
+            i = 0
+            while True:
+                while i < len(flight.pieces):
+                    yield flight.pieces[i]
+                    i += 1
+                if flight.finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wake.wait()
+        finally:
+            self._leave(flight)
+
+    @staticmethod
+    async def _produce(flight, gen_fn):
+        try:
+            async for piece in gen_fn():
+                flight.pieces.append(piece)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = ConnectionAbortedError("shared stream cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.finished = True
+            flight.notify()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._flights),
+            "started": self.leaders,
+            "coalesced": self.followers,
+        }
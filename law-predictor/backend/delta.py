@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+import numpy as np
+from filters import matches
+
+# Vector IDs of uploaded chunks start here, far above any ID ingest.py hands out
+DELTA_ID_BASE = 1 << 62
+# Where the process that indexed an upload saves its chunks, so the other server processes,
+# and this one after a restart, load them instead of extracting and embedding the file again
+DELTA_DIR = os.path.join(os.getenv("UPLOAD_DIR", "./data/uploads"), ".delta")
+
+class DeltaIndex:
+    """
+    Vectors of uploaded documents that no published snapshot holds yet, searched exactly next
+    to the snapshot. Writers replace the arrays rather than growing them in place, so a search
+    reads a consistent set of vectors without taking a lock. Each document's chunks are also
+    saved under `directory` until a snapshot holds it.
+    """
+    def __init__(self, directory=DELTA_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()  # between writers
+        self._data = (np.empty((0, 0), dtype="float32"), np.empty(0, dtype="int64"))
+        self.rows = {}  # vid -> metadata row, text included
+        self.sources = {}  # sha256 of the uploaded file -> its vids
+        self.next_id = DELTA_ID_BASE
+        self.generation = 0  # changes with every add or drop; part of the search cache key
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def __contains__(self, sha):
+        return sha in self.sources
+
+    def add(self, sha, rows, vectors):
+        """Add the chunks of one document: metadata rows and their embeddings, in the same order"""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            ids = np.arange(self.next_id, self.next_id + len(rows), dtype="int64")
+            self.next_id += len(rows)
+            for vid, row in zip(ids.tolist(), rows):
+                self.rows[vid] = dict(row, vid=vid)
+            old, old_ids = self._data
+            self._data = (np.concatenate([old.reshape(-1, vectors.shape[1]), vectors]), np.concatenate([old_ids, ids]))
+            self.sources[sha] = ids
+            self.generation += 1
+        return ids
+
+    def _path(self, sha):
+        return os.path.join(self.directory, sha + ".npz")
+
+    def save(self, sha, rows, vectors):
+        """Write one document's rows and embeddings where load() finds them"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._path(sha)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            np.savez(fh, vectors=np.asarray(vectors, dtype="float32"), rows=np.array(json.dumps(rows, ensure_ascii=False)))
+        os.replace(tmp, self._path(sha))
+
+    def load(self, sha):
+        """(rows, vectors) saved for a document, or None when no process has indexed it yet"""
+        try:
+            with np.load(self._path(sha)) as data:
+                return json.loads(str(data["rows"])), data["vectors"]
+        except FileNotFoundError:
+            return None
+
+    def drop(self, shas):
+        """Forget the documents with these hashes (a snapshot now holds them). Returns how many."""
+        with self._lock:
+            shas = [sha for sha in shas if sha in self.sources]
+            if not shas:
+                return 0
+            gone = np.concatenate([self.sources.pop(sha) for sha in shas])
+            vectors, ids = self._data
+            keep = ~np.isin(ids, gone)
+            self._data = (vectors[keep], ids[keep])
+            for vid in gone.tolist():
+                del self.rows[vid]
+            self.generation += 1
+        for sha in shas:
+            self.remove_saved(sha)
+        return len(shas)
+
+    def remove_saved(self, sha):
+        """Delete what save() wrote for a document, once a snapshot holds it"""
+        try:
+            os.remove(self._path(sha))
+        except FileNotFoundError:
+            pass  # another process removed it first
+
+    def get(self, vid, default=None):
+        return self.rows.get(vid, default)
+
+    def search(self, queries, k, spec=None):
+        """(D, I) of the exact top-k, squared L2 like the index, among the vectors `spec` allows"""
+        import faiss
+        vectors, ids = self._data
+        if spec:
+            allowed = np.array([matches(spec, self.rows.get(vid, {})) for vid in ids.tolist()], dtype=bool)
+            vectors, ids = vectors[allowed], ids[allowed]
+        D = np.full((len(queries), k), np.inf, dtype="float32")
+        I = np.full((len(queries), k), -1, dtype="int64")
+        if len(ids):
+            d, i = faiss.knn(np.ascontiguousarray(queries, dtype="float32"), np.ascontiguousarray(vectors), min(k, len(ids)))
+            D[:, :d.shape[1]] = d
+            I[:, :i.shape[1]] = np.where(i >= 0, ids[np.maximum(i, 0)], -1)
+        return D, I
+
+    def stats(self):
+        return {"documents": len(self.sources), "vectors": len(self), "generation": self.generation}
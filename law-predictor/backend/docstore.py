@@ -0,0 +1,148 @@
+import os
+import json
+import mmap
+import numpy as np
+
+# Extracted document text, one UTF-8 file per source content hash.
+# Metadata rows point into it with byte offsets instead of carrying a copy of the chunk.
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", "./faiss_index/texts")
+
+def text_path(doc):
+    return os.path.join(TEXT_STORE_DIR, doc + ".txt")
+
+def write_text(doc, text):
+    """Store a document's text under its content hash (no-op if it is already stored)"""
+    path = text_path(doc)
+    if os.path.exists(path):
+        return path
+    os.makedirs(TEXT_STORE_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+    return path
+
+def open_text(doc):
+    """Memory-map a stored document read-only. The caller closes the returned mmap."""
+    with open(text_path(doc), "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_span(doc, start, end):
+    with open(text_path(doc), "rb") as fh:
+        fh.seek(start)
+        return fh.read(end - start).decode("utf-8", errors="replace")
+
+def with_text(row, limit=2000):
+    """Return the row with its chunk text filled in from the text store"""
+    if "text" in row or "doc" not in row:
+        return row
+    row = dict(row)
+    try:
+        row["text"] = read_span(row["doc"], row["start"], row["end"])[:limit]
+    except OSError:
+        row["text"] = ""
+    return row
+
+def remove_unreferenced(keep):
+    """Delete stored documents whose hash is not in `keep`. Returns how many were removed."""
+    if not os.path.isdir(TEXT_STORE_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(TEXT_STORE_DIR):
+        if name.endswith(".txt") and name[:-4] not in keep:
+            os.remove(os.path.join(TEXT_STORE_DIR, name))
+            removed += 1
+    return removed
+
+# --- Metadata store ---
+# docs_meta.jsonl stays the source of truth; docs_meta.offsets.npy holds (vid, byte offset)
+# pairs sorted by vid plus a (max int64, file size) sentinel row, so a reader can memory-map
+# both and decode only the rows a query returns.
+_SENTINEL = np.iinfo(np.int64).max
+
+def offsets_path(meta_path):
+    return os.path.splitext(meta_path)[0] + ".offsets.npy"
+
+def write_meta(meta_path, rows):
+    """Write {vid: row} as JSONL plus its offsets index, each through a temp file and rename"""
+    offsets, pos = [], 0
+    tmp = meta_path + ".tmp"
+    with open(tmp, "wb") as fh:
+        for vid, row in rows.items():
+            line = (json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8")
+            offsets.append((vid, pos))
+            fh.write(line)
+            pos += len(line)
+        fh.flush()
+        os.fsync(fh.fileno())
+    table = np.array(sorted(offsets) + [(_SENTINEL, pos)], dtype=np.int64).reshape(-1, 2)
+    otmp = offsets_path(meta_path) + ".tmp"
+    with open(otmp, "wb") as fh:
+        np.save(fh, table)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, meta_path)
+    os.replace(otmp, offsets_path(meta_path))
+
+class MetaStore:
+    """
+    Read-only view of docs_meta.jsonl keyed by vector ID. The file and its offsets index
+    are memory-mapped; a row is only JSON-decoded when it is looked up.
+    """
+    def __init__(self, meta_path):
+        self.path = meta_path
+        self._fh = open(meta_path, "rb")
+        size = os.fstat(self._fh.fileno()).st_size
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        table = None
+        opath = offsets_path(meta_path)
+        if os.path.exists(opath):
+            table = np.load(opath, mmap_mode="r")
+            if len(table) == 0 or table[-1, 0] != _SENTINEL or table[-1, 1] != size:
+                print(f"⚠️ {opath} does not match {meta_path}; rebuilding the offsets in memory.")
+                table = None
+        if table is None:
+            table = self._scan()
+        self._vids = table[:-1, 0]
+        self._offsets = table[:-1, 1]
+
+    def _scan(self):
+        # Rows written before vector IDs existed are keyed by line position
+        offsets, pos, size = [], 0, len(self._mm)
+        for i in range(size):
+            if pos >= size:
+                break
+            end = self._mm.find(b"\n", pos)
+            end = size if end == -1 else end
+            offsets.append((json.loads(self._mm[pos:end]).get("vid", i), pos))
+            pos = end + 1
+        return np.array(sorted(offsets) + [(_SENTINEL, size)], dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self._vids)
+
+    def _locate(self, vid):
+        i = int(np.searchsorted(self._vids, vid))
+        if i < len(self._vids) and self._vids[i] == vid:
+            return int(self._offsets[i])
+        return None
+
+    def __contains__(self, vid):
+        return self._locate(int(vid)) is not None
+
+    def get(self, vid, default=None):
+        off = self._locate(int(vid))
+        if off is None:
+            return default
+        end = self._mm.find(b"\n", off)
+        return json.loads(self._mm[off:end if end != -1 else len(self._mm)])
+
+    def get_many(self, ids):
+        """Rows for the given IDs in order, skipping IDs that are unknown (e.g. -1 padding)"""
+        rows = (self.get(vid) for vid in ids if vid >= 0)
+        return [row for row in rows if row is not None]
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+        self._fh.close()
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import datetime
+import numpy as np
+from cache import TTLCache
+
+# Metadata filters for /predict. ingest.py records each source file's attributes (document type,
+# court, judgment date) in the manifest and writes them out as ID sets next to the index: one
+# bitmap over vector IDs per attribute value, plus (date, ID) pairs sorted by date for ranges.
+# A filtered search hands FAISS the bitmap of the allowed IDs, so it never scores the others;
+# selections of at most FILTER_EXACT_MAX vectors are scanned exactly over the memory-mapped vectors.
+FILTERS_PATH = os.getenv("FAISS_FILTERS_PATH", "./faiss_index/filters.json")
+FILTER_EXACT_MAX = int(os.getenv("FILTER_EXACT_MAX", "10000"))  # scanning more costs more than the selector
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "256"))  # selections kept, keyed by filter
+HIGH_COURTS = (
+    "allahabad", "andhra pradesh", "bombay", "calcutta", "chhattisgarh", "delhi", "gauhati", "gujarat",
+    "himachal pradesh", "jammu and kashmir", "jharkhand", "karnataka", "kerala", "madhya pradesh", "madras",
+    "manipur", "meghalaya", "orissa", "patna", "punjab and haryana", "rajasthan", "sikkim", "telangana",
+    "tripura", "uttarakhand",
+)
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+_DATE_RES = (
+    (re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?(?:\s+day\s+of)?[\s.,-]+" + _MONTH + r"[\s.,-]+(\d{4})\b"), "dmy"),
+    (re.compile(r"\b" + _MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b"), "mdy"),
+    (re.compile(r"\b(\d{1,2})[./-](\d{1,2})[./-](\d{4})\b"), "numeric"),  # day first, as Indian courts write it
+)
+_DATE_LABEL = re.compile(r"(date of (?:the )?(?:judgment|decision|order)|decided on|pronounced on|judgment dated|dated)")
+HEAD_CHARS = 3000  # court and date are read from the start of a document only
+
+def doc_type_of(path):
+    """'statute' or 'judgment' from the data directory a file is under, else None"""
+    for part in os.path.normpath(path).lower().split(os.sep)[:-1]:
+        if "statute" in part:
+            return "statute"
+        if "judg" in part:
+            return "judgment"
+    return None
+
+_COURT_RES = [(re.compile(r"\bsupreme court\b"), "supreme court")] + [
+    (re.compile(rf"\bhigh court of (?:judicature (?:at|for) )?{name}\b|\b{name} high court\b"), f"{name} high court")
+    for name in HIGH_COURTS
+] + [(re.compile(r"\b(?:district|sessions) court\b|\bcourt of (?:the )?sessions\b"), "district court")]
+
+def court_of(text):
+    """
+    Canonical name of the court a judgment's header names: 'supreme court', 'delhi high court',
+    ... The court named first wins, as judgments go on to cite other courts.
+    """
+    head = " ".join(re.sub(r"[^a-z]+", " ", text[:HEAD_CHARS].lower()).split())
+    found = [(m.start(), court) for regex, court in _COURT_RES for m in [regex.search(head)] if m]
+    return min(found)[1] if found else None
+
+def _parse(m, kind):
+    try:
+        if kind == "dmy":
+            return datetime.date(int(m.group(3)), _MONTHS.index(m.group(2)) + 1, int(m.group(1)))
+        if kind == "mdy":
+            return datetime.date(int(m.group(3)), _MONTHS.index(m.group(1)) + 1, int(m.group(2)))
+        return datetime.date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+    except ValueError:
+        return None
+
+def date_of(text):
+    """The judgment date: the first date after a 'dated' / 'decided on' label, else the first date at all"""
+    head = text[:HEAD_CHARS].lower()
+    found = []
+    for regex, kind in _DATE_RES:
+        for m in regex.finditer(head):
+            day = _parse(m, kind)
+            if day is not None and 1860 <= day.year <= datetime.date.today().year + 1:
+                found.append((m.start(), day))
+    if not found:
+        return None
+    found.sort()
+    labels = [m.end() for m in _DATE_LABEL.finditer(head)]
+    for pos, day in found:
+        if any(0 <= pos - end <= 40 for end in labels):
+            return day.isoformat()
+    return found[0][1].isoformat()
+
+def doc_attributes(path, text):
+    """The filterable attributes of a source document; attributes that cannot be told are left out"""
+    attrs = {"type": doc_type_of(path)}
+    if attrs["type"] != "statute":
+        attrs["court"] = court_of(text)
+        attrs["date"] = date_of(text)
+    return {k: v for k, v in attrs.items() if v}
+
+def filter_spec(doc_type=None, court=None, date_from=None, date_to=None):
+    """Normalized filter of a query, or None when it has no filter"""
+    spec = {
+        "doc_type": doc_type,
+        "court": " ".join(court.lower().split()) if court else None,
+        "date_from": date_from.isoformat() if isinstance(date_from, datetime.date) else date_from,
+        "date_to": date_to.isoformat() if isinstance(date_to, datetime.date) else date_to,
+    }
+    spec = {k: v for k, v in spec.items() if v}
+    return spec or None
+
+def matches(spec, attrs):
+    """Whether a document with these attributes passes the filter; the rules of FilterIndex.select()"""
+    if spec.get("doc_type") and attrs.get("type") != spec["doc_type"]:
+        return False
+    if spec.get("court") and spec["court"] not in (attrs.get("court") or ""):
+        return False
+    if spec.get("date_from") or spec.get("date_to"):
+        day = attrs.get("date")
+        if not day or day < spec.get("date_from", day) or day > spec.get("date_to", day):
+            return False
+    return True
+
+def spec_key(spec):
+    return json.dumps(spec, sort_keys=True) if spec else ""
+
+def _paths(path):
+    root = os.path.splitext(path)[0]
+    return root + ".bits.npy", root + ".dates.npy"
+
+def filter_paths(path=FILTERS_PATH):
+    """All files of the filter index at `path`"""
+    return [path, *_paths(path)]
+
+def _save_npy(path, array):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, array)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+def write_filters(path, files, n_ids):
+    """
+    Write the ID sets of the attributes of `files` ({source path: manifest file record}) for
+    vector IDs below n_ids. A vector shared by several files (a duplicate chunk) is in the sets
+    of all of them. The bitmaps and date table go first and the JSON header last, each through
+    a temp file and a rename.
+    """
+    sets, dated = {}, []
+    for rec in files.values():
+        attrs = rec.get("attrs") or {}
+        ids = np.asarray(rec["ids"], dtype=np.int64)
+        if len(ids) == 0:
+            continue
+        for attr in ("type", "court"):
+            if attrs.get(attr):
+                sets.setdefault(f"{attr}={attrs[attr]}", []).append(ids)
+        if attrs.get("date"):
+            day = datetime.date.fromisoformat(attrs["date"]).toordinal()
+            dated.append(np.stack([np.full(len(ids), day, dtype=np.int64), ids], axis=1))
+    keys = sorted(sets)
+    bits = np.zeros((len(keys), (n_ids + 7) // 8), dtype=np.uint8)
+    counts = {}
+    for row, key in enumerate(keys):
+        mask = np.zeros(n_ids, dtype=bool)
+        mask[np.concatenate(sets[key])] = True
+        bits[row] = np.packbits(mask, bitorder="little")  # the bit order faiss.IDSelectorBitmap reads
+        counts[key] = int(mask.sum())
+    dates = np.concatenate(dated) if dated else np.empty((0, 2), dtype=np.int64)
+    dates = dates[np.lexsort((dates[:, 1], dates[:, 0]))]
+    bits_path, dates_path = _paths(path)
+    _save_npy(bits_path, bits)
+    _save_npy(dates_path, dates)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({"n_ids": n_ids, "keys": keys, "counts": counts, "dated": len(dates)}, fh, ensure_ascii=False)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+class Selection:
+    """The vector IDs a filter allows: sorted, and as the bitmap FAISS tests while it searches"""
+    def __init__(self, spec, mask):
+        self.spec = spec
+        self.ids = np.flatnonzero(mask).astype(np.int64)
+        self.n_ids = len(mask)
+        self.bitmap = np.packbits(mask, bitorder="little")
+        self._selector = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def selector(self):
+        # the selector points into self.bitmap, which lives as long as this object. Its n is the
+        # bitmap's length in bytes: is_member(id) reads byte id >> 3 only while that is below n
+        if self._selector is None:
+            import faiss
+            self._selector = faiss.IDSelectorBitmap(len(self.bitmap), faiss.swig_ptr(self.bitmap))
+        return self._selector
+
+class FilterIndex:
+    """Read-only view of the ID sets written by write_filters(); bitmaps and dates are memory-mapped"""
+    def __init__(self, path=FILTERS_PATH, cache_size=FILTER_CACHE_SIZE):
+        with open(path, "r", encoding="utf-8") as fh:
+            info = json.load(fh)
+        bits_path, dates_path = _paths(path)
+        self.n_ids, self.counts = info["n_ids"], info["counts"]
+        self.rows = {key: i for i, key in enumerate(info["keys"])}
+        self.bits = np.load(bits_path, mmap_mode="r")
+        self.dates = np.load(dates_path, mmap_mode="r")
+        self._cache = TTLCache(cache_size)
+
+    def values(self, attr):
+        return sorted(key.split("=", 1)[1] for key in self.rows if key.startswith(attr + "="))
+
+    def _any(self, keys):
+        mask = np.zeros(self.n_ids, dtype=bool)
+        for key in keys:
+            mask |= np.unpackbits(self.bits[self.rows[key]], count=self.n_ids, bitorder="little").astype(bool)
+        return mask
+
+    def select(self, spec):
+        """
+        Selection of the vectors matching every filter of `spec` (see filter_spec). A court
+        matches every court name containing it ("high court" selects all high courts); a date
+        range only selects vectors of dated documents.
+        """
+        key = spec_key(spec)
+        selection = self._cache.get(key)
+        if selection is not None:
+            return selection
+        mask = np.ones(self.n_ids, dtype=bool)
+        if spec.get("doc_type"):
+            mask &= self._any([k for k in self.rows if k == "type=" + spec["doc_type"]])
+        if spec.get("court"):
+            mask &= self._any([k for k in self.rows if k.startswith("court=") and spec["court"] in k[len("court="):]])
+        if spec.get("date_from") or spec.get("date_to"):
+            lo = datetime.date.fromisoformat(spec["date_from"]).toordinal() if spec.get("date_from") else 0
+            hi = datetime.date.fromisoformat(spec["date_to"]).toordinal() if spec.get("date_to") else np.iinfo(np.int64).max
+            days = self.dates[:, 0]
+            rows = self.dates[np.searchsorted(days, lo, side="left"):np.searchsorted(days, hi, side="right")]
+            in_range = np.zeros(self.n_ids, dtype=bool)
+            in_range[np.asarray(rows[:, 1])] = True
+            mask &= in_range
+        selection = Selection(spec, mask)
+        self._cache.put(key, selection)
+        return selection
+
+    def stats(self):
+        return {
+            "values": {attr: self.values(attr) for attr in ("type", "court")},
+            "vectors": self.counts,
+            "dated_vectors": len(self.dates),
+            "selection_cache": self._cache.stats(),
+        }
+
+def load_filters(path=FILTERS_PATH):
+    """The FilterIndex written by the last ingest, or None for an index ingested without one"""
+    if not os.path.exists(path):
+        return None
+    return FilterIndex(path)
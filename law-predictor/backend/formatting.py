@@ -0,0 +1,179 @@
+import re
+
+def format_response_for_markdown(text):
+    """
+    Post-process the response to ensure proper markdown formatting with line breaks
+    """
+    import re
+    
+    # First, normalize line endings
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    # Split into lines and process
+    lines = text.split('\n')
+    formatted_lines = []
+    
+    for i, line in enumerate(lines):
+        line = line.strip()
+        
+        # Skip empty lines but preserve them
+        if not line:
+            if formatted_lines and formatted_lines[-1] != '':
+                formatted_lines.append('')
+            continue
+            
+        # Add extra spacing around main headings (##)
+        if line.startswith('##'):
+            # Add blank line before heading if previous line isn't empty
+            if formatted_lines and formatted_lines[-1] != '':
+                formatted_lines.append('')
+            formatted_lines.append(line)
+            formatted_lines.append('')  # Add blank line after heading
+            
+        # Add spacing around numbered items (1., 2., etc.)
+        elif re.match(r'^\d+\.', line):
+            # Add blank line before numbered item
+            if formatted_lines and formatted_lines[-1] != '':
+                formatted_lines.append('')
+            formatted_lines.append(line)
+            formatted_lines.append('')  # Add blank line after numbered item
+            
+        # Handle bullet points - indent them
+        elif line.startswith('*') or line.startswith('-'):
+            formatted_lines.append('   ' + line)  # Indent bullet points
+            
+        # Handle regular paragraphs
+        else:
+            formatted_lines.append(line)
+    
+    # Join lines and clean up multiple consecutive empty lines
+    result = '\n'.join(formatted_lines)
+    result = re.sub(r'\n\s*\n\s*\n+', '\n\n', result)  # Replace 3+ newlines with 2
+    
+    return result.strip()
+
+# Disclaimers the model likes to open with, replaced by DISCLAIMER_REPLACEMENT
+# (only the first one found, as /chat always did)
+DISCLAIMERS = [
+    "I cannot provide legal advice, but",
+    "I can't provide legal advice, but", 
+    "I cannot provide legal advice.",
+    "I can't provide legal advice.",
+    "I cannot provide legal advice,",
+    "I can't provide legal advice,",
+    "However, I can offer some general information",
+    "Would that help?",
+    "I cannot provide legal advice. However, I can offer some general information about the Indian Penal Code (IPC)",
+    "I cannot provide legal advice. However,",
+    "However, I can offer some general information about the Indian Penal Code (IPC). Would that help?",
+    "I cannot provide legal advice. However, I can offer some general information about the Indian Penal Code (IPC). Would that help?"
+]
+DISCLAIMER_REPLACEMENT = "Based on historical legal data and case analysis,"
+# Used instead of a short answer without substance when there is case data to show
+FORCED_RESPONSE = "Based on historical legal data and case analysis, here's what the statistics show about similar cases."
+MIN_RESPONSE_CHARS = 200
+FOOTER = "\n\n---\n\n**⚠️ Disclaimer:** This is general legal information based on historical data. Please consult with a qualified lawyer for specific legal advice."
+
+def format_case_header(case_context):
+    """The case statistics section that opens a /chat answer, up to the analysis heading"""
+    formatted_case_context = case_context.replace("📊 **Historical Case Data Analysis:**", "## 📊 **HISTORICAL CASE ANALYSIS**")
+    formatted_case_context = formatted_case_context.replace("**Overall Analysis**", "**Based on")
+    formatted_case_context = formatted_case_context.replace("• Combined Success Rate:", "similar cases, average success rate is")
+    return f"{formatted_case_context}\n\n## 📋 **LEGAL ANALYSIS**\n\n"
+
+def replace_disclaimer(text):
+    """Replace the first of DISCLAIMERS found in text; returns (text, the disclaimer or None)"""
+    for disclaimer in DISCLAIMERS:
+        if disclaimer in text:
+            return text.replace(disclaimer, DISCLAIMER_REPLACEMENT), disclaimer
+    return text, None
+
+def clean_chat_response(raw_response, case_context=""):
+    """
+    The /chat answer body: disclaimer replaced, a short non-answer swapped for
+    FORCED_RESPONSE when there is case data to show, then formatted for markdown
+    """
+    cleaned_response, disclaimer = replace_disclaimer(raw_response)
+    if disclaimer is None and len(cleaned_response) < MIN_RESPONSE_CHARS and case_context:
+        cleaned_response = FORCED_RESPONSE
+    return format_response_for_markdown(cleaned_response)
+
+class MarkdownStream:
+    """
+    clean_chat_response() applied to a token stream. Tokens are buffered until a line is
+    complete; each finished line goes through the same rules, keeping only the state they
+    need: whether anything was written yet, whether a blank line is owed, and which
+    disclaimer is being replaced.
+
+    The joined output equals clean_chat_response() of the joined tokens, with one exception:
+    the disclaimer replaced is the first of DISCLAIMERS found on the earliest line that has
+    one, where /chat takes the first of DISCLAIMERS found anywhere in the answer. The two
+    only differ when an answer contains different disclaimers on different lines.
+
+    With hold_chars, output is held back until that much text has arrived or a disclaimer
+    was replaced, so a short non-answer can still be swapped for FORCED_RESPONSE.
+    """
+    def __init__(self, hold_chars=0):
+        self.hold_chars = hold_chars
+        self.disclaimer = None
+        self.chars = 0
+        self._partial = ""
+        self._started = False
+        self._blank_owed = False
+        self._held = []
+
+    def feed(self, token):
+        """Add streamed text; returns the formatted text that can be sent now"""
+        self.chars += len(token)  # /chat compares the raw length with hold_chars
+        text = self._partial + token
+        # a trailing \r may be the first half of a \r\n split across tokens
+        cr = '\r' if text.endswith('\r') else ''
+        lines = _split_lines(text[:len(text) - len(cr)])
+        self._partial = lines.pop() + cr
+        return self._release(''.join(self._line(line) for line in lines))
+
+    def finish(self):
+        """Flush the last partial line; returns the remaining formatted text"""
+        out = self._release(''.join(self._line(line) for line in _split_lines(self._partial)), final=True)
+        self._partial = ""
+        return out
+
+    def _release(self, text, final=False):
+        if self._held is None:
+            return text
+        self._held.append(text)
+        if self.disclaimer is None and self.chars < self.hold_chars:
+            if not final:
+                return ""
+            self._held = None
+            return format_response_for_markdown(FORCED_RESPONSE)
+        text, self._held = ''.join(self._held), None
+        return text
+
+    def _line(self, line):
+        if self.disclaimer is None:
+            self.disclaimer = next((d for d in DISCLAIMERS if d in line), None)
+        if self.disclaimer is not None:
+            line = line.replace(self.disclaimer, DISCLAIMER_REPLACEMENT)
+        line = line.strip()
+        if not line:
+            self._blank_owed = self._started
+            return ""
+        if line.startswith('##') or re.match(r'^\d+\.', line):
+            out = self._emit(line, blank_before=True)
+            self._blank_owed = True
+            return out
+        if line.startswith('*') or line.startswith('-'):
+            # the final strip() of format_response_for_markdown unindents a leading bullet
+            return self._emit('   ' + line if self._started else line)
+        return self._emit(line)
+
+    def _emit(self, line, blank_before=False):
+        prefix = ""
+        if self._started:
+            prefix = "\n\n" if (self._blank_owed or blank_before) else "\n"
+        self._started, self._blank_owed = True, False
+        return prefix + line
+
+def _split_lines(text):
+    return text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
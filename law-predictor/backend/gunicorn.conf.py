@@ -0,0 +1,12 @@
+import os
+
+# Multi-worker serving: gunicorn -c gunicorn.conf.py main:app
+# The app is imported once in the master (preload_app) with SERVE_PRELOAD=1, which loads the
+# embedding model and the memory-mapped index before the workers are forked, so they share it.
+os.environ.setdefault("SERVE_PRELOAD", "1")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 300  # long LLM generations
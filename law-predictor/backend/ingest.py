@@ -1,18 +1,44 @@
-import os, json, argparse
+import os, json, argparse, glob
 from pathlib import Path
 from tqdm import tqdm
 import pdfplumber
 from bs4 import BeautifulSoup
 import requests
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 import uuid
+import time
+import hashlib
+import re
+import zlib
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import docstore
+import vector_index
+import filters
+import snapshots
 
 EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index/index.faiss")
 META_PATH = os.getenv("DOCS_META_PATH", "./faiss_index/docs_meta.jsonl")
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "./faiss_index/manifest.json")
+MINHASH_PATH = os.getenv("INGEST_MINHASH_PATH", "./faiss_index/minhash.npz")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./data/uploads")  # files added through the server's /upload (uploads.py)
+DATA_DIRS = ["./data/statutes", "./data/judgments", UPLOAD_DIR]
 D = 384  # embedding dimension for MiniLM-L6
+CHUNK_WORDS, CHUNK_OVERLAP = 600, 120  # words per chunk, and words shared with the previous chunk
+BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "128"))
+WORKERS = int(os.getenv("INGEST_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))  # extracted documents waiting to be embedded
+CHECKPOINT_EVERY = float(os.getenv("INGEST_CHECKPOINT_EVERY", "300"))  # seconds between checkpoints
+NEAR_DUP_THRESHOLD = float(os.getenv("DEDUP_NEAR_THRESHOLD", "0.9"))  # estimated Jaccard; 0 disables near-dup dedup
+EVAL_QUERIES = int(os.getenv("INGEST_EVAL_QUERIES", "200"))  # recall check of approximate indexes after ingestion
+# The index can be split into shards, each its own file searched in parallel by the server.
+# A file's chunks all go to one shard: "hash" spreads files by a hash of their path, "source"
+# keeps each data directory (e.g. statutes, judgments) in a shard of its own.
+SHARDS = int(os.getenv("FAISS_SHARDS", "1"))
+SHARD_BY = os.getenv("FAISS_SHARD_BY", "hash")  # hash | source
 
 def ensure_dirs():
     Path(os.path.dirname(INDEX_PATH)).mkdir(parents=True, exist_ok=True)
@@ -37,55 +63,730 @@ def extract_text_from_html(path):
         s.decompose()
     return soup.get_text(separator="\n")
 
+_WORD_RE = re.compile(rb"\S+(\s*)")
+_SENTENCE_END = (b".", b"?", b"!", b";", b":")
+
+def iter_chunk_spans(buf, chunk_size=800, overlap=100, min_fill=0.75):
+    """
+    Stream (start, end) byte offsets of overlapping ~chunk_size-word chunks over UTF-8
+    bytes (or an mmap of them) without copying the text. A chunk is cut at the last
+    sentence end or blank line in its final quarter when there is one, and the next
+    chunk starts at a sentence start inside the overlap when it can.
+    """
+    window = []  # (start, end, ends_sentence) of the words in the current chunk
+    last_end = 0
+    for m in _WORD_RE.finditer(buf):
+        word_end = m.start(1)
+        boundary = buf[word_end - 1:word_end] in _SENTENCE_END or b"\n\n" in m.group(1)
+        window.append((m.start(), word_end, boundary))
+        if len(window) < chunk_size:
+            continue
+        cut = len(window) - 1
+        for i in range(len(window) - 1, int(chunk_size * min_fill) - 1, -1):
+            if window[i][2]:
+                cut = i
+                break
+        yield window[0][0], window[cut][1]
+        last_end = window[cut][1]
+        nxt = max(1, cut + 1 - overlap)
+        for j in range(nxt, cut + 1):
+            if window[j - 1][2]:
+                nxt = j
+                break
+        window = window[nxt:]
+    if window and window[-1][1] > last_end:
+        yield window[0][0], window[-1][1]
+
 def chunk_text(text, chunk_size=800, overlap=100):
-    words = text.split()
-    i, chunks = 0, []
-    while i < len(words):
-        chunk = " ".join(words[i:i+chunk_size])
-        chunks.append(chunk)
-        i += (chunk_size - overlap)
-    return chunks
-
-def create_or_load_index(dimension):
-    if os.path.exists(INDEX_PATH):
-        return faiss.read_index(INDEX_PATH)
-    return faiss.IndexFlatL2(dimension)
-
-def main(data_dirs):
-    ensure_dirs()
-    embedder = SentenceTransformer(EMBED_MODEL)
-    index = create_or_load_index(D)
-    meta_f = open(META_PATH, "a", encoding="utf-8")
+    data = text.encode("utf-8")
+    return [data[a:b].decode("utf-8") for a, b in iter_chunk_spans(data, chunk_size, overlap)]
+
+def normalize_chunk(text):
+    return re.sub(r"\W+", " ", text.lower()).strip()
+
+class ChunkDeduper:
+    """
+    Finds chunks that are already indexed: exact duplicates by a hash of the normalized
+    text, near-duplicates by MinHash signatures over word 5-gram shingles with LSH banding.
+    """
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, num_perm=64, bands=16, shingle=5):
+        self.threshold = threshold
+        self.num_perm, self.bands, self.shingle = num_perm, bands, shingle
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(1)  # fixed so signatures stay comparable across runs
+        self._prime = (1 << 31) - 1
+        self._a = rng.integers(1, self._prime, num_perm, dtype=np.int64)
+        self._b = rng.integers(0, self._prime, num_perm, dtype=np.int64)
+        self.by_hash = {}   # text hash -> vid
+        self.hashes = {}    # vid -> text hash
+        self.sigs = {}      # vid -> MinHash signature
+        self.buckets = {}   # (band, band bytes) -> set of vids
+
+    def fingerprint(self, text):
+        norm = normalize_chunk(text)
+        h = hashlib.sha1(norm.encode("utf-8")).hexdigest()
+        if self.threshold <= 0:
+            return h, None
+        words = norm.split()
+        n = max(1, len(words) - self.shingle + 1)
+        shingles = np.fromiter(
+            (zlib.crc32(" ".join(words[i:i + self.shingle]).encode("utf-8")) for i in range(n)),
+            dtype=np.int64, count=n,
+        )
+        sig = ((np.outer(shingles, self._a) + self._b) % self._prime).min(axis=0).astype(np.uint32)
+        return h, sig
+
+    def _bands(self, sig):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, h, sig):
+        """Return (vid, kind) of an indexed duplicate, or (None, None)"""
+        vid = self.by_hash.get(h)
+        if vid is not None:
+            return vid, "exact"
+        if sig is None:
+            return None, None
+        candidates = set()
+        for key in self._bands(sig):
+            candidates.update(self.buckets.get(key, ()))
+        best, best_sim = None, self.threshold
+        for vid in candidates:
+            sim = float(np.mean(self.sigs[vid] == sig))
+            if sim >= best_sim:
+                best, best_sim = vid, sim
+        return (best, "near") if best is not None else (None, None)
+
+    def add(self, vid, h, sig):
+        self.by_hash.setdefault(h, vid)
+        self.hashes[vid] = h
+        if sig is not None:
+            self.sigs[vid] = sig
+            for key in self._bands(sig):
+                self.buckets.setdefault(key, set()).add(vid)
+
+    def remove(self, vid):
+        h = self.hashes.pop(vid, None)
+        if h is not None and self.by_hash.get(h) == vid:
+            del self.by_hash[h]
+        sig = self.sigs.pop(vid, None)
+        if sig is not None:
+            for key in self._bands(sig):
+                bucket = self.buckets.get(key)
+                if bucket:
+                    bucket.discard(vid)
+                    if not bucket:
+                        del self.buckets[key]
+
+    def load(self, meta_rows):
+        sigs = {}
+        if self.threshold > 0 and os.path.exists(MINHASH_PATH):
+            data = np.load(MINHASH_PATH)
+            if data["sigs"].shape[1:] == (self.num_perm,):
+                sigs = dict(zip(data["ids"].tolist(), data["sigs"]))
+        for vid, row in meta_rows.items():
+            if "hash" in row:
+                self.add(vid, row["hash"], sigs.get(vid))
+
+    def save(self):
+        ids = np.array(list(self.sigs), dtype=np.int64)
+        sigs = np.array(list(self.sigs.values()), dtype=np.uint32).reshape(len(ids), self.num_perm)
+        write_atomic(MINHASH_PATH, lambda fh: np.savez(fh, ids=ids, sigs=sigs), mode="wb")
+
+def source_refs(row):
+    return [row["source_path"]] + row.get("sources", [])
+
+def set_source_refs(row, refs):
+    row["source_path"] = refs[0]
+    if len(refs) > 1:
+        row["sources"] = refs[1:]
+    else:
+        row.pop("sources", None)
+
+def release_source(path, ids, meta_rows, deduper):
+    """
+    Drop `path` as a source of its vectors. Returns the IDs left without any source,
+    which must be removed from the index; shared vectors only lose the reference.
+    """
+    orphaned = []
+    for vid in ids:
+        row = meta_rows.get(vid)
+        refs = [r for r in source_refs(row) if r != path] if row else []
+        if refs:
+            set_source_refs(row, refs)
+            continue
+        meta_rows.pop(vid, None)
+        deduper.remove(vid)
+        orphaned.append(vid)
+    return orphaned
+
+def shard_layout(count=SHARDS, by=SHARD_BY):
+    if by not in ("hash", "source"):
+        raise ValueError(f"Unknown shard partitioning {by!r}, expected hash or source")
+    return {"count": max(1, count), "by": by, "sources": {}}
+
+def manifest_shards(manifest):
+    # manifests written before sharding describe a single index file
+    return manifest.get("shards") or shard_layout(1, "hash")
+
+def shard_for(path, data_dirs, layout):
+    """Shard that the chunks of a file go to"""
+    if layout["count"] == 1:
+        return 0
+    if layout["by"] == "hash":
+        return zlib.crc32(os.path.normpath(path).encode("utf-8")) % layout["count"]
+    source = next((os.path.normpath(d) for d in data_dirs if under_dirs(path, [d])), os.path.dirname(path))
+    sources = layout["sources"]
+    if source not in sources:
+        # a new source goes to the shard holding the fewest sources so far
+        load = [0] * layout["count"]
+        for shard in sources.values():
+            load[shard] += 1
+        sources[source] = load.index(min(load))
+    return sources[source]
+
+def create_or_load_index(dimension, manifest, spec, layout):
+    """Load the existing ID-mapped shard indexes, or return None when they have to be rebuilt"""
+    old = manifest_shards(manifest)
+    paths = vector_index.shard_paths(INDEX_PATH, old["count"])
+    if not any(os.path.exists(p) for p in paths):
+        return None
+    if not os.path.exists(MANIFEST_PATH):
+        print("⚠️ Existing index has no ingest manifest; rebuilding it from scratch.")
+        return None
+    if manifest.get("index", {}).get("type", "flat") != spec["type"]:
+        print(f"⚠️ Index type changed to {spec['type']}; rebuilding it from scratch.")
+        return None
+    if (old["count"], old["by"]) != (layout["count"], layout["by"]):
+        print(f"⚠️ Sharding changed to {layout['count']} shards by {layout['by']}; rebuilding the index from scratch.")
+        return None
+    indexes = []
+    for i, path in enumerate(paths):
+        if not os.path.exists(path):
+            # its files lose their vectors, so reconcile() has them re-ingested into this shard
+            print(f"⚠️ Shard {i} ({path}) is missing; re-ingesting the files it held.")
+            indexes.append(vector_index.build_index(dimension, manifest.get("index", spec)))
+            continue
+        index = faiss.read_index(path)
+        if not hasattr(index, "id_map") or index.d != dimension:
+            print("⚠️ Existing index is not ID-mapped; rebuilding it from scratch.")
+            return None
+        indexes.append(index)
+    return indexes
+
+def rebuild_shard(shard, meta_rows, spec, vectors, train_on=None, block=65536):
+    """
+    Rebuild one shard's index from the exact vectors on disk, without re-extracting or
+    re-embedding anything. Returns None if some of its vectors are not in the vector store.
+    """
+    ids = np.array(sorted(vid for vid, row in meta_rows.items() if row.get("shard", 0) == shard), dtype="int64")
+    mm = vectors.reader()
+    if len(ids) and (mm is None or ids[-1] >= len(mm)):
+        return None
+    writer = vector_index.IndexWriter(vector_index.build_index(D, spec), spec, D, train_on=train_on)
+    for b in range(0, len(ids), block):
+        block_ids = ids[b:b + block]
+        vecs = np.ascontiguousarray(mm[block_ids])
+        if not vecs.any(axis=1).all():
+            return None  # rows that were never written (vectors older than the store)
+        writer.add(vecs, block_ids)
+    return writer.finish()
+
+def remove_from_shards(indexes, ids):
+    """Remove vectors by ID from whichever shards hold them. Returns (indexes, shards changed)."""
+    ids = np.asarray(ids, dtype="int64")
+    changed = set()
+    if len(ids) == 0:
+        return indexes, changed
+    out = []
+    for i, index in enumerate(indexes):
+        mine = ids[np.isin(ids, vector_index.stored_ids(index))]
+        if len(mine):
+            index = vector_index.remove_ids(index, mine)
+            changed.add(i)
+        out.append(index)
+    return out, changed
+
+def remove_other_layouts(count):
+    """Delete index files of a previous shard layout, so the server does not pick them up"""
+    keep = set(vector_index.shard_paths(INDEX_PATH, count))
+    root, ext = os.path.splitext(INDEX_PATH)
+    for path in [INDEX_PATH] + glob.glob(glob.escape(root) + ".shard*-of-*" + glob.escape(ext)):
+        if path not in keep and os.path.exists(path):
+            os.remove(path)
+
+def publish_snapshot(manifest, n_shards):
+    """Publish the files of the last checkpoint as the snapshot servers load (see snapshots.py)"""
+    paths = vector_index.shard_paths(INDEX_PATH, n_shards) + [META_PATH, docstore.offsets_path(META_PATH), vector_index.VECTORS_PATH]
+    paths += filters.filter_paths(filters.FILTERS_PATH)
+    # the sources let servers drop uploads (see uploads.py) that this snapshot now holds
+    sources = sorted({rec["sha256"] for rec in manifest["files"].values() if rec.get("ids")})
+    name = snapshots.publish(manifest["version"], paths, {"ntotal": manifest["ntotal"], "shards": n_shards, "sources": sources})
+    return name, snapshots.prune()
+
+def snapshot_docs(names):
+    """Stored documents the metadata of the given snapshots refers to"""
+    docs = set()
+    for name in names:
+        path = os.path.join(snapshots.SNAPSHOT_DIR, name, os.path.basename(META_PATH))
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                docs.update(row["doc"] for row in map(json.loads, f) if "doc" in row)
+    return docs
+
+def empty_manifest(spec=None, layout=None):
+    return {"version": 0, "next_id": 0, "complete": True, "index": spec or vector_index.index_spec(),
+            "shards": layout or shard_layout(), "files": {}}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return empty_manifest()
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as fh:
+        return json.load(fh)
 
+def write_atomic(path, write, mode="w"):
+    """Write a file through a temp file in the same directory and rename it into place"""
+    tmp = path + ".tmp"
+    with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as fh:
+        write(fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+def save_manifest(manifest):
+    write_atomic(MANIFEST_PATH, lambda fh: json.dump(manifest, fh, ensure_ascii=False))
+
+def load_meta():
+    """Metadata rows keyed by vector ID (line position for rows written before IDs existed)"""
+    rows = {}
+    if os.path.exists(META_PATH):
+        with open(META_PATH, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                row = json.loads(line)
+                rows[row.get("vid", i)] = row
+    return rows
+
+def save_meta(rows):
+    docstore.write_meta(META_PATH, rows)
+
+def checkpoint(indexes, meta_rows, manifest, deduper, vectors, complete=False, dirty=None):
+    """
+    Persist the shard indexes, metadata and manifest together. Each goes through a temp file
+    and a rename, and the manifest is renamed last: it is the commit point, so it never lists
+    a vector that is not in the index and metadata files on disk. Only the shards in `dirty`
+    are rewritten (all of them when it is None).
+    """
+    manifest["complete"] = complete
+    manifest["ntotal"] = int(sum(index.ntotal for index in indexes))
+    manifest["shards"]["ntotal"] = [int(index.ntotal) for index in indexes]
+    manifest["checkpoint_at"] = time.time()
+    vectors.sync()
+    for i, (index, path) in enumerate(zip(indexes, vector_index.shard_paths(INDEX_PATH, len(indexes)))):
+        if dirty is None or i in dirty or not os.path.exists(path):
+            tmp = path + ".tmp"
+            faiss.write_index(index, tmp)
+            os.replace(tmp, path)
+    save_meta(meta_rows)
+    filters.write_filters(filters.FILTERS_PATH, manifest["files"], manifest["next_id"])
+    deduper.save()
+    save_manifest(manifest)
+
+def reconcile(indexes, meta_rows, manifest):
+    """
+    Make the shard indexes, metadata and manifest agree after an interrupted run: vectors
+    and rows that no manifest entry owns are dropped, files whose vectors went missing are
+    forgotten so they get re-ingested, and duplicate-source references are limited to
+    committed files. Returns the indexes (rebuilt if they cannot remove in place), the
+    shards changed and the number of vectors removed.
+    """
+    present = set()
+    for index in indexes:
+        present.update(vector_index.stored_ids(index).tolist())
+    owners = {}
+    for path, rec in list(manifest["files"].items()):
+        if all(vid in present and vid in meta_rows for vid in rec["ids"]):
+            for vid in rec["ids"]:
+                owners.setdefault(vid, set()).add(path)
+        else:
+            del manifest["files"][path]
+    orphans = present - owners.keys()
+    indexes, changed = remove_from_shards(indexes, sorted(orphans))
+    for vid in list(meta_rows):
+        if vid not in owners:
+            del meta_rows[vid]
+            continue
+        refs = [r for r in source_refs(meta_rows[vid]) if r in owners[vid]]
+        refs += sorted(owners[vid] - set(refs))
+        set_source_refs(meta_rows[vid], refs)
+    return indexes, changed, len(orphans)
+
+def backfill_attributes(manifest, meta_rows):
+    """Filter attributes for files ingested before they were recorded, read back from the text store"""
+    docs = {}
+    for row in meta_rows.values():
+        if "doc" in row:
+            docs.setdefault(row["source_path"], row["doc"])
+    for path, rec in manifest["files"].items():
+        if "attrs" in rec:
+            continue
+        try:
+            head = docstore.read_span(docs[path], 0, filters.HEAD_CHARS * 4) if path in docs else ""
+        except OSError:
+            head = ""
+        rec["attrs"] = filters.doc_attributes(path, head)
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def under_dirs(path, data_dirs):
+    path = os.path.normpath(path)
+    return any(path.startswith(os.path.normpath(d) + os.sep) for d in data_dirs)
+
+def plan_changes(data_dirs, manifest):
+    """
+    Compare the files on disk with the manifest.
+    Returns (files to ingest as {path: file record}, {path: vector IDs to release}, deleted paths).
+    Size and mtime are checked first; the content hash is only computed when they differ.
+    """
+    files = manifest["files"]
+    to_ingest, stale, seen = {}, {}, set()
+    for path in iter_source_files(data_dirs):
+        seen.add(path)
+        st = os.stat(path)
+        old = files.get(path)
+        if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+            continue
+        sha = file_sha256(path)
+        if old and old["sha256"] == sha:
+            old["mtime"] = st.st_mtime  # touched but unchanged
+            continue
+        if old:
+            stale[path] = old["ids"]
+            del files[path]
+        to_ingest[path] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": sha, "ids": []}
+
+    deleted = [p for p in files if p not in seen and under_dirs(p, data_dirs)]
+    for p in deleted:
+        stale[p] = files[p]["ids"]
+    return to_ingest, stale, deleted
+
+def extract_text(path, sha=None):
+    """
+    Extract the text of a single file and put it in the text store under the file's
+    content hash. Runs inside an extraction worker process, so only
+    (path, doc hash or None, word count, filter attributes) travels back to the embedding stage.
+    """
+    lower = path.lower()
+    try:
+        if lower.endswith(".pdf"):
+            text = extract_text_from_pdf(path)
+        elif lower.endswith((".html",".htm")):
+            text = extract_text_from_html(path)
+        else:
+            with open(path,"r",encoding="utf-8") as fh:
+                text = fh.read()
+    except Exception as e:
+        if lower.endswith((".pdf",".html",".htm")):
+            print(f"⚠️ Could not extract {path}: {e}")
+        return path, None, 0, {}
+    n_words = len(text.split())
+    if n_words < 50:
+        return path, None, n_words, {}
+    sha = sha or hashlib.sha256(text.encode("utf-8")).hexdigest()
+    docstore.write_text(sha, text)
+    return path, sha, n_words, filters.doc_attributes(path, text)
+
+def iter_source_files(data_dirs):
     for d in data_dirs:
-        for root,_,files in os.walk(d):
+        for root,dirs,files in os.walk(d):
+            # UPLOAD_DIR keeps upload job records and saved chunks in dot-directories, and a
+            # file still being uploaded ends in .part; neither is a document
+            dirs[:] = [x for x in dirs if not x.startswith(".")]
             for f in files:
-                path = os.path.join(root,f)
-                if f.lower().endswith(".pdf"):
-                    text = extract_text_from_pdf(path)
-                elif f.lower().endswith((".html",".htm")):
-                    text = extract_text_from_html(path)
-                else:
-                    try:
-                        text = open(path,"r",encoding="utf-8").read()
-                    except:
-                        continue
-                if not text or len(text.split()) < 50:
-                    continue
-                chunks = chunk_text(text, chunk_size=600, overlap=120)
-                for chunk in chunks:
-                    emb = embedder.encode([chunk], show_progress_bar=False)
-                    emb = np.array(emb).astype("float32")
-                    index.add(emb)
-                    meta = {"id": str(uuid.uuid4()), "source_path": path, "text": chunk[:2000]}
-                    meta_f.write(json.dumps(meta, ensure_ascii=False)+"\n")
-
-    faiss.write_index(index, INDEX_PATH)
-    meta_f.close()
-    print("✅ Ingestion complete. Index saved to", INDEX_PATH)
+                if not f.endswith(".part"):
+                    yield os.path.join(root,f)
+
+_DONE = object()
+
+def iter_extracted(jobs, workers=WORKERS, queue_size=QUEUE_SIZE):
+    """
+    Yield (path, doc, n_words, attrs) as the (path, sha256) jobs are extracted into the text store. With more than one worker the files are
+    parsed by a process pool and handed over through a bounded queue, so extraction of
+    the next files overlaps with chunking/embedding of the current ones.
+    """
+    if workers <= 1:
+        for path, sha in jobs:
+            yield extract_text(path, sha)
+        return
+
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                in_flight = set()
+                for path, sha in jobs:
+                    if stop.is_set():
+                        break
+                    in_flight.add(pool.submit(extract_text, path, sha))
+                    if len(in_flight) >= workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            put(fut.result())
+                while in_flight and not stop.is_set():
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        put(fut.result())
+                for fut in in_flight:
+                    fut.cancel()
+        except Exception as e:
+            put(e)
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name="extract-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+def flush_batch(embedder, writers, vectors, batch, batch_size):
+    """Encode a batch of (vid, shard, chunk) in one call and add them to their shard indexes in bulk"""
+    if not batch:
+        return 0
+    texts = [chunk for _, _, chunk in batch]
+    emb = embedder.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    emb = np.ascontiguousarray(emb, dtype="float32")
+    ids = np.array([vid for vid, _, _ in batch], dtype="int64")
+    shards = np.array([shard for _, shard, _ in batch])
+    vectors.write(ids, emb)
+    for shard in np.unique(shards).tolist():
+        mask = shards == shard
+        writers[shard].add(np.ascontiguousarray(emb[mask]), ids[mask])
+    return len(batch)
+
+def report_footprint(indexes, vectors, eval_queries=EVAL_QUERIES, k=10):
+    """
+    Print the index's memory per million chunks and, for approximate indexes, its
+    recall@k (over all shards, merged) against exact search over the on-disk vectors,
+    with and without re-ranking.
+    """
+    kind = vector_index.describe(indexes[0])
+    total = sum(index.ntotal for index in indexes)
+    per_vec = sum(vector_index.bytes_per_vector(index) * index.ntotal for index in indexes) / total if total else 0.0
+    mib = lambda b: b * 1e6 / 2**20
+    print(f"💾 {kind} index: {per_vec:.0f} bytes/vector, ~{mib(per_vec):.0f} MiB per million chunks in RAM "
+          f"(float32 flat: {mib(D * 4 + 8):.0f} MiB; exact vectors on disk: {mib(D * 4):.0f} MiB)")
+    mm = vectors.reader()
+    if kind == "flat" or mm is None or eval_queries <= 0 or total == 0:
+        return
+    ids = np.concatenate([vector_index.stored_ids(index) for index in indexes])
+    ids = ids[ids < len(mm)]
+    rng = np.random.default_rng(0)
+    picks = np.sort(rng.choice(ids, size=min(eval_queries, len(ids)), replace=False))
+    xq = np.asarray(mm[picks]) + rng.standard_normal((len(picks), D), dtype=np.float32) * 0.05 * float(np.asarray(mm[picks]).std())
+    xq = np.ascontiguousarray(xq, dtype="float32")
+    k = min(k, len(ids))
+    _, truth = vector_index.exact_knn(mm, ids, xq, k)
+    _, I = vector_index.search_shards(indexes, xq, k)
+    recall = vector_index.recall_at_k(I, truth)
+    line = f"🎯 recall@{k} vs exact search: {recall:.3f}"
+    if kind in vector_index.COMPRESSED_TYPES:
+        _, I = vector_index.search_shards(indexes, xq, k, vectors=mm)
+        reranked = vector_index.recall_at_k(I, truth)
+        line += f", {reranked:.3f} with exact re-ranking (x{vector_index.RERANK_FACTOR} candidates, {reranked - recall:+.3f})"
+    print(line)
+
+def main(data_dirs, batch_size=BATCH_SIZE, workers=WORKERS, rebuild=False, resume=False,
+         checkpoint_every=CHECKPOINT_EVERY, near_dup_threshold=NEAR_DUP_THRESHOLD, spec=None, train_size=None,
+         eval_queries=EVAL_QUERIES, shards=None, shard_by=None, rebuild_shards=()):
+    ensure_dirs()
+    manifest = empty_manifest() if rebuild else load_manifest()
+    if not manifest.get("complete", True) and not resume:
+        print("⚠️ The previous ingestion did not finish; pass --resume to continue from its checkpoint. Rebuilding from scratch.")
+        rebuild = True
+    # Without an explicit index type or shard count, keep whatever layout the existing index was built with
+    spec = spec or manifest.get("index") or vector_index.index_spec()
+    old_layout = manifest_shards(manifest)
+    layout = shard_layout(shards or old_layout["count"], shard_by or old_layout["by"])
+    if (layout["count"], layout["by"]) == (old_layout["count"], old_layout["by"]):
+        layout = old_layout
+    indexes = None if rebuild else create_or_load_index(D, manifest, spec, layout)
+    deduper = ChunkDeduper(threshold=near_dup_threshold)
+    vectors = vector_index.VectorStore(dimension=D)
+    dirty = set()  # shards whose index file has to be rewritten
+    if indexes is None:
+        manifest, meta_rows = empty_manifest(spec, shard_layout(layout["count"], layout["by"])), {}
+        indexes = [vector_index.build_index(D, spec) for _ in range(layout["count"])]
+        dirty.update(range(len(indexes)))
+        vectors.truncate()
+    else:
+        manifest["shards"] = layout
+        meta_rows = load_meta()
+        for shard in sorted(set(rebuild_shards)):
+            if not 0 <= shard < len(indexes):
+                raise ValueError(f"--rebuild-shard {shard}: the index has {len(indexes)} shard(s)")
+            t = time.perf_counter()
+            index = rebuild_shard(shard, meta_rows, manifest["index"], vectors, train_on=train_size)
+            if index is None:
+                # its files lose their vectors, so reconcile() has them re-ingested
+                print(f"⚠️ Not all vectors of shard {shard} are on disk; re-ingesting the files it held.")
+                index = vector_index.build_index(D, manifest["index"])
+            else:
+                print(f"🔧 Rebuilt shard {shard} from {index.ntotal} stored vectors in {time.perf_counter() - t:.1f}s")
+            indexes[shard] = index
+            dirty.add(shard)
+        indexes, changed, dropped = reconcile(indexes, meta_rows, manifest)
+        dirty |= changed
+        deduper.load(meta_rows)
+        if not manifest.get("complete", True):
+            print(f"🔄 Resuming from checkpoint: {len(manifest['files'])} files, {sum(ix.ntotal for ix in indexes)} vectors kept, {dropped} uncommitted vectors dropped")
+
+    backfill_attributes(manifest, meta_rows)
+    to_ingest, stale, deleted = plan_changes(data_dirs, manifest)
+    stale_ids = []
+    for path, ids in stale.items():
+        stale_ids += release_source(path, ids, meta_rows, deduper)
+    indexes, changed = remove_from_shards(indexes, stale_ids)
+    dirty |= changed
+    for path in deleted:
+        del manifest["files"][path]
+    print(f"🔍 {len(to_ingest)} new/changed files, {len(deleted)} deleted, {len(stale_ids)} stale vectors removed")
+
+    t0 = time.perf_counter()
+    n_docs, n_chunks, n_exact, n_near = 0, 0, 0, 0
+    if to_ingest:
+        # imported here, not at the top: the server's upload worker imports this module for extraction
+        from sentence_transformers import SentenceTransformer
+        embedder = SentenceTransformer(EMBED_MODEL)
+        writers = [vector_index.IndexWriter(index, manifest["index"], D, train_on=train_size) for index in indexes]
+        batch = []
+        last_checkpoint = time.monotonic()
+        progress = tqdm(unit="chunk", desc="Embedding")
+        jobs = [(path, rec["sha256"]) for path, rec in to_ingest.items()]
+        for path, doc, _, attrs in iter_extracted(jobs, workers=workers):
+            file_ids = set()
+            shard = shard_for(path, data_dirs, manifest["shards"])
+            if doc:
+                n_docs += 1
+                buf = docstore.open_text(doc)
+                try:
+                    for start, end in iter_chunk_spans(buf, chunk_size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+                        chunk = buf[start:end].decode("utf-8", errors="replace")
+                        h, sig = deduper.fingerprint(chunk)
+                        vid, kind = deduper.find(h, sig)
+                        if vid is not None:
+                            # Duplicate: reference the existing vector instead of embedding it again
+                            n_exact += kind == "exact"
+                            n_near += kind == "near"
+                            refs = source_refs(meta_rows[vid])
+                            if path not in refs:
+                                set_source_refs(meta_rows[vid], refs + [path])
+                            if vid not in file_ids:
+                                file_ids.add(vid)
+                                to_ingest[path]["ids"].append(vid)
+                            continue
+                        vid = manifest["next_id"]
+                        manifest["next_id"] += 1
+                        file_ids.add(vid)
+                        to_ingest[path]["ids"].append(vid)
+                        deduper.add(vid, h, sig)
+                        meta_rows[vid] = {"vid": vid, "id": str(uuid.uuid4()), "source_path": path, "doc": doc, "start": start, "end": end, "hash": h, **attrs}
+                        if len(indexes) > 1:
+                            meta_rows[vid]["shard"] = shard
+                        batch.append((vid, shard, chunk))
+                        dirty.add(shard)
+                        if len(batch) >= batch_size:
+                            n_chunks += flush_batch(embedder, writers, vectors, batch, batch_size)
+                            progress.update(len(batch))
+                            batch = []
+                            # Only whole files are in the manifest, so a file cut off here is redone on resume.
+                            # An IVF index still collecting its training sample cannot be checkpointed yet.
+                            if not any(w.buffered for w in writers) and time.monotonic() - last_checkpoint >= checkpoint_every:
+                                checkpoint([w.index for w in writers], meta_rows, manifest, deduper, vectors, dirty=dirty)
+                                dirty = set()
+                                last_checkpoint = time.monotonic()
+                finally:
+                    buf.close()
+            # Files that yield no text are recorded too, so they are not re-extracted until they change
+            to_ingest[path]["shard"] = shard
+            to_ingest[path]["attrs"] = attrs
+            manifest["files"][path] = to_ingest[path]
+        n_chunks += flush_batch(embedder, writers, vectors, batch, batch_size)
+        progress.update(len(batch))
+        progress.close()
+        indexes = [w.finish() for w in writers]
+        if len(writers) == 1:
+            manifest["index"] = writers[0].spec
+
+    if to_ingest or stale or dirty or not manifest.get("complete", True):
+        # past every published snapshot, also when --rebuild started a new manifest
+        manifest["version"] = max(manifest["version"], snapshots.latest_version()) + 1
+    checkpoint(indexes, meta_rows, manifest, deduper, vectors, complete=True, dirty=dirty)
+    remove_other_layouts(len(indexes))
+    vectors.close()
+    snapshot, kept = publish_snapshot(manifest, len(indexes))
+    # servers still on an older snapshot read the texts of its documents until they reload
+    docstore.remove_unreferenced({row["doc"] for row in meta_rows.values() if "doc" in row} | snapshot_docs([n for n in kept if n != snapshot]))
+    elapsed = time.perf_counter() - t0
+    rate = n_chunks / elapsed if elapsed > 0 else 0.0
+    print(f"📈 Embedded {n_chunks} chunks from {n_docs} documents in {elapsed:.1f}s ({rate:.1f} chunks/sec, batch size {batch_size}, {workers} extraction workers)")
+    print(f"🧹 Skipped {n_exact} exact and {n_near} near-duplicate chunks (kept as extra sources of existing vectors)")
+    report_footprint(indexes, vectors, eval_queries)
+    root, ext = os.path.splitext(INDEX_PATH)
+    where = INDEX_PATH if len(indexes) == 1 else f"{root}.shard*-of-{len(indexes)}{ext} (by {manifest['shards']['by']}: {', '.join(str(ix.ntotal) for ix in indexes)} vectors)"
+    print(f"✅ Ingestion complete. {vector_index.factory_string(manifest['index'])} index ({sum(ix.ntotal for ix in indexes)} vectors, version {manifest['version']}) saved to", where)
+    print(f"📦 Published as snapshot {snapshot} in {snapshots.SNAPSHOT_DIR} (kept: {', '.join(kept)}); running servers switch to it on their next check.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--dirs", nargs="+", default=["./data/statutes","./data/judgments"])
+    parser.add_argument("--dirs", nargs="+", default=DATA_DIRS, help="Document directories (default: statutes, judgments and UPLOAD_DIR)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Chunks per encode()/index.add() call")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Extraction processes (1 = extract in the main process)")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the manifest and re-index everything")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its last checkpoint")
+    parser.add_argument("--checkpoint-every", type=float, default=CHECKPOINT_EVERY, help="Seconds between checkpoints")
+    parser.add_argument("--near-dup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help="MinHash Jaccard above which a chunk counts as a near-duplicate (0 = exact dedup only)")
+    parser.add_argument("--index-type", choices=vector_index.INDEX_TYPES, default=None,
+                        help="Index layout (default: keep the existing one, else FAISS_INDEX_TYPE); changing it rebuilds")
+    parser.add_argument("--nlist", type=int, default=vector_index.IVF_NLIST, help="IVF cells")
+    parser.add_argument("--pq-m", type=int, default=vector_index.PQ_M, help="PQ sub-quantizers (must divide the embedding dimension)")
+    parser.add_argument("--pq-nbits", type=int, default=vector_index.PQ_NBITS, help="Bits per PQ code")
+    parser.add_argument("--hnsw-m", type=int, default=vector_index.HNSW_M, help="HNSW graph degree")
+    parser.add_argument("--train-size", type=int, default=None, help="Vectors to collect before training IVF/PQ/SQ8 indexes")
+    parser.add_argument("--eval-queries", type=int, default=EVAL_QUERIES, help="Queries for the post-ingest recall check (0 = skip)")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Split the index into this many shard files (default: keep the existing layout, else FAISS_SHARDS); changing it rebuilds")
+    parser.add_argument("--shard-by", choices=("hash", "source"), default=None,
+                        help="Partition files by a hash of their path, or one data directory per shard (default: FAISS_SHARD_BY)")
+    parser.add_argument("--rebuild-shard", type=int, nargs="+", default=[], metavar="SHARD",
+                        help="Rebuild these shards' index files from the stored vectors, leaving the other shards alone")
     args = parser.parse_args()
-    main(args.dirs)
+    spec = None
+    if args.index_type:
+        spec = vector_index.index_spec(args.index_type, nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m)
+    main(args.dirs, batch_size=args.batch_size, workers=args.workers, rebuild=args.rebuild,
+         resume=args.resume, checkpoint_every=args.checkpoint_every, near_dup_threshold=args.near_dup_threshold,
+         spec=spec, train_size=args.train_size, eval_queries=args.eval_queries,
+         shards=args.shards, shard_by=args.shard_by, rebuild_shards=args.rebuild_shard)
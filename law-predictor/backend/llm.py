@@ -0,0 +1,128 @@
+import os
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from backends import pool
+from serving import state, embed_queries
+from response_cache import responses
+from admission import scheduler
+
+# Blocking work (Ollama generation, query embedding, FAISS search) must not run on the
+# event loop, or one slow request stalls /health and every other route. How many generations
+# run at once, and in which order waiting ones start, is up to admission.scheduler.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))  # threads for encode + index search
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+
+embed_pool = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the response was ready"""
+
+async def chat(model, messages, traffic="chat", shed=True, **kwargs):
+    """ollama.chat without blocking the event loop, once the scheduler admits this traffic class"""
+    async with scheduler.slot(traffic, shed=shed):
+        return await pool.chat(model, messages, **kwargs)
+
+async def chat_stream(model, messages, traffic="chat", shed=True, **kwargs):
+    """Streamed ollama.chat: yields the response parts as they are generated"""
+    async with scheduler.slot(traffic, shed=shed):
+        async for part in pool.chat_stream(model, messages, **kwargs):
+            yield part
+
+def response_scope(model, context=None):
+    """
+    Cached answers are only valid for the model and data they were generated from, and, for
+    prompts built over retrieved evidence, for that evidence (`context`, see predictor.evidence_key)
+    """
+    scope = f"{model}|index={state.index_version}|cases={state.case_version}"
+    return f"{scope}|evidence={context}" if context else scope
+
+async def question_embedding(question):
+    if question is None or responses.similarity <= 0 or state.embedder is None:
+        return None
+    return (await run_blocking(embed_queries, [question]))[0]
+
+async def cache_lookup(model, messages, question=None, context=None):
+    """
+    (answer or None, scope, question embedding) of the response-cache lookup behind
+    cached_chat(). Routes look up first so that cache hits are never shed by the scheduler.
+    """
+    scope = response_scope(model, context)
+    emb = await question_embedding(question)
+    return await run_blocking(responses.get, scope, messages, emb), scope, emb
+
+async def cached_chat(model, messages, question=None, traffic="chat", shed=True, context=None, lookup=None):
+    """
+    Answer text of chat(), from the response cache when this prompt, or with a similarity
+    threshold set a similar `question`, was answered before for the same model, data and context.
+    `lookup` is the result of cache_lookup() when the caller already did it.
+    """
+    answer, scope, emb = lookup or await cache_lookup(model, messages, question, context)
+    if answer is None:
+        response = await chat(model, messages, traffic=traffic, shed=shed)
+        answer = response['message']['content']
+        await run_blocking(responses.put, scope, messages, answer, emb)
+    return answer
+
+async def cached_chat_stream(model, messages, question=None, traffic="chat", shed=True, lookup=None):
+    """Text pieces of chat_stream(); a cached answer comes back as a single piece"""
+    answer, scope, emb = lookup or await cache_lookup(model, messages, question)
+    if answer is not None:
+        yield answer
+        return
+    parts = []
+    async for part in chat_stream(model, messages, traffic=traffic, shed=shed):
+        parts.append(part['message']['content'])
+        yield parts[-1]
+    # only complete answers get here; a cancelled stream is not cached
+    await run_blocking(responses.put, scope, messages, "".join(parts), emb)
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a CPU-bound call (encode, search) on the embedding thread pool"""
+    loop = asyncio.get_running_loop()
+    # in the caller's context, so the call sees the index snapshot the request pinned
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(embed_pool, context.run, functools.partial(fn, *args, **kwargs))
+
+async def as_completed_bounded(items, fn, limit):
+    """
+    Yield (position, result, error) of `await fn(item)` for every item as each one
+    completes, with at most `limit` running at a time. Closing the generator cancels the rest.
+    """
+    items = list(items)
+    results = asyncio.Queue()
+    positions = iter(range(len(items)))
+
+    async def worker():
+        for i in positions:  # shared iterator: each position is taken once
+            try:
+                results.put_nowait((i, await fn(items[i]), None))
+            except Exception as e:
+                results.put_nowait((i, None, e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(limit, len(items))))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for w in workers:
+            w.cancel()
+
+async def unless_disconnected(request, coro, poll=DISCONNECT_POLL_S):
+    """
+    Await `coro`, cancelling it if the client disconnects first. Cancelling the Ollama
+    call closes its HTTP connection, which makes Ollama stop generating.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -1,196 +1,67 @@
-import os, json
-from fastapi import FastAPI, HTTPException
+import os, json, time, hmac, asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from pydantic import BaseModel
-from typing import List
-from sentence_transformers import SentenceTransformer
-import faiss
-import ollama
-import numpy as np
-from predictor import trend_predictor
-import csv
-import re
-
-# --- Config ---
-EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index/index.faiss")
-META_PATH = os.getenv("DOCS_META_PATH", "./faiss_index/docs_meta.jsonl")  # stays jsonl
-
-# --- Load Case Data ---
-def load_case_data():
-    """Load case data from case.txt file"""
-    case_data = []
-    case_file_path = "./data/judgments/case.txt"
-    
-    if os.path.exists(case_file_path):
-        try:
-            with open(case_file_path, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f, delimiter='|')
-                header = next(reader)  # Skip header line
-                
-                for row in reader:
-                    if len(row) >= 5:
-                        case_data.append({
-                            'case_id': row[0].strip(),
-                            'case_type': row[1].strip(),
-                            'ipc_section': row[2].strip(),
-                            'winning_percentage': float(row[3].strip()),
-                            'outcome': row[4].strip()
-                        })
-            print(f"✅ Loaded {len(case_data)} case records from case.txt")
-        except Exception as e:
-            print(f"⚠️ Error loading case data: {e}")
-    else:
-        print("⚠️ Case data file not found at ./data/judgments/case.txt")
-    
-    return case_data
-
-def find_relevant_cases(query, case_data, max_results=5):
-    """Find cases relevant to the user's query"""
-    query_lower = query.lower()
-    relevant_cases = []
-    
-    # Define keywords and their associated IPC sections
-    keywords_map = {
-        'fraud': ['420'], 'cheating': ['420'], 'dishonesty': ['420'],
-        'murder': ['302'], 'homicide': ['302'], 'killing': ['302'],
-        'false evidence': ['193'], 'perjury': ['193'], 'lying': ['193'],
-        'dowry': ['498a'], 'harassment': ['498a'], 'cruelty': ['498a'],
-        'rape': ['376'], 'sexual assault': ['376'],
-        'attempt to murder': ['307'], 'attempted murder': ['307'],
-        'assault': ['323', '324'], 'beating': ['323'], 'hurt': ['323', '324'],
-        'theft': ['379'], 'stealing': ['379'],
-        'breach of trust': ['406']
-    }
-    
-    for case in case_data:
-        relevance_score = 0
-        case_section = case['ipc_section'].lower()
-        case_type = case['case_type'].lower()
-        
-        # Direct IPC section matching
-        ipc_numbers = re.findall(r'\b(\d{2,3}[a-z]*)\b', query_lower)
-        for number in ipc_numbers:
-            if number in case_section:
-                relevance_score += 20
-        
-        # Keyword matching
-        for keyword, sections in keywords_map.items():
-            if keyword in query_lower:
-                for section in sections:
-                    if section in case_section:
-                        relevance_score += 15
-        
-        # Case type matching
-        if any(ctype in query_lower for ctype in ['civil', 'criminal']):
-            if any(ctype in case_type for ctype in ['civil', 'criminal'] if ctype in query_lower):
-                relevance_score += 10
-        
-        if relevance_score > 0:
-            case_with_score = case.copy()
-            case_with_score['relevance_score'] = relevance_score
-            relevant_cases.append(case_with_score)
-    
-    # Sort by relevance and return top results
-    relevant_cases.sort(key=lambda x: x['relevance_score'], reverse=True)
-    return relevant_cases[:max_results]
-
-def generate_case_context(relevant_cases):
-    """Generate context string from relevant cases"""
-    if not relevant_cases:
-        return ""
-    
-    context = "\n\n📊 **Historical Case Data Analysis:**\n"
-    
-    # Group cases by IPC section
-    section_stats = {}
-    for case in relevant_cases:
-        section = case['ipc_section']
-        if section not in section_stats:
-            section_stats[section] = []
-        section_stats[section].append(case)
-    
-    for section, cases in section_stats.items():
-        avg_winning = sum(case['winning_percentage'] for case in cases) / len(cases)
-        favorable_count = len([c for c in cases if c['outcome'] == 'Favorable'])
-        
-        context += f"\n🔹 **{section}** ({len(cases)} cases):\n"
-        context += f"   • Average Success Rate: **{avg_winning:.1f}%**\n"
-        context += f"   • Favorable Outcomes: {favorable_count}/{len(cases)}\n"
-    
-    # Overall statistics
-    total_cases = len(relevant_cases)
-    overall_avg = sum(case['winning_percentage'] for case in relevant_cases) / total_cases
-    
-    context += f"\n📈 **Overall Analysis** ({total_cases} similar cases):\n"
-    context += f"   • Combined Success Rate: **{overall_avg:.1f}%**\n"
-    
-    # Recommendation
-    if overall_avg >= 70:
-        recommendation = "🟢 **High probability of success**"
-    elif overall_avg >= 50:
-        recommendation = "🟡 **Moderate chances of success**"
-    else:
-        recommendation = "🔴 **Lower probability of success**"
-    
-    context += f"   • Recommendation: {recommendation}\n"
-    
-    return context
-
-def format_response_for_markdown(text):
-    """
-    Post-process the response to ensure proper markdown formatting with line breaks
-    """
-    import re
-    
-    # First, normalize line endings
-    text = text.replace('\r\n', '\n').replace('\r', '\n')
-    
-    # Split into lines and process
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for i, line in enumerate(lines):
-        line = line.strip()
-        
-        # Skip empty lines but preserve them
-        if not line:
-            if formatted_lines and formatted_lines[-1] != '':
-                formatted_lines.append('')
-            continue
-            
-        # Add extra spacing around main headings (##)
-        if line.startswith('##'):
-            # Add blank line before heading if previous line isn't empty
-            if formatted_lines and formatted_lines[-1] != '':
-                formatted_lines.append('')
-            formatted_lines.append(line)
-            formatted_lines.append('')  # Add blank line after heading
-            
-        # Add spacing around numbered items (1., 2., etc.)
-        elif re.match(r'^\d+\.', line):
-            # Add blank line before numbered item
-            if formatted_lines and formatted_lines[-1] != '':
-                formatted_lines.append('')
-            formatted_lines.append(line)
-            formatted_lines.append('')  # Add blank line after numbered item
-            
-        # Handle bullet points - indent them
-        elif line.startswith('*') or line.startswith('-'):
-            formatted_lines.append('   ' + line)  # Indent bullet points
-            
-        # Handle regular paragraphs
-        else:
-            formatted_lines.append(line)
-    
-    # Join lines and clean up multiple consecutive empty lines
-    result = '\n'.join(formatted_lines)
-    result = re.sub(r'\n\s*\n\s*\n+', '\n\n', result)  # Replace 3+ newlines with 2
-    
-    return result.strip()
+from typing import List, Literal, Optional
+from datetime import date
+import llm
+from predictor import trend_predictor_async, trend_lookup
+from prompts import CHAT_SYSTEM_PROMPT, TREND_SYSTEM_PROMPT, chat_messages
+from case_stats import find_relevant_cases, generate_case_context
+from serving import (state, uploaded, start_warm_up, retrieve_many, normalize_query, embedding_cache, search_cache,
+                     filtered_searches, SERVE_PRELOAD, preload, warm_up_worker, memory_usage,
+                     reload_index, reload_case_data, start_reload_watcher, INDEX_RELOAD_POLL_S)
+from filters import filter_spec, spec_key
+from response_cache import responses
+from batching import QueryBatcher
+from coalesce import SingleFlight
+from admission import scheduler, Overloaded
+from backends import pool, CHAT_MODEL, TREND_MODEL
+from uploads import upload_worker, check_upload_length, UploadRejected
+from formatting import clean_chat_response, format_case_header, MarkdownStream, MIN_RESPONSE_CHARS, FOOTER
 
 # --- App Setup ---
-app = FastAPI(title="AI-Powered Legal Assistance Backend")
+LLM_WARM_UP = os.getenv("LLM_WARM_UP", "1") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # X-Admin-Token for /admin routes; unset, they only answer localhost
+
+async def warm_up_llm():
+    """Load the models into Ollama and prefill their system prompts before the first user asks"""
+    t0 = time.perf_counter()
+    done = await pool.warm_up({CHAT_MODEL: CHAT_SYSTEM_PROMPT, TREND_MODEL: TREND_SYSTEM_PROMPT})
+    state.timings["llm_warm_up"] = round(time.perf_counter() - t0, 3)
+    print(f"✅ LLM warm-up finished: {done}")
+
+# /predict queries arriving together share one encode + search (BATCH_MAX_WAIT_MS, BATCH_MAX_SIZE)
+query_batcher = QueryBatcher(retrieve_many)
+# concurrent identical /chat and /predict requests share one computation
+flights = SingleFlight()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Models and index load in the background; /ready reports when they are in.
+    # Preloaded (SERVE_PRELOAD=1) they are already here, inherited from the gunicorn master.
+    if state.ready.is_set():
+        warm_up_worker()
+    else:
+        start_warm_up()
+    query_batcher.start()
+    pool.start_health_checks()
+    if INDEX_RELOAD_POLL_S > 0:
+        start_reload_watcher()
+    upload_worker.start()  # also indexes uploads no snapshot holds yet, from before a restart
+    if LLM_WARM_UP:
+        asyncio.create_task(warm_up_llm())
+    yield
+    await pool.stop()
+    await query_batcher.stop()
+
+if SERVE_PRELOAD:
+    preload()
+
+app = FastAPI(title="AI-Powered Legal Assistance Backend", lifespan=lifespan)
 
 # Enable CORS (important for React frontend)
 app.add_middleware(
@@ -199,204 +70,313 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Index-Version"],
 )
 
-# --- Load Model & FAISS Index ---
-# --- Load Case Data ---
-case_data = load_case_data()
-try:
-    embedder = SentenceTransformer(EMBED_MODEL)
-except Exception as e:
-    embedder = None
-    print(f"⚠️ Could not load embedder: {e}")
-
-index, docs_meta = None, []
-if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH):
-    try:
-        index = faiss.read_index(INDEX_PATH)
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            docs_meta = [json.loads(line) for line in f]
-        print(f"✅ Loaded FAISS index with {len(docs_meta)} documents.")
-    except Exception as e:
-        print(f"⚠️ Error loading FAISS index: {e}")
-else:
-    print("⚠️ FAISS index or metadata file not found. Run `python ingest.py` first.")
+@app.middleware("http")
+async def pin_index_version(request, call_next):
+    # A request is served from one index snapshot from start to end, even if a reload swaps
+    # in the next one meanwhile, and the response says which version that was
+    with state.pin() as snapshot:
+        response = await call_next(request)
+    if snapshot.version is not None:
+        response.headers["X-Index-Version"] = str(snapshot.version)
+    return response
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    # load shedding: answer at once instead of letting the request queue until the client times out
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail},
+                        headers={"Retry-After": str(exc.retry_after)})
 
 # --- Request Schema ---
 class Query(BaseModel):
     question: str
     facts: str = ""
     top_k: int = 5
+    # Optional metadata filters, applied inside the index search rather than to its results
+    doc_type: Optional[Literal["statute", "judgment"]] = None
+    court: Optional[str] = None  # e.g. "supreme court", "delhi high court", or "high court" for any
+    date_from: Optional[date] = None  # judgment date range, inclusive; undated documents never match
+    date_to: Optional[date] = None
+
+    @property
+    def text(self):
+        return self.question + ("\n" + self.facts if self.facts else "")
+
+    @property
+    def filters(self):
+        return filter_spec(self.doc_type, self.court, self.date_from, self.date_to)
+
+class BatchQuery(BaseModel):
+    queries: List[Query]
+
+# Bulk prediction: LLM calls queued per /predict/batch request, and queries accepted per request
+BATCH_LLM_PARALLEL = int(os.getenv("BATCH_LLM_PARALLEL", "2"))
+PREDICT_BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", "1000"))
 
 # --- Routes ---
 @app.get("/")
 async def root():
     return {"message": "AI-Powered Legal Assistance Backend is running!"}
 
+# Check if question is about case predictions or winning chances
+PREDICTION_KEYWORDS = [
+    'winning', 'chances', 'probability', 'outcome', 'likely', 
+    'success rate', 'predict', 'odds', 'prospects'
+]
+
+def chat_case_context(message):
+    """Historical case statistics for prediction-style questions, "" otherwise"""
+    case_context = ""
+    if any(keyword in message.lower() for keyword in PREDICTION_KEYWORDS):
+        relevant_cases = find_relevant_cases(message, state.case_data)
+        if relevant_cases:
+            case_context = generate_case_context(relevant_cases)
+            print(f"✅ Generated case context: {case_context}")
+    return case_context
+
 @app.post("/chat")
-async def chat(request: dict):
+async def chat(request: dict, http_request: Request):
     try:
         message = request.get("message", "")
         print(f"🔍 Received message: {message}")
         
-        # Check if question is about case predictions or winning chances
-        prediction_keywords = [
-            'winning', 'chances', 'probability', 'outcome', 'likely', 
-            'success rate', 'predict', 'odds', 'prospects'
-        ]
+        case_context = chat_case_context(message)
+        print(f"🔍 Sending to LLM: {(message + case_context)[:200]}...")
         
-        case_context = ""
-        if any(keyword in message.lower() for keyword in prediction_keywords):
-            relevant_cases = find_relevant_cases(message, case_data)
-            if relevant_cases:
-                case_context = generate_case_context(relevant_cases)
-                print(f"✅ Generated case context: {case_context}")
+        # Use Ollama (off the event loop, unless cached; dropped if the client disconnects)
+        # identical questions in flight share one generation
+        raw_response = await llm.unless_disconnected(http_request, flights.do(
+            ("chat", normalize_query(message)),
+            lambda: llm.cached_chat(CHAT_MODEL, chat_messages(message, case_context), question=message)))
         
-        # Enhanced system prompt with formatting instructions
-        system_prompt = """You are an expert legal data analyst specializing in Indian law case predictions.
-
-CRITICAL FORMATTING RULES:
-- Use ## for main headings with blank lines before and after
-- Use numbered lists (1., 2., 3.) with blank lines between each item
-- Use * for bullet points with blank lines between groups
-- Put TWO blank lines between major sections
-- Put ONE blank line after each numbered item before starting bullet points
-- Always end bullet point groups with a blank line
-- Use **bold** for important terms
-
-REQUIRED FORMAT EXAMPLE:
-
-## **Main Section Title**
-
-1. **First Item Name**
-
-* First sub-point here
-* Second sub-point here
-* Third sub-point here
-
-2. **Second Item Name**
-
-* Another sub-point
-* More details here
-
-3. **Third Item Name**
-
-* More information
-* Additional details
-
-
-## **Next Section Title**
-
-Important information here.
-
-Always follow this exact spacing pattern with blank lines for proper markdown rendering."""
-        
-        user_prompt = message + case_context
-        print(f"🔍 Sending to LLM: {user_prompt[:200]}...")
-        
-        # Use Ollama
-        response = ollama.chat(model='llama3.1:8b', messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': user_prompt}
-        ])
-        
-        raw_response = response['message']['content']
         print(f"🔍 Raw LLM response: {raw_response}")
 
-        # Handle multiple disclaimer variations (same as test_main.py)
-        disclaimers_to_replace = [
-            "I cannot provide legal advice, but",
-            "I can't provide legal advice, but", 
-            "I cannot provide legal advice.",
-            "I can't provide legal advice.",
-            "I cannot provide legal advice,",
-            "I can't provide legal advice,",
-            "However, I can offer some general information",
-            "Would that help?",
-            "I cannot provide legal advice. However, I can offer some general information about the Indian Penal Code (IPC)",
-            "I cannot provide legal advice. However,",
-            "However, I can offer some general information about the Indian Penal Code (IPC). Would that help?",
-            "I cannot provide legal advice. However, I can offer some general information about the Indian Penal Code (IPC). Would that help?"
-        ]
-
-        cleaned_response = raw_response
-        replacement_made = False
-
-        for disclaimer in disclaimers_to_replace:
-            if disclaimer in raw_response:
-                print(f"🎯 FOUND DISCLAIMER: '{disclaimer}'")
-                cleaned_response = cleaned_response.replace(
-                    disclaimer,
-                    "Based on historical legal data and case analysis,"
-                )
-                replacement_made = True
-                break
-
-        print(f"🔍 Replacement made: {replacement_made}")
-        print(f"🔍 Cleaned response: '{cleaned_response}'")
-
-        # If no replacement was made and it's still a generic response, force a better response
-        if not replacement_made and len(cleaned_response) < 200 and case_context:
-            print("🚨 FORCING BETTER RESPONSE")
-            cleaned_response = "Based on historical legal data and case analysis, here's what the statistics show about similar cases."
-
-        # POST-PROCESS THE RESPONSE FOR BETTER LINE BREAKS
-        cleaned_response = format_response_for_markdown(cleaned_response)
+        # Replace the disclaimer, force a better response for a short non-answer with case
+        # data, and post-process the response for better line breaks
+        cleaned_response = clean_chat_response(raw_response, case_context)
         print(f"🔍 After formatting: {cleaned_response[:300]}...")
 
         # Combine historical context + cleaned LLM response
         final_response = ""
         if case_context:
-            # Format case context better
-            formatted_case_context = case_context.replace("📊 **Historical Case Data Analysis:**", "## 📊 **HISTORICAL CASE ANALYSIS**")
-            formatted_case_context = formatted_case_context.replace("**Overall Analysis**", "**Based on")
-            formatted_case_context = formatted_case_context.replace("• Combined Success Rate:", "similar cases, average success rate is")
-            
-            final_response += f"{formatted_case_context}\n\n"
-            final_response += f"## 📋 **LEGAL ANALYSIS**\n\n{cleaned_response}"
+            final_response = format_case_header(case_context) + cleaned_response
         else:
             final_response = cleaned_response
 
         # Add a professional footer
-        final_response += "\n\n---\n\n**⚠️ Disclaimer:** This is general legal information based on historical data. Please consult with a qualified lawyer for specific legal advice."
+        final_response += FOOTER
 
         print(f"🔍 Final response length: {len(final_response)}")
         return {"response": final_response}
         
+    except llm.ClientDisconnected:
+        print("🔌 Client disconnected, generation cancelled")
+        return Response(status_code=499)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"❌ Chat error: {e}")
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
-@app.post("/upload")
-async def upload_document(file: str):
-    # Simple file processing for now
-    return {"analysis": "Document received and analyzed successfully"}
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: dict):
+    """
+    /chat as Server-Sent Events. The case statistics go out first, then the answer as it is
+    generated, formatted line by line. The "text" of all events joined equals the /chat response
+    unless the answer has different disclaimers on different lines (see MarkdownStream).
+    """
+    message = request.get("message", "")
+    case_context = chat_case_context(message)
+    messages = chat_messages(message, case_context)
+    lookup = await llm.cache_lookup(CHAT_MODEL, messages, question=message)
+    if lookup[0] is None:
+        scheduler.check("chat")  # shed load before the stream starts; later it can only report an error event
+
+    async def events():
+        if case_context:
+            yield sse("header", {"text": format_case_header(case_context)})
+        formatter = MarkdownStream(hold_chars=MIN_RESPONSE_CHARS if case_context else 0)
+        try:
+            # Identical questions in flight share one generation and all get its full token
+            # sequence. Starlette cancels this generator when the client disconnects; once no
+            # client is left the streaming connection to Ollama is closed, stopping the generation.
+            shared = flights.stream(
+                ("chat_stream", normalize_query(message)),
+                lambda: llm.cached_chat_stream(CHAT_MODEL, messages, lookup=lookup))
+            async for piece in shared:
+                text = formatter.feed(piece)
+                if text:
+                    yield sse("token", {"text": text})
+            yield sse("token", {"text": formatter.finish() + FOOTER})
+            yield sse("done", {})
+        except Exception as e:
+            print(f"❌ Chat stream error: {e}")
+            yield sse("error", {"detail": f"Chat failed: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/upload", status_code=202)
+async def upload_document(request: Request):
+    """
+    Add a PDF, HTML or TXT filing to the searchable documents: a multipart form with the
+    `file` and, optionally, `doc_type` ("statute" or "judgment"), which sets the "type" filter;
+    without it the document is typed as ingest.py would. The size limit is checked on the
+    Content-Length before any of the body is read. The file is written to disk in blocks and
+    indexed in the background; GET /upload/{job_id} reports progress, and /predict finds it
+    once the job is "indexed", usually seconds later.
+    """
+    try:
+        check_upload_length(request.headers.get("content-length"))
+        async with request.form(max_files=1, max_fields=4) as form:
+            file, doc_type = form.get("file"), form.get("doc_type") or None
+            if not isinstance(file, StarletteUploadFile):
+                raise UploadRejected(422, "Send the document as the multipart form field \"file\".")
+            if doc_type not in (None, "statute", "judgment"):
+                raise UploadRejected(422, "doc_type must be \"statute\" or \"judgment\".")
+            job = await upload_worker.accept(file, doc_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return dict(job, status_url=f"/upload/{job['job_id']}")
+
+@app.get("/upload/{job_id}")
+async def upload_status(job_id: str):
+    job = upload_worker.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload job.")
+    return job
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
-@app.post("/predict")
-async def predict(q: Query):
-    if not index or not docs_meta:
+@app.get("/ready")
+async def ready():
+    """Readiness, separate from liveness: 503 until the warm-up has loaded models and index"""
+    status = state.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "query_batching": query_batcher.stats.snapshot(),
+        "embedding_cache": embedding_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "index_shards": state.index.stats() if state.index else {},
+        "metadata_filters": dict(state.filters.stats(), searches=dict(filtered_searches)) if state.filters else {},
+        "uploads": upload_worker.stats(),
+        "response_cache": responses.stats(),
+        "coalescing": flights.stats(),
+        "llm_admission": scheduler.stats(),
+        "ollama_backends": pool.stats(),
+        "memory": memory_usage(),
+    }
+
+def require_admin(request):
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid X-Admin-Token.")
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="Set ADMIN_TOKEN to use /admin routes from other hosts.")
+
+@app.post("/admin/reload")
+async def admin_reload(request: Request, force: bool = False):
+    """
+    Load the index snapshot ingest.py published last, and case.txt if it changed, without a
+    restart: the new version is loaded in the background and swapped in once ready, requests
+    in flight finish on the old one. Only this worker reloads here; the others follow within
+    INDEX_RELOAD_POLL_S. `force` reloads even an unchanged version.
+    """
+    require_admin(request)
+    previous = state.snapshot.version
+    try:
+        snapshot = await asyncio.to_thread(reload_index, force)
+        case_reloaded = await asyncio.to_thread(reload_case_data, force)
+    except Exception as e:
+        state.reload_error = str(e)
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving index version {state.snapshot.version}: {e}")
+    return {
+        "index_version": state.snapshot.version,
+        "previous_version": previous,
+        "index_reloaded": snapshot is not None,
+        "case_version": state.case_version,
+        "case_data_reloaded": case_reloaded,
+        "draining_versions": [s.version for s in state.draining],
+    }
+
+def require_ready():
+    if not state.ready.is_set():
+        raise HTTPException(status_code=503, detail="Server is warming up, retry shortly.", headers={"Retry-After": "5"})
+
+def require_search(filtered=False):
+    require_ready()
+    if (not state.index or not state.docs_meta or len(state.docs_meta) == 0) and not len(uploaded):
         raise HTTPException(status_code=500, detail="FAISS index not available. Run ingestion first.")
-    if not embedder:
+    if not state.embedder:
         raise HTTPException(status_code=500, detail="SentenceTransformer not available.")
+    if filtered and state.filters is None and state.index:
+        raise HTTPException(status_code=400, detail="This index was built without metadata filters. Re-run ingestion to filter by type, court or date.")
 
-    # Prepare query
-    qtext = q.question + ("\n" + q.facts if q.facts else "")
-    q_emb = embedder.encode([qtext]).astype("float32")
+@app.post("/predict")
+async def predict(q: Query, http_request: Request):
+    require_search(filtered=q.filters is not None)
 
-    # Search in FAISS
-    D, I = index.search(q_emb, q.top_k)
-    retrieved = [docs_meta[idx] for idx in I[0] if 0 <= idx < len(docs_meta)]
+    # Prepare query, then embed it and search FAISS
+    qtext = q.text
 
-    # Run prediction
+    async def run_prediction():
+        retrieved = await query_batcher.submit(qtext, q.top_k, q.filters, snapshot=state.current)
+        return await trend_predictor_async(qtext, retrieved, top_k=q.top_k, filters=q.filters)
+
+    # Run prediction, shared with identical requests already in flight
+    key = ("predict", normalize_query(q.question), normalize_query(q.facts), q.top_k, spec_key(q.filters), state.index_version)
     try:
-        return trend_predictor(qtext, retrieved)
+        result = await llm.unless_disconnected(http_request, flights.do(key, run_prediction))
+        return dict(result, question=qtext)
+    except llm.ClientDisconnected:
+        return Response(status_code=499)
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+@app.post("/predict/batch")
+async def predict_batch(batch: BatchQuery):
+    """
+    Many /predict queries in one request. All of them are embedded and searched together,
+    then the LLM runs BATCH_LLM_PARALLEL at a time. Results stream back as NDJSON lines
+    in completion order, each carrying the "index" of its query.
+    """
+    require_search(filtered=any(q.filters for q in batch.queries))
+    if len(batch.queries) > PREDICT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX} queries per batch.")
+    qtexts = [q.text for q in batch.queries]
+    top_ks = [q.top_k for q in batch.queries]
+    retrieved = await llm.run_blocking(retrieve_many, qtexts, top_ks, [q.filters for q in batch.queries]) if qtexts else []
+    lookups = [await trend_lookup(qtexts[i], retrieved[i], q.top_k, q.filters) for i, q in enumerate(batch.queries)]
+    if any(lookup[0] is None for lookup in lookups):
+        scheduler.check("batch")  # a batch answered from the cache alone is never shed
+
+    async def predict_one(i):
+        # admitted batches wait their turn behind interactive traffic rather than being shed
+        query = batch.queries[i]
+        return await trend_predictor_async(qtexts[i], retrieved[i], traffic="batch", shed=False,
+                                           top_k=query.top_k, filters=query.filters, lookup=lookups[i])
+
+    async def lines():
+        # closing this generator (client gone) cancels the LLM calls still running
+        async for i, result, error in llm.as_completed_bounded(range(len(qtexts)), predict_one, BATCH_LLM_PARALLEL):
+            if error is not None:
+                result = {"question": qtexts[i], "error": f"Prediction failed: {str(error)}"}
+            yield json.dumps({"index": i, **result}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/predict_case")
 async def predict_case(request: dict):
     try:
@@ -405,7 +385,7 @@ async def predict_case(request: dict):
         
         # Find matching cases
         matching_cases = []
-        for case in case_data:
+        for case in state.case_data:
             section_match = ipc_section.lower() in case['ipc_section'].lower()
             type_match = not case_type or case_type.lower() in case['case_type'].lower()
             
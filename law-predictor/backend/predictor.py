@@ -1,31 +1,60 @@
-import ollama
 import json
 import re
+import hashlib
+import llm
+from admission import Overloaded
+from backends import pool, TREND_MODEL
+from case_stats import find_relevant_cases, generate_case_context
+from prompts import trend_prompt
+
+def evidence_key(evidence_list, top_k=None, filters=None):
+    """
+    Digest of what a trend answer is written over: the retrieved chunks, top_k and filters.
+    Similar questions only share a cached answer when they were asked over the same evidence.
+    """
+    ids = [e.get("id") or e.get("source_path") for e in evidence_list]
+    return hashlib.blake2b(json.dumps([ids, top_k, filters], sort_keys=True).encode("utf-8"), digest_size=12).hexdigest()
 
 def ask_llm_for_trend(question, evidence_list):
-    prompt = "You are a legal prediction assistant for Indian law.\n"
-    prompt += "Question:\n" + question + "\n\n"
-    prompt += "Evidence:\n"
-    for i, e in enumerate(evidence_list[:3], 1):
-        prompt += f"[{i}] {e.get('source_path','?')}\n{e.get('text','')[:500]}\n\n"
-    
     try:
-        response = ollama.chat(model='llama3.2:3b', messages=[
-            {'role': 'system', 'content': 'You are a helpful legal assistant.'},
-            {'role': 'user', 'content': prompt}
-        ])
+        response = pool.chat_sync(TREND_MODEL, trend_prompt(question, evidence_list))
         return {"reasoning": response['message']['content'], "label": "analyzed"}
     except Exception as e:
         return {"reasoning": "Error processing request", "label": "error"}
 
+async def trend_lookup(question, evidence_list, top_k=None, filters=None):
+    """The response-cache lookup of a trend prompt (llm.cache_lookup), to pass on as `lookup`"""
+    return await llm.cache_lookup(TREND_MODEL, trend_prompt(question, evidence_list), question=question,
+                                  context=evidence_key(evidence_list, top_k, filters))
+
+async def ask_llm_for_trend_async(question, evidence_list, traffic="predict", shed=True, top_k=None, filters=None,
+                                  lookup=None):
+    # Cancellation (client gone) is not an Exception and still propagates, so does load shedding
+    try:
+        answer = await llm.cached_chat(TREND_MODEL, trend_prompt(question, evidence_list), question=question,
+                                       traffic=traffic, shed=shed, context=evidence_key(evidence_list, top_k, filters),
+                                       lookup=lookup)
+        return {"reasoning": answer, "label": "analyzed"}
+    except Overloaded:
+        raise
+    except Exception as e:
+        return {"reasoning": "Error processing request", "label": "error"}
+
 def trend_predictor(question, retrieved_docs, case_data=None):
     # Get LLM analysis
     llm_result = ask_llm_for_trend(question, retrieved_docs)
-    
+    return combine_prediction(question, retrieved_docs, llm_result, case_data)
+
+async def trend_predictor_async(question, retrieved_docs, case_data=None, traffic="predict", shed=True,
+                                top_k=None, filters=None, lookup=None):
+    llm_result = await ask_llm_for_trend_async(question, retrieved_docs, traffic=traffic, shed=shed,
+                                               top_k=top_k, filters=filters, lookup=lookup)
+    return combine_prediction(question, retrieved_docs, llm_result, case_data)
+
+def combine_prediction(question, retrieved_docs, llm_result, case_data=None):
     # If case data is provided, add statistical analysis
     case_analysis = ""
     if case_data:
-        from main import find_relevant_cases, generate_case_context
         relevant_cases = find_relevant_cases(question, case_data)
         if relevant_cases:
             case_analysis = generate_case_context(relevant_cases)
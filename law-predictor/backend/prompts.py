@@ -0,0 +1,62 @@
+# The prompts sent to Ollama, kept free of imports with side effects so tools such as
+# bench_prefill.py can use them without bringing up the app.
+
+# Enhanced system prompt with formatting instructions. It is sent unchanged as the first
+# message of every /chat call (per-request text only follows it), so Ollama can reuse its prefill.
+CHAT_SYSTEM_PROMPT = """You are an expert legal data analyst specializing in Indian law case predictions.
+
+CRITICAL FORMATTING RULES:
+- Use ## for main headings with blank lines before and after
+- Use numbered lists (1., 2., 3.) with blank lines between each item
+- Use * for bullet points with blank lines between groups
+- Put TWO blank lines between major sections
+- Put ONE blank line after each numbered item before starting bullet points
+- Always end bullet point groups with a blank line
+- Use **bold** for important terms
+
+REQUIRED FORMAT EXAMPLE:
+
+## **Main Section Title**
+
+1. **First Item Name**
+
+* First sub-point here
+* Second sub-point here
+* Third sub-point here
+
+2. **Second Item Name**
+
+* Another sub-point
+* More details here
+
+3. **Third Item Name**
+
+* More information
+* Additional details
+
+
+## **Next Section Title**
+
+Important information here.
+
+Always follow this exact spacing pattern with blank lines for proper markdown rendering."""
+
+def chat_messages(message, case_context):
+    return [
+        {'role': 'system', 'content': CHAT_SYSTEM_PROMPT},
+        {'role': 'user', 'content': message + case_context}
+    ]
+
+# Fixed instructions go in the system message, ahead of anything per-request, so every
+# prompt starts with the same tokens and Ollama can reuse their prefill from its KV cache
+TREND_SYSTEM_PROMPT = "You are a helpful legal assistant.\nYou are a legal prediction assistant for Indian law."
+
+def trend_prompt(question, evidence_list):
+    prompt = "Question:\n" + question + "\n\n"
+    prompt += "Evidence:\n"
+    for i, e in enumerate(evidence_list[:3], 1):
+        prompt += f"[{i}] {e.get('source_path','?')}\n{e.get('text','')[:500]}\n\n"
+    return [
+        {'role': 'system', 'content': TREND_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
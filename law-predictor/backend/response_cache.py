@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from cache import TTLCache
+
+# LLM answers, reused for the exact same prompt or, with RESPONSE_CACHE_SIMILARITY > 0, for a
+# question whose embedding is at least that cosine-similar to a cached one. Entries are scoped
+# by model and by the case-data/index versions they were generated from.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))  # 0 disables the cache
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "604800"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))  # e.g. 0.95; 0 = exact only
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")  # e.g. ./faiss_index/responses.sqlite3; "" = in memory
+
+class SqliteStore:
+    """On-disk LRU/TTL store with the same get/put as TTLCache, so answers survive restarts"""
+    def __init__(self, path, max_size, ttl=None):
+        self.max_size, self.ttl = max_size, ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, scope TEXT NOT NULL, "
+            "embedding BLOB, response TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._db.commit()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            if self.ttl is not None and now - row[1] >= self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return default
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return row[0]
+
+    def put(self, key, value, scope="", embedding=None):
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        blob = None if embedding is None else np.asarray(embedding, dtype="float32").tobytes()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, scope, blob, value, now, now))
+            excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_size
+            if excess > 0:
+                self._db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used LIMIT ?)", (excess,))
+            self._db.commit()
+
+    def embeddings(self, scope):
+        """(key, embedding) of the stored answers of a scope that have one"""
+        with self._lock:
+            rows = self._db.execute("SELECT key, embedding FROM responses WHERE scope = ? AND embedding IS NOT NULL", (scope,)).fetchall()
+        return [(key, np.frombuffer(blob, dtype="float32")) for key, blob in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+class ResponseCache:
+    """
+    Exact lookups by a hash of (scope, messages); similarity lookups compare the question's
+    embedding with those of the cached answers of the same scope.
+    """
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL_S,
+                 similarity=RESPONSE_CACHE_SIMILARITY, db_path=RESPONSE_CACHE_DB):
+        self.max_size, self.similarity = max_size, similarity
+        self.store = SqliteStore(db_path, max_size, ttl) if db_path and max_size > 0 else TTLCache(max_size, ttl)
+        self._near = OrderedDict()  # scope -> OrderedDict(key -> unit-length embedding)
+        self._near_count = 0  # embeddings held over all scopes
+        self._lock = threading.Lock()
+        self.exact_hits = self.similar_hits = self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def key(scope, messages):
+        return hashlib.sha256(json.dumps([scope, messages], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _scope_entries(self, scope):
+        # caller holds self._lock
+        entries = self._near.get(scope)
+        if entries is None:
+            entries = OrderedDict()
+            if isinstance(self.store, SqliteStore):
+                for key, emb in self.store.embeddings(scope):
+                    entries[key] = emb
+            self._near[scope] = entries
+            self._near_count += len(entries)
+        self._near.move_to_end(scope)
+        self._trim()
+        return entries
+
+    def _trim(self):
+        # caller holds self._lock. There is a scope per data version and per evidence set, so the
+        # embeddings are bounded over all scopes, least recently used scope first
+        while len(self._near) > 1 and (self._near_count > self.max_size or len(self._near) > self.max_size):
+            _, dropped = self._near.popitem(last=False)
+            self._near_count -= len(dropped)
+        if self._near:
+            entries = next(reversed(self._near.values()))
+            while self._near_count > self.max_size and entries:
+                entries.popitem(last=False)
+                self._near_count -= 1
+
+    def get(self, scope, messages, embedding=None):
+        """Cached answer for these messages, or for a similar enough question, else None"""
+        if not self.enabled:
+            return None
+        answer = self.store.get(self.key(scope, messages))
+        if answer is not None:
+            self.exact_hits += 1
+            return answer
+        if self.similarity > 0 and embedding is not None:
+            q = _unit(embedding)
+            with self._lock:
+                entries = self._scope_entries(scope)
+                keys = list(entries)
+                sims = np.stack(list(entries.values())) @ q if keys else np.empty(0)
+            for i in np.argsort(-sims):
+                if sims[i] < self.similarity:
+                    break
+                answer = self.store.get(keys[i])
+                if answer is not None:
+                    self.similar_hits += 1
+                    return answer
+                with self._lock:
+                    # evicted or expired meanwhile
+                    if entries.pop(keys[i], None) is not None and self._near.get(scope) is entries:
+                        self._near_count -= 1
+        self.misses += 1
+        return None
+
+    def put(self, scope, messages, answer, embedding=None):
+        if not self.enabled:
+            return
+        key = self.key(scope, messages)
+        emb = _unit(embedding) if embedding is not None and self.similarity > 0 else None
+        if isinstance(self.store, SqliteStore):
+            self.store.put(key, answer, scope=scope, embedding=emb)
+        else:
+            self.store.put(key, answer)
+        if emb is not None:
+            with self._lock:
+                entries = self._scope_entries(scope)
+                if key not in entries:
+                    self._near_count += 1
+                entries[key] = emb
+                self._trim()
+
+    def stats(self):
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "backend": "sqlite" if isinstance(self.store, SqliteStore) else "memory",
+            "size": len(self.store),
+            "max_size": self.max_size,
+            "similarity_threshold": self.similarity,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+def _unit(v):
+    v = np.asarray(v, dtype="float32").ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+responses = ResponseCache()
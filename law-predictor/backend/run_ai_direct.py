@@ -1,10 +1,59 @@
 import argparse
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from predictor import trend_predictor
+from docstore import with_text, MetaStore
+import vector_index
 from sentence_transformers import SentenceTransformer
 import faiss, os
 from dotenv import load_dotenv
 
+def retrieve_all(embedder, indexes, vectors, docs_meta, qtexts, top_k):
+    """Embed all queries in batches and search them in one call per index shard"""
+    q_emb = embedder.encode(qtexts, show_progress_bar=len(qtexts) > 100).astype("float32")
+    D, I = vector_index.search_shards(indexes, q_emb, top_k, vectors=vectors)
+    return [[with_text(row) for row in docs_meta.get_many(ids)] for ids in I]
+
+def read_queries(path):
+    """JSONL with one {"question", "facts"?, "top_k"?} object per line ("q" also accepted)"""
+    queries = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                queries.append(json.loads(line))
+    return queries
+
+def run_batch(args, embedder, indexes, vectors, docs_meta):
+    queries = read_queries(args.input)
+    qtexts, top_ks = [], []
+    for q in queries:
+        question, facts = q.get("question", q.get("q", "")), q.get("facts", "")
+        qtexts.append(question + ("\n" + facts if facts else ""))
+        top_ks.append(int(q.get("top_k", args.top_k)))
+    print(f"🔍 Retrieving evidence for {len(qtexts)} queries...", file=sys.stderr)
+    retrieved = retrieve_all(embedder, indexes, vectors, docs_meta, qtexts, max(top_ks, default=0)) if qtexts else []
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    done = 0
+    try:
+        # LLM calls in parallel; each result is written as soon as it is ready
+        with ThreadPoolExecutor(max_workers=args.parallel) as pool:
+            futures = {pool.submit(trend_predictor, qtexts[i], retrieved[i][:top_ks[i]]): i for i in range(len(qtexts))}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    result = {"question": qtexts[i], "error": f"Prediction failed: {str(e)}"}
+                out.write(json.dumps({"index": i, **result}, ensure_ascii=False) + "\n")
+                out.flush()
+                done += 1
+                print(f"✅ {done}/{len(qtexts)}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
 def main():
     # Load environment variables
     load_dotenv()
@@ -14,34 +63,41 @@ def main():
     INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index/index.faiss")
     META_PATH = os.getenv("DOCS_META_PATH", "./faiss_index/docs_meta.jsonl")
 
+    # Parse user input
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--q", type=str, help="Legal question")
+    parser.add_argument("--facts", type=str, default="", help="Supporting facts")
+    parser.add_argument("--top_k", type=int, default=5, help="Number of chunks to retrieve")
+    parser.add_argument("--input", type=str, help="JSONL file of queries to run in one go instead of --q")
+    parser.add_argument("--output", type=str, help="Where to write the JSONL results of --input (default: stdout)")
+    parser.add_argument("--parallel", type=int, default=int(os.getenv("BATCH_LLM_PARALLEL", "2")),
+                        help="LLM calls in flight at once with --input")
+    args = parser.parse_args()
+    if not args.q and not args.input:
+        parser.error("one of --q or --input is required")
+
     # Load embedding model
     embedder = SentenceTransformer(EMBED_MODEL)
 
-    # Load FAISS index
-    index = faiss.read_index(INDEX_PATH)
+    # Load FAISS index (every shard of it, when ingested with --shards)
+    indexes = [vector_index.set_search_params(faiss.read_index(path))
+               for path in vector_index.find_shards(INDEX_PATH) if os.path.exists(path)]
+    vectors = vector_index.VectorStore(dimension=indexes[0].d).reader()
 
     # Load metadata
-    with open(META_PATH, "r", encoding="utf-8") as f:
-        docs_meta = [json.loads(line) for line in f]
+    docs_meta = MetaStore(META_PATH)
 
-    # Parse user input
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--q", type=str, required=True, help="Legal question")
-    parser.add_argument("--facts", type=str, default="", help="Supporting facts")
-    parser.add_argument("--top_k", type=int, default=5, help="Number of chunks to retrieve")
-    args = parser.parse_args()
+    if args.input:
+        run_batch(args, embedder, indexes, vectors, docs_meta)
+        return
 
     question = args.q
     facts = args.facts
     top_k = args.top_k
     qtext = question + ("\n" + facts if facts else "")
-    q_emb = embedder.encode([qtext]).astype("float32")
 
     # Search index
-    D, I = index.search(q_emb, top_k)
-    raw_retrieved = [docs_meta[idx] for idx in I[0] if 0 <= idx < len(docs_meta)]
-
-    retrieved = raw_retrieved  # Use all retrieved docs, no keyword filtering
+    retrieved = retrieve_all(embedder, indexes, vectors, docs_meta, [qtext], top_k)[0]  # Use all retrieved docs, no keyword filtering
 
     # Run prediction
     result = trend_predictor(qtext, retrieved)
@@ -52,4 +108,4 @@ def main():
 
 # Ensure script runs only once
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,463 @@
+import os
+import gc
+import time
+import hashlib
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+import snapshots
+from case_stats import load_case_data, CASE_DATA_PATH
+from cache import TTLCache
+from filters import load_filters, spec_key, FILTERS_PATH, FILTER_EXACT_MAX
+from delta import DeltaIndex, DELTA_ID_BASE
+
+# Heavy dependencies (sentence_transformers/torch, faiss) are imported by warm_up(),
+# not at module import, so the server can accept connections straight away.
+EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./faiss_index/index.faiss")
+META_PATH = os.getenv("DOCS_META_PATH", "./faiss_index/docs_meta.jsonl")  # stays jsonl
+PROCESS_START = time.time()
+# Multi-worker serving: the index is memory-mapped read-only, so its pages sit in the page cache
+# once for all workers, and with SERVE_PRELOAD=1 (gunicorn.conf.py sets it) the model and index
+# are loaded at import, in the master before it forks, so workers share them copy-on-write.
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "0") == "1"
+# Normalized query text -> embedding, and (embedding, top_k, index version) -> vector IDs
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+EMBED_CACHE_TTL_S = float(os.getenv("EMBED_CACHE_TTL_S", "86400"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "10000"))
+SEARCH_CACHE_TTL_S = float(os.getenv("SEARCH_CACHE_TTL_S", "3600"))
+# Hot reload: every worker checks snapshots/CURRENT (see snapshots.py) and case.txt this often
+# and loads a new version next to the one it serves. 0 leaves it to POST /admin/reload.
+INDEX_RELOAD_POLL_S = float(os.getenv("INDEX_RELOAD_POLL_S", "5"))
+
+class IndexSnapshot:
+    """
+    One loaded version of the index with its metadata, exact vectors and filters. Requests pin
+    the snapshot they start on; a reload swaps in the next one, and the old one is closed once
+    the last request pinned to it has finished.
+    """
+    def __init__(self, version=None, index=None, docs_meta=None, vectors=None, filters=None, source=None):
+        self.version, self.index, self.docs_meta, self.vectors, self.filters = version, index, docs_meta, vectors, filters
+        self.source = source  # snapshot directory, None for the live index files
+        self.sources = frozenset(snapshots.info(source).get("sources", []))  # sha256 of the files it holds
+        self.loaded_at = time.time()
+        self.pins = 0
+        self.retired = False
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        if self.docs_meta is not None:
+            self.docs_meta.close()
+        self.index = self.docs_meta = self.vectors = self.filters = None
+
+    def info(self):
+        return {
+            "version": self.version,
+            "source": self.source,
+            "vectors": self.index.ntotal if self.index is not None else 0,
+            "loaded_at": self.loaded_at,
+            "requests": self.pins,
+        }
+
+# The snapshot the running request pinned; copied into the threads it hands work to
+_pinned = contextvars.ContextVar("index_snapshot", default=None)
+
+def _release(snapshot):
+    def run():
+        snapshot.close()
+        gc.collect()
+        print(f"♻️ Released index version {snapshot.version}")
+    if snapshot.index is not None:
+        threading.Thread(target=run, name="snapshot-release", daemon=True).start()
+
+class ServingState:
+    """What the routes serve from. Filled in by warm_up() while the server is already up."""
+    def __init__(self):
+        self.case_data = []
+        self.embedder = None
+        self.snapshot = IndexSnapshot()
+        self.draining = []  # replaced snapshots that requests still pin
+        self.case_version = None
+        self.reloads = 0
+        self.reload_error = None
+        self.ready = threading.Event()
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        """The snapshot pinned by the running request, else the latest one"""
+        return _pinned.get() or self.snapshot
+
+    @property
+    def index(self):
+        return self.current.index
+
+    @property
+    def docs_meta(self):
+        return self.current.docs_meta
+
+    @property
+    def vectors(self):
+        return self.current.vectors
+
+    @property
+    def filters(self):
+        return self.current.filters
+
+    @property
+    def index_version(self):
+        return self.current.version
+
+    @contextmanager
+    def pin(self, snapshot=None):
+        """Keep a snapshot (the current one by default) open, and current, for the enclosed work"""
+        with self._lock:
+            snapshot = snapshot or self.current
+            snapshot.pins += 1
+        token = _pinned.set(snapshot)
+        try:
+            yield snapshot
+        finally:
+            _pinned.reset(token)
+            with self._lock:
+                snapshot.pins -= 1
+                done = snapshot.retired and snapshot.pins == 0
+                if done:
+                    self.draining.remove(snapshot)
+            if done:
+                _release(snapshot)
+
+    def swap(self, snapshot):
+        """Serve `snapshot` from now on. The one it replaces is released once no request pins it."""
+        with self._lock:
+            old, self.snapshot = self.snapshot, snapshot
+            old.retired = True
+            if old.pins:
+                self.draining.append(old)
+        if snapshot.version != old.version:
+            search_cache.clear()  # keyed by version anyway; this frees the old entries
+        dropped = uploaded.drop(snapshot.sources)
+        if dropped:
+            print(f"✅ Index version {snapshot.version} holds {dropped} uploaded document(s); dropped them from the upload index")
+        if not old.pins:
+            _release(old)
+        return old
+
+    def status(self):
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "embedder": self.embedder is not None,
+            "index": self.snapshot.index is not None,
+            "documents": len(self.snapshot.docs_meta) if self.snapshot.docs_meta is not None else 0,
+            "filters": self.snapshot.filters is not None,
+            "index_version": self.snapshot.version,
+            "draining_versions": [s.version for s in self.draining],
+            "reloads": self.reloads,
+            "reload_error": self.reload_error,
+            "case_records": len(self.case_data),
+            "case_version": self.case_version,
+            "timings_s": self.timings,
+        }
+
+state = ServingState()
+embedding_cache = TTLCache(EMBED_CACHE_SIZE, EMBED_CACHE_TTL_S)
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_S)
+filtered_searches = Counter()  # how filtered searches ran: "exact" scan, "index" search, or "empty" selection
+uploaded = DeltaIndex()  # uploads not in a published snapshot yet, searched next to it (see uploads.py)
+
+def file_version(path):
+    """Changes whenever the file is rewritten (ingest.py always replaces the index file)"""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+def case_data_version():
+    return file_version(CASE_DATA_PATH) if os.path.exists(CASE_DATA_PATH) else None
+
+def _timed(name, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    state.timings[name] = round(time.perf_counter() - t0, 3)
+    return result
+
+def load_index(directory=None):
+    """
+    (index, metadata, vectors, version) from a snapshot directory, or from the live index files
+    when `directory` is None; (None, None, None, None) when there is no index yet
+    """
+    import vector_index
+    from docstore import MetaStore
+    from shards import ShardedIndex, LocalShard, RemoteShard, SHARD_URLS
+    index_path, meta_path = snapshots.resolve(INDEX_PATH, directory), snapshots.resolve(META_PATH, directory)
+    paths = [] if SHARD_URLS else vector_index.find_shards(index_path)
+    if not ((SHARD_URLS or paths) and os.path.exists(meta_path)):
+        print("⚠️ FAISS index or metadata file not found. Run `python ingest.py` first.")
+        return None, None, None, None
+    vectors = None
+    if SHARD_URLS:
+        shards = []
+        for url in SHARD_URLS:
+            try:
+                shards.append(RemoteShard(url))
+            except Exception as e:
+                print(f"⚠️ Shard server {url} is not reachable, serving without it: {e}")
+        versions = [s.version for s in shards]
+    else:
+        shards, versions = [], []
+        for path in paths:
+            if not os.path.exists(path):
+                print(f"⚠️ Index shard {path} is missing, serving without it. Rebuild it with `python ingest.py --rebuild-shard`.")
+                continue
+            versions.append(file_version(path))
+            index = vector_index.read_index(path, mmap=FAISS_MMAP)
+            if vectors is None:
+                # exact vectors on disk (memory-mapped) to re-rank candidates of compressed indexes
+                vectors = vector_index.VectorStore(snapshots.resolve(vector_index.VECTORS_PATH, directory), dimension=index.d).reader()
+            # nprobe / efSearch for IVF and HNSW indexes (FAISS_NPROBE, FAISS_EF_SEARCH)
+            vector_index.set_search_params(index)
+            shards.append(LocalShard(os.path.basename(path), index, vectors))
+    if not shards:
+        return None, None, None, None
+    version = versions[0] if len(versions) == 1 else hashlib.blake2b("|".join(versions).encode(), digest_size=8).hexdigest()
+    # memory-mapped, rows are decoded only when a query returns them
+    docs_meta = MetaStore(meta_path)
+    print(f"✅ Loaded FAISS index with {len(docs_meta)} documents in {len(shards)} shard(s).")
+    return ShardedIndex(shards), docs_meta, vectors, version
+
+def load_snapshot():
+    """The snapshot snapshots/CURRENT names, loaded; the live index files until one is published"""
+    name, directory = snapshots.current()
+    index, docs_meta, vectors, version = load_index(directory)
+    filters = load_filters(snapshots.resolve(FILTERS_PATH, directory)) if index is not None else None
+    return IndexSnapshot(name or version, index, docs_meta, vectors, filters, source=directory)
+
+def load_embedder(encode=True):
+    from sentence_transformers import SentenceTransformer
+    embedder = SentenceTransformer(EMBED_MODEL)
+    if encode:
+        embedder.encode(["warm-up"], show_progress_bar=False)  # first call pays lazy init costs
+    return embedder
+
+def warm_up(encode=True):
+    """Load case data, index and embedding model, cheapest first, then mark the server ready"""
+    try:
+        state.case_data = _timed("case_data", load_case_data)
+        state.case_version = case_data_version()
+        try:
+            state.swap(_timed("index", load_snapshot))
+        except Exception as e:
+            print(f"⚠️ Error loading FAISS index: {e}")
+        try:
+            state.embedder = _timed("embedder", lambda: load_embedder(encode))
+        except Exception as e:
+            print(f"⚠️ Could not load embedder: {e}")
+    except Exception as e:
+        state.error = str(e)
+        print(f"❌ Warm-up failed: {e}")
+    state.timings["ready_after_start"] = round(time.time() - PROCESS_START, 3)
+    state.ready.set()
+    print(f"✅ Warm-up finished in {state.timings['ready_after_start']}s since process start: {state.timings}")
+
+def normalize_query(qtext):
+    return " ".join(qtext.lower().split())
+
+def embed_queries(qtexts):
+    """Embeddings of the queries, encoding only those not in the embedding cache (in one batch)"""
+    keys = [normalize_query(q) for q in qtexts]
+    embs = [embedding_cache.get(key) for key in keys]
+    missing = [i for i, emb in enumerate(embs) if emb is None]
+    if missing:
+        new = state.embedder.encode([qtexts[i] for i in missing]).astype("float32")
+        for i, emb in zip(missing, new):
+            embs[i] = emb
+            embedding_cache.put(keys[i], emb)
+    return np.stack(embs)
+
+def search_filtered(queries, k, selection, snapshot=None):
+    """
+    (D, I, shards left out) of the top-k among the vectors a filter allows. Small selections,
+    and indexes that cannot take an ID selector, are scanned exactly over the stored vectors.
+    """
+    import vector_index
+    snapshot = snapshot or state.current
+    if len(selection) == 0:
+        filtered_searches["empty"] += 1
+        return np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64"), []
+    vectors = snapshot.vectors
+    if (vectors is not None and selection.ids[-1] < len(vectors)
+            and (len(selection) <= FILTER_EXACT_MAX or not snapshot.index.supports_selector)):
+        filtered_searches["exact"] += 1
+        D, I = vector_index.exact_knn(vectors, selection.ids, queries, k)
+        return D, I, []
+    filtered_searches["index"] += 1
+    return snapshot.index.search(queries, k, selection)
+
+def search(queries, k, spec=None, snapshot=None):
+    """(D, I, shards left out) of the top-k in a snapshot and the uploads not in it yet"""
+    import vector_index
+    snapshot = snapshot or state.current
+    if snapshot.index is None:
+        D, I, left_out = np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64"), []
+    elif spec:
+        D, I, left_out = search_filtered(queries, k, snapshot.filters.select(spec), snapshot)
+    else:
+        D, I, left_out = snapshot.index.search(queries, k)
+    if len(uploaded):
+        D, I = vector_index.merge_results([(D, I), uploaded.search(queries, k, spec)], k)
+    return D, I, left_out
+
+def lookup_rows(ids, snapshot=None):
+    """Metadata rows of vector IDs in order, from the snapshot or the uploads; unknown IDs (-1 padding) are skipped"""
+    snapshot = snapshot or state.current
+    rows = (uploaded.get(vid) if vid >= DELTA_ID_BASE else snapshot.docs_meta.get(vid) if snapshot.docs_meta is not None else None
+            for vid in ids if vid >= 0)
+    return [row for row in rows if row is not None]
+
+def retrieve_many(qtexts, top_k, filters=None, snapshot=None):
+    """
+    Embed the queries in one batch and return, per query, the metadata rows (text filled in)
+    of its top_k chunks. top_k is one number for all queries or one per query, and so is
+    filters (a filters.filter_spec() or None). Searches already answered for the loaded index
+    are served from the search cache; the shards are searched in parallel and those that fail
+    or time out are left out of the answer. Everything comes from one index snapshot: the
+    given one, else the one the request pinned, else the latest; plus the uploads not in it.
+    """
+    from docstore import with_text
+    top_ks = [top_k] * len(qtexts) if isinstance(top_k, int) else list(top_k)
+    specs = list(filters) if isinstance(filters, list) else [filters] * len(qtexts)
+    with state.pin(snapshot) as snap:
+        if any(specs) and snap.index is not None and snap.filters is None:
+            raise ValueError("The index has no metadata filters; re-run ingest.py to build them.")
+        q_emb = embed_queries(qtexts)
+        keys = [(hashlib.blake2b(emb.tobytes(), digest_size=16).digest(), k, spec_key(spec), snap.version, uploaded.generation)
+                for emb, k, spec in zip(q_emb, top_ks, specs)]
+        ids = [search_cache.get(key) for key in keys]
+        missing = [i for i, found in enumerate(ids) if found is None]
+        groups = {}  # queries with the same filter are searched together
+        for i in missing:
+            groups.setdefault(keys[i][2], []).append(i)
+        for group in groups.values():
+            _, I, left_out = search(q_emb[group], max(top_ks[i] for i in group), specs[group[0]], snap)
+            for i, row in zip(group, I):
+                ids[i] = row[:top_ks[i]].copy()
+                if not left_out:  # a partial answer is not cached, the next search asks every shard again
+                    search_cache.put(keys[i], ids[i])
+        return [[with_text(row) for row in lookup_rows(found.tolist(), snap)] for found in ids]
+
+def retrieve(qtext, top_k, filters=None):
+    """Embed the query and return the metadata rows (text filled in) of its top_k chunks"""
+    return retrieve_many([qtext], top_k, filters)[0]
+
+_reload_lock = threading.Lock()
+
+def reload_index(force=False):
+    """
+    Load the snapshot CURRENT names next to the one serving and swap it in once it is loaded
+    and has answered a search; requests already running finish on the old one. Returns the
+    new IndexSnapshot, or None when CURRENT still names the serving one (unless `force`).
+    """
+    with _reload_lock:
+        old = state.snapshot
+        name, _ = snapshots.current()
+        if not force and (name is None or name == old.version):
+            return None
+        t0 = time.perf_counter()
+        snapshot = load_snapshot()
+        try:
+            if snapshot.index is None:
+                raise RuntimeError("no index to load")
+            if state.embedder is not None and snapshot.index.d != state.embedder.get_sentence_embedding_dimension():
+                raise RuntimeError(f"index dimension {snapshot.index.d} does not match the embedding model")
+            # one search pages in what every search touches (coarse centroids, upper graph levels)
+            snapshot.index.search(np.zeros((1, snapshot.index.d), dtype="float32"), 1)
+        except Exception:
+            snapshot.close()
+            raise
+        state.swap(snapshot)
+        state.reloads += 1
+        state.reload_error = None
+        state.timings["last_reload"] = round(time.perf_counter() - t0, 3)
+        print(f"🔄 Serving index version {snapshot.version} (was {old.version}), loaded in {state.timings['last_reload']}s")
+        return snapshot
+
+def reload_case_data(force=False):
+    """Reload case.txt when it changed. Returns True if it was reloaded."""
+    version = case_data_version()
+    if not force and version == state.case_version:
+        return False
+    case_data = load_case_data()
+    if not case_data and state.case_data:
+        # a file caught half-written, or emptied by mistake: keep what is loaded and retry
+        raise RuntimeError(f"{CASE_DATA_PATH} has no case records")
+    state.case_data = case_data  # data first: the version also scopes cached LLM answers
+    state.case_version = version
+    return True
+
+def start_reload_watcher(poll_s=INDEX_RELOAD_POLL_S):
+    """Reload the index when ingest publishes a snapshot, and case.txt when it changes"""
+    def run():
+        failed = {}  # version that last failed to load, per kind; not retried until it changes
+        while True:
+            time.sleep(poll_s)
+            if not state.ready.is_set():
+                continue
+            for what, on_disk, reload in (("index", lambda: snapshots.current()[0], reload_index),
+                                          ("case data", case_data_version, reload_case_data)):
+                version = None
+                try:
+                    version = on_disk()
+                    if version is None or failed.get(what) == version:
+                        continue
+                    reload()
+                    failed.pop(what, None)
+                except Exception as e:
+                    failed[what] = version
+                    state.reload_error = f"{what} {version}: {e}"
+                    print(f"⚠️ Could not reload {what} {version}, still serving the loaded one: {e}")
+    thread = threading.Thread(target=run, name="reload-watcher", daemon=True)
+    thread.start()
+    return thread
+
+def preload():
+    """
+    Load everything synchronously before the workers are forked. No warm-up encode here:
+    torch's thread pools do not survive a fork, so each worker runs its own first encode.
+    """
+    warm_up(encode=False)
+    gc.freeze()  # keep the loaded objects out of GC passes, which would copy their pages in every worker
+
+def warm_up_worker():
+    """In a forked worker whose state was preloaded: pay the lazy init of the first encode"""
+    def run():
+        t0 = time.perf_counter()
+        if state.embedder is not None:
+            state.embedder.encode(["warm-up"], show_progress_bar=False)
+        state.timings["worker_encode"] = round(time.perf_counter() - t0, 3)
+    threading.Thread(target=run, name="worker-warm-up", daemon=True).start()
+
+def memory_usage():
+    """This process's memory in MB. PSS splits shared pages between the processes mapping them."""
+    try:
+        with open("/proc/self/smaps_rollup") as fh:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in fh if line.endswith("kB\n")}
+    except OSError:
+        return {}
+    shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    return {
+        "pid": os.getpid(),
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "shared_mb": round(shared / 1024, 1),
+        "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1),
+    }
+
+def start_warm_up():
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,91 @@
+import os
+import time
+import threading
+from typing import List, Optional
+import numpy as np
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+import snapshots
+import vector_index
+from filters import load_filters, FILTERS_PATH, FILTER_EXACT_MAX
+from serving import file_version, FAISS_MMAP, INDEX_RELOAD_POLL_S
+
+# One index shard behind HTTP, so main.py can fan a search out to shards in other processes or
+# on other nodes (FAISS_SHARD_URLS). For example, one server per shard of a 4-way ingest:
+#   FAISS_SHARD_PATH=./faiss_index/index.shard0-of-4.faiss uvicorn shard_server:app --port 8101
+# Once ingest.py publishes snapshots the shard file is read from the current one, and a new
+# snapshot is loaded and swapped in while this server keeps answering from the old one.
+SHARD_PATH = os.getenv("FAISS_SHARD_PATH", "./faiss_index/index.faiss")
+
+class SearchRequest(BaseModel):
+    queries: List[List[float]]
+    k: int
+    filters: Optional[dict] = None  # filters.filter_spec() of the query
+
+class Shard:
+    """The shard index of one snapshot (or of the live files), with its exact vectors and filters"""
+    def __init__(self):
+        name, directory = snapshots.current()
+        self.path = snapshots.resolve(SHARD_PATH, directory)
+        self.index = vector_index.set_search_params(vector_index.read_index(self.path, mmap=FAISS_MMAP))
+        self.version = name or file_version(self.path)
+        # exact vectors for re-ranking compressed indexes, as in the main server
+        self.vectors = vector_index.VectorStore(snapshots.resolve(vector_index.VECTORS_PATH, directory), dimension=self.index.d).reader()
+        self.filters = load_filters(snapshots.resolve(FILTERS_PATH, directory))
+        print(f"✅ Serving shard {self.path} (version {self.version}) with {self.index.ntotal} vectors.")
+
+app = FastAPI(title="FAISS index shard")
+shard = Shard()
+
+def watch():
+    # a request holds on to the Shard it started with; the old one is freed after the last of them
+    global shard
+    failed = None
+    while True:
+        time.sleep(INDEX_RELOAD_POLL_S)
+        name, _ = snapshots.current()
+        if name not in (None, shard.version, failed):
+            try:
+                shard = Shard()
+            except Exception as e:
+                failed = name
+                print(f"⚠️ Could not load shard of snapshot {name}, still serving {shard.version}: {e}")
+
+if INDEX_RELOAD_POLL_S > 0:
+    threading.Thread(target=watch, name="reload-watcher", daemon=True).start()
+
+@app.get("/info")
+def info():
+    current = shard
+    return {"path": current.path, "d": current.index.d, "ntotal": current.index.ntotal, "version": current.version,
+            "type": vector_index.describe(current.index), "supports_selector": vector_index.supports_selector(current.index)}
+
+def search_filtered(current, queries, k, spec):
+    """Top-k among the vectors the filter allows, scanned exactly as in serving.search_filtered when small or on a PQ index"""
+    if current.filters is None:
+        raise HTTPException(status_code=400, detail="This shard has no metadata filters; re-run ingest.py")
+    selection = current.filters.select(spec)
+    if len(selection) == 0:
+        return np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64")
+    index, vectors = current.index, current.vectors
+    if (vectors is not None and selection.ids[-1] < len(vectors)
+            and (len(selection) <= FILTER_EXACT_MAX or not vector_index.supports_selector(index))):
+        return vector_index.exact_knn(vectors, selection.ids, queries, k)
+    if not vector_index.supports_selector(index):
+        raise HTTPException(status_code=400, detail=f"A {vector_index.describe(index)} shard without its exact vectors cannot be searched with a filter")
+    return vector_index.search(index, queries, k, vectors=vectors, params=vector_index.selector_params(index, selection.selector))
+
+@app.post("/search")
+def search(req: SearchRequest):
+    # a plain def route runs in the threadpool; FAISS releases the GIL while searching
+    current = shard
+    index = current.index
+    queries = np.asarray(req.queries, dtype="float32").reshape(-1, index.d)
+    if index.ntotal == 0:
+        return {"distances": [[float(np.finfo("float32").max)] * req.k] * len(queries), "ids": [[-1] * req.k] * len(queries)}
+    if req.filters:
+        D, I = search_filtered(current, queries, req.k, req.filters)
+    else:
+        D, I = vector_index.search(index, queries, req.k, vectors=current.vectors)
+    D = np.nan_to_num(D, posinf=np.finfo("float32").max)  # JSON has no infinity
+    return {"distances": D.tolist(), "ids": I.tolist()}
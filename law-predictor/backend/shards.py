@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+import httpx
+import numpy as np
+import vector_index
+
+# Scatter-gather search over the index shards written by `ingest.py --shards N`. Each shard is
+# searched in its own thread (FAISS releases the GIL while it searches), or by a shard server
+# process (shard_server.py, on this node or another) when FAISS_SHARD_URLS lists them. The
+# per-shard top-k lists are merged by distance; a shard that fails or misses its timeout is left
+# out and the answer comes from the shards that did reply. A shard that keeps failing is not
+# asked at all for FAISS_SHARD_EJECT_S, then tried again. A shard that is merely busy with other
+# searches is waited for, never skipped.
+SHARD_URLS = [u.strip() for u in os.getenv("FAISS_SHARD_URLS", "").split(",") if u.strip()]
+SHARD_TIMEOUT_S = float(os.getenv("FAISS_SHARD_TIMEOUT_S", "2"))
+SHARD_THREADS = int(os.getenv("FAISS_SHARD_THREADS", "8"))  # concurrent searches per shard before they queue
+SHARD_EJECT_AFTER = int(os.getenv("FAISS_SHARD_EJECT_AFTER", "3"))  # consecutive errors or timeouts
+SHARD_EJECT_S = float(os.getenv("FAISS_SHARD_EJECT_S", "10"))
+
+class ShardSearchError(RuntimeError):
+    """No shard answered a search"""
+
+class LocalShard:
+    """A shard index loaded in this process"""
+    def __init__(self, name, index, vectors=None):
+        self.name, self.index, self.vectors = name, index, vectors
+        self.d, self.ntotal = index.d, index.ntotal
+        self.supports_selector = vector_index.supports_selector(index)
+
+    def search(self, queries, k, selection=None):
+        if self.ntotal == 0:
+            return np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64")
+        params = None
+        if selection is not None:
+            if not self.supports_selector:
+                raise ValueError(f"a {vector_index.describe(self.index)} index cannot be searched with a filter")
+            params = vector_index.selector_params(self.index, selection.selector)
+        return vector_index.search(self.index, queries, k, vectors=self.vectors, params=params)
+
+class RemoteShard:
+    """A shard served by shard_server.py"""
+    def __init__(self, url, timeout=SHARD_TIMEOUT_S):
+        self.name = url
+        self.client = httpx.Client(base_url=url, timeout=timeout)
+        info = self.client.get("/info").raise_for_status().json()
+        self.d, self.ntotal, self.version = info["d"], info["ntotal"], info["version"]
+        # a PQ shard cannot take an ID selector; the main server then scans small selections itself
+        self.supports_selector = info.get("supports_selector", info.get("type") != "pq")
+
+    def search(self, queries, k, selection=None):
+        # the shard server resolves the filter against its own copy of the ID sets
+        request = {"queries": queries.tolist(), "k": k, "filters": selection.spec if selection is not None else None}
+        body = self.client.post("/search", json=request).raise_for_status().json()
+        return np.asarray(body["distances"], dtype="float32"), np.asarray(body["ids"], dtype="int64")
+
+    def close(self):
+        self.client.close()
+
+class _ShardStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.searches = self.errors = self.timeouts = self.busy = self.skipped = self.ejections = 0
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+        self.latency = deque(maxlen=1000)
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.ejected_until
+
+    def failed(self, name, reason):
+        self.failures += 1
+        if self.failures >= SHARD_EJECT_AFTER:
+            if self.healthy:
+                self.ejections += 1
+                print(f"⚠️ Index shard {name} ejected for {SHARD_EJECT_S:.0f}s: {reason}")
+            self.ejected_until = time.monotonic() + SHARD_EJECT_S
+
+class ShardedIndex:
+    """
+    The shards searched as one index. search() returns the merged (D, I) and the names of the
+    shards whose results are missing from it, so callers can tell a partial answer apart.
+    """
+    def __init__(self, shards, timeout=SHARD_TIMEOUT_S, threads=SHARD_THREADS):
+        self.shards, self.timeout = shards, timeout
+        self.d = shards[0].d if shards else 0
+        self._stats = {s.name: _ShardStats() for s in shards}
+        self._lock = threading.Lock()
+        # enough threads that concurrent searches (EMBED_WORKERS, /predict/batch) rarely queue; a
+        # thread stuck in a timed-out search holds one until its shard is ejected
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(shards) * threads), thread_name_prefix="shard-search")
+        self.partial = 0
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def ntotal(self):
+        return sum(s.ntotal for s in self.shards)
+
+    def _run(self, shard, queries, k, selection):
+        stats = self._stats[shard.name]
+        t0 = time.perf_counter()
+        try:
+            return shard.search(queries, k, selection)
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+                stats.latency.append(time.perf_counter() - t0)
+
+    @property
+    def supports_selector(self):
+        return all(s.supports_selector for s in self.shards)
+
+    def search(self, queries, k, selection=None):
+        """
+        Top-k over all shards, merged by distance: (D, I, names of the shards left out).
+        With a filters.Selection only the vectors it allows are searched.
+        """
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        futures, left_out = {}, []
+        for shard in self.shards:
+            stats = self._stats[shard.name]
+            with self._lock:
+                if not stats.healthy:
+                    stats.skipped += 1
+                    left_out.append(shard.name)
+                    continue
+                stats.in_flight += 1
+                stats.searches += 1
+            futures[self._pool.submit(self._run, shard, queries, k, selection)] = shard
+        _, late = wait(futures, timeout=self.timeout)
+        results = []
+        for fut, shard in futures.items():
+            stats = self._stats[shard.name]
+            if fut in late:
+                if fut.cancel():
+                    # never started: queued behind other searches, which says nothing about the shard
+                    stats.busy += 1
+                    with self._lock:
+                        stats.in_flight -= 1
+                else:
+                    stats.timeouts += 1
+                    stats.failed(shard.name, f"no answer within {self.timeout}s")
+                left_out.append(shard.name)
+                continue
+            try:
+                results.append(fut.result())
+                stats.failures = 0
+            except Exception as e:
+                stats.errors += 1
+                stats.failed(shard.name, e)
+                left_out.append(shard.name)
+        if not results:
+            raise ShardSearchError(f"No index shard answered ({', '.join(left_out)})")
+        if left_out:
+            self.partial += 1
+        D, I = vector_index.merge_results(results, k)
+        return D, I, left_out
+
+    def stats(self):
+        def pct(samples, q):
+            return round(float(np.percentile(samples, q)) * 1000, 2) if samples else 0.0
+        return {
+            "timeout_s": self.timeout,
+            "partial_searches": self.partial,
+            "shards": {
+                s.name: {
+                    "vectors": s.ntotal,
+                    "healthy": self._stats[s.name].healthy,
+                    "in_flight": self._stats[s.name].in_flight,
+                    "searches": self._stats[s.name].searches,
+                    "errors": self._stats[s.name].errors,
+                    "timeouts": self._stats[s.name].timeouts,
+                    "busy": self._stats[s.name].busy,
+                    "skipped": self._stats[s.name].skipped,
+                    "ejections": self._stats[s.name].ejections,
+                    "latency_ms_p50": pct(self._stats[s.name].latency, 50),
+                    "latency_ms_p99": pct(self._stats[s.name].latency, 99),
+                }
+                for s in self.shards
+            },
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        for shard in self.shards:
+            if hasattr(shard, "close"):
+                shard.close()
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import shutil
+
+# Versioned index snapshots. After each complete run ingest.py publishes the index shards,
+# metadata, exact vectors and filter files as snapshots/v<version>/ (hard links, so unchanged
+# files cost no space) and then points snapshots/CURRENT at it. Servers load the snapshot
+# CURRENT names and watch it, so ingest can rewrite the live files while they keep serving the
+# last complete version. Ingest only ever appends to vectors.f32 (a rebuild starts a new file)
+# and keeps the texts/ of documents the retained snapshots refer to.
+SNAPSHOT_DIR = os.getenv("FAISS_SNAPSHOT_DIR", "./faiss_index/snapshots")
+SNAPSHOT_KEEP = int(os.getenv("FAISS_SNAPSHOT_KEEP", "3"))  # published snapshots kept on disk
+CURRENT = "CURRENT"
+
+def _version(name):
+    try:
+        return int(name[1:]) if name.startswith("v") else None
+    except ValueError:
+        return None
+
+def published():
+    """Names of the published snapshots, oldest first"""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    names = [n for n in os.listdir(SNAPSHOT_DIR) if _version(n) is not None and os.path.isdir(os.path.join(SNAPSHOT_DIR, n))]
+    return sorted(names, key=_version)
+
+def latest_version():
+    """Highest version published so far (0 if none), so a rebuilt manifest never reuses a name"""
+    names = published()
+    return _version(names[-1]) if names else 0
+
+def current():
+    """(name, directory) of the snapshot CURRENT points at, or (None, None) before the first publish"""
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, CURRENT), "r", encoding="utf-8") as fh:
+            name = fh.read().strip()
+    except FileNotFoundError:
+        return None, None
+    path = os.path.join(SNAPSHOT_DIR, name)
+    return (name, path) if name and os.path.isdir(path) else (None, None)
+
+def info(directory):
+    """The snapshot.json of a snapshot directory ({} for the live index files)"""
+    if not directory:
+        return {}
+    try:
+        with open(os.path.join(directory, "snapshot.json"), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+def resolve(path, directory):
+    """Where the file `path` of the live index is found in a snapshot directory (None: the live file)"""
+    return os.path.join(directory, os.path.basename(path)) if directory else path
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:  # no hard links on this filesystem
+        shutil.copy2(src, dst)
+
+def publish(version, paths, info=None):
+    """
+    Publish the files `paths` as snapshot v<version> and point CURRENT at it. The directory
+    is filled under a temporary name and renamed, then CURRENT is replaced; a snapshot that
+    already exists is only pointed at again. Returns the snapshot name.
+    """
+    name = f"v{version}"
+    path = os.path.join(SNAPSHOT_DIR, name)
+    if not os.path.isdir(path):
+        tmp = os.path.join(SNAPSHOT_DIR, f".{name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        files = []
+        for src in paths:
+            if os.path.exists(src):
+                _link(src, os.path.join(tmp, os.path.basename(src)))
+                files.append(os.path.basename(src))
+        with open(os.path.join(tmp, "snapshot.json"), "w", encoding="utf-8") as fh:
+            json.dump(dict(info or {}, version=version, published_at=time.time(), files=files), fh)
+        os.rename(tmp, path)
+    tmp = os.path.join(SNAPSHOT_DIR, CURRENT + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(name + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, os.path.join(SNAPSHOT_DIR, CURRENT))
+    return name
+
+def prune(keep=SNAPSHOT_KEEP):
+    """
+    Delete all but the newest `keep` snapshots (never the current one). A server still on a
+    deleted snapshot is unaffected: it opened every file when it loaded it.
+    """
+    names = published()
+    current_name, _ = current()
+    for name in names[:-max(1, keep)]:
+        if name != current_name:
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, name), ignore_errors=True)
+    return published()
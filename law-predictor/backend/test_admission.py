@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from admission import LLMScheduler, Overloaded
+
+CLASSES = {"chat": (0, 2), "predict": (1, 2), "batch": (2, 1)}
+
+def scheduler(**kwargs):
+    options = dict(capacity=2, max_queue=4, max_wait_s=60, classes=CLASSES, service_estimate_s=15, max_backlog=8)
+    options.update(kwargs)
+    return LLMScheduler(**options)
+
+async def hold(sched, cls, release, order=None, shed=True):
+    async with sched.slot(cls, shed=shed):
+        if order is not None:
+            order.append(cls)
+        await release.wait()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_queued_batch_work_does_not_shed_chat():
+    async def run():
+        sched, release = scheduler(), asyncio.Event()
+        tasks = [asyncio.create_task(hold(sched, "chat", release)) for _ in range(2)]
+        tasks += [asyncio.create_task(hold(sched, "batch", release, shed=False)) for _ in range(6)]
+        await settle()
+        assert sched.backlog("batch") == 6 and sched.ahead("chat") == 0
+        sched.check("chat")  # 6 batch waiters > max_queue, but none of them is ahead of chat
+        sched.check("predict")
+        with pytest.raises(Overloaded) as e:
+            sched.check("batch")
+        assert e.value.status_code == 503  # 7 generations ahead at one batch slot
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+
+def test_queue_full_counts_waiters_of_same_or_higher_priority():
+    async def run():
+        sched, release = scheduler(), asyncio.Event()
+        tasks = [asyncio.create_task(hold(sched, "predict", release)) for _ in range(2 + 4)]
+        await settle()
+        sched.check("chat")
+        with pytest.raises(Overloaded) as e:
+            sched.check("predict")
+        assert e.value.status_code == 429 and e.value.retry_after >= 1
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+
+def test_batch_backlog_is_bounded():
+    async def run():
+        sched, release = scheduler(max_wait_s=10_000), asyncio.Event()
+        tasks = [asyncio.create_task(hold(sched, "batch", release, shed=False)) for _ in range(1 + 8)]
+        await settle()
+        assert sched.backlog("batch") == 8
+        with pytest.raises(Overloaded) as e:
+            sched.check("batch")
+        assert e.value.status_code == 429
+        sched.check("chat")
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+
+def test_long_wait_is_shed_with_503():
+    async def run():
+        sched, release = scheduler(max_wait_s=20), asyncio.Event()
+        tasks = [asyncio.create_task(hold(sched, "chat", release)) for _ in range(2 + 2)]
+        await settle()
+        with pytest.raises(Overloaded) as e:
+            sched.check("chat")  # 3 ahead of it, 2 at a time: 22.5s
+        assert e.value.status_code == 503 and e.value.retry_after == 23
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
+
+def test_waiters_are_served_by_priority():
+    async def run():
+        sched, release, order = scheduler(max_queue=10), asyncio.Event(), []
+        running = [asyncio.create_task(hold(sched, "chat", release)) for _ in range(2)]
+        await settle()
+        later = asyncio.Event()
+        waiting = [asyncio.create_task(hold(sched, cls, later, order, shed=False)) for cls in ("batch", "predict", "chat")]
+        await settle()
+        release.set()
+        await asyncio.gather(*running)
+        await settle()
+        assert order == ["chat", "predict"]  # two slots free up; batch waits behind both
+        later.set()
+        await asyncio.gather(*waiting)
+        assert order == ["chat", "predict", "batch"]
+        assert sched.stats()["running"] == 0
+    asyncio.run(run())
+
+def test_shed_request_never_queues():
+    async def run():
+        sched, release = scheduler(max_queue=0), asyncio.Event()
+        tasks = [asyncio.create_task(hold(sched, "chat", release)) for _ in range(2)]
+        await settle()
+        with pytest.raises(Overloaded):
+            async with sched.slot("chat"):
+                pass
+        assert sched.stats()["queued"] == 0 and sched.rejected["chat"] == 1
+        release.set()
+        await asyncio.gather(*tasks)
+    asyncio.run(run())
@@ -0,0 +1,45 @@
+import random
+import pytest
+from formatting import clean_chat_response, MarkdownStream, MIN_RESPONSE_CHARS
+
+ANSWERS = [
+    "",
+    "Short answer.",
+    "I cannot provide legal advice, but here is what Section 420 says.",
+    "## Overview\nCheating is covered by Section 420.\n\n1. Dishonest inducement\n2. Delivery of property\n* fine\n- imprisonment",
+    "* leading bullet\nthen text\n\n\n\n## Heading\n\nWould that help?",
+    "Line one\r\nLine two\rLine three\r\n\r\n## Heading\r\n",
+    "   indented   \n\t\n1.5 years is the term.\n##no space heading\n",
+    "Intro\nI can't provide legal advice. Still,\nmore text here " + "x" * MIN_RESPONSE_CHARS,
+    "a" * (MIN_RESPONSE_CHARS - 1),
+    "a" * MIN_RESPONSE_CHARS,
+    "a\r\n" * (MIN_RESPONSE_CHARS // 3),
+]
+
+def streamed(tokens, case_context=""):
+    formatter = MarkdownStream(hold_chars=MIN_RESPONSE_CHARS if case_context else 0)
+    return "".join(formatter.feed(t) for t in tokens) + formatter.finish()
+
+def splits(text, rng):
+    """The text as single characters, as one token, and cut at random places"""
+    yield list(text)
+    yield [text]
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 8))))
+        yield [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+
+@pytest.mark.parametrize("case_context", ["", "📊 cases"])
+@pytest.mark.parametrize("answer", ANSWERS)
+def test_stream_matches_chat(answer, case_context):
+    expected = clean_chat_response(answer, case_context)
+    for tokens in splits(answer, random.Random(answer)):
+        assert streamed(tokens, case_context) == expected, tokens
+
+def test_crlf_split_across_tokens():
+    assert streamed(["a\r", "\nb"]) == clean_chat_response("a\r\nb") == "a\nb"
+
+def test_disclaimers_on_different_lines_differ_from_chat():
+    # /chat replaces the disclaimer listed first in DISCLAIMERS, the stream the one it meets first
+    answer = "Intro\nWould that help?\nI cannot provide legal advice, but x"
+    assert clean_chat_response(answer) == "Intro\nWould that help?\nBased on historical legal data and case analysis, x"
+    assert streamed([answer]) == "Intro\nBased on historical legal data and case analysis,\nI cannot provide legal advice, but x"
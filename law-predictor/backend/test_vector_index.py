@@ -0,0 +1,22 @@
+import numpy as np
+import faiss
+import pytest
+import vector_index
+
+DIMENSION, N = 32, 2000
+
+@pytest.mark.parametrize("kind", vector_index.INDEX_TYPES)
+def test_mmap_read_of_every_index_type(kind, tmp_path):
+    vecs = np.random.default_rng(0).random((N, DIMENSION), dtype="float32")
+    spec = vector_index.fit_spec(vector_index.index_spec(kind, nlist=16, pq_m=8, pq_nbits=4, hnsw_m=8), N)
+    writer = vector_index.IndexWriter(vector_index.build_index(DIMENSION, spec), spec, DIMENSION, train_on=N)
+    writer.add(vecs, np.arange(N))
+    index = vector_index.set_search_params(writer.finish())
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(index, path)
+
+    loaded = vector_index.set_search_params(vector_index.read_index(path, mmap=True))
+    assert vector_index.describe(loaded) == kind and loaded.ntotal == N
+    D, I = vector_index.search(loaded, vecs[:5], 3)
+    assert I.shape == (5, 3) and (I >= 0).all()
+    assert np.array_equal(I, vector_index.search(index, vecs[:5], 3)[1])
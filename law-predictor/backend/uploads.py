@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process, nothing to coordinate with
+    fcntl = None
+import docstore
+from cache import TTLCache
+from serving import state, uploaded
+
+# POST /upload streams a document to UPLOAD_DIR; a background worker then extracts, chunks and
+# embeds it with ingest.py's own functions and adds it to the upload index searched next to the
+# loaded snapshot (serving.uploaded), so a new filing can be queried seconds after it arrives.
+# The files stay in UPLOAD_DIR, which the next offline run of ingest.py covers by default; once a
+# published snapshot holds a document, its upload vectors are dropped. One process indexes each
+# upload and saves its chunks (delta.DELTA_DIR); every server process scans UPLOAD_DIR and loads
+# the saved chunks, so an upload to one gunicorn worker is searchable in all of them, and after a
+# restart, without being extracted and embedded again.
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./data/uploads")
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "50"))
+UPLOAD_READ_BYTES = 1 << 20  # copied from the request to disk at a time
+UPLOAD_FORM_OVERHEAD = 64 * 1024  # multipart boundaries, headers and the doc_type field
+UPLOAD_EMBED_BATCH = int(os.getenv("UPLOAD_EMBED_BATCH", "16"))  # small, so query encodes get in between
+UPLOAD_SCAN_S = float(os.getenv("UPLOAD_SCAN_S", "5"))  # how often UPLOAD_DIR is checked for uploads to other workers
+UPLOAD_TYPES = (".pdf", ".html", ".htm", ".txt")
+TYPE_DIRS = {"statute": "statutes", "judgment": "judgments"}  # filters.doc_type_of() reads the type from these
+JOBS_DIR = os.path.join(UPLOAD_DIR, ".jobs")
+FINAL = ("indexed", "failed")
+_JOB_ID = re.compile(r"[0-9a-f]{16}")
+
+class UploadRejected(Exception):
+    """An upload that is not accepted; maps to its HTTP status"""
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code, self.detail = status_code, detail
+
+def check_upload_length(content_length):
+    """
+    Reject an upload by its Content-Length header, before the body is read: the form parser
+    spools the whole body to disk before accept() sees a byte of it. The header counts the
+    multipart framing too, so a little over UPLOAD_MAX_MB is let through; accept() enforces
+    the exact limit on the file itself.
+    """
+    if content_length is None:
+        raise UploadRejected(411, "Uploads need a Content-Length header.")
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise UploadRejected(400, "Invalid Content-Length header.")
+    if length > UPLOAD_MAX_MB * 1024 * 1024 + UPLOAD_FORM_OVERHEAD:
+        raise UploadRejected(413, f"Uploads are limited to {UPLOAD_MAX_MB:g} MB.")
+
+def _safe_name(filename):
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(filename or "")).strip("._")
+    return name[-120:] or "upload"
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, job_id + ".json")
+
+def load_job(job_id):
+    """A job's last saved status, from whichever process wrote it"""
+    if not _JOB_ID.fullmatch(job_id or ""):
+        return None
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+@contextmanager
+def _claim(sha):
+    """
+    Yields whether this process may index the document: an flock held by whoever is indexing
+    it, released when that process finishes or dies
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(uploaded.directory, exist_ok=True)
+    path = os.path.join(uploaded.directory, sha + ".lock")
+    with open(path, "a") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            # whoever takes a new lock file after this checks for the saved chunks first
+            os.remove(path)
+
+class UploadWorker:
+    """
+    Accepts uploads and indexes them one at a time in a background thread. Text extraction
+    runs in a separate process: parsing a large PDF holds the GIL for seconds, and searches
+    should not wait on it. Embedding uses the server's model in small batches.
+    """
+    def __init__(self):
+        self.jobs = TTLCache(1000)  # recent jobs of this process, in case their file cannot be read
+        self.indexed = self.loaded = self.failed = 0
+        self._queue = queue.Queue()
+        self._seen = set()  # upload paths this process has queued
+        self._lock = threading.Lock()
+        self._thread = None
+        self._extractor = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="upload-worker", daemon=True)
+                self._thread.start()
+
+    async def accept(self, file, doc_type=None):
+        """Stream an UploadFile to UPLOAD_DIR and queue it. Returns the job's status."""
+        name = _safe_name(file.filename)
+        if not name.lower().endswith(UPLOAD_TYPES):
+            raise UploadRejected(415, f"Only {', '.join(UPLOAD_TYPES)} files can be uploaded.")
+        job_id = uuid.uuid4().hex[:16]
+        directory = os.path.join(UPLOAD_DIR, TYPE_DIRS.get(doc_type, ""))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{job_id}-{name}")
+        sha, size = hashlib.sha256(), 0
+        try:
+            with open(path + ".part", "wb") as fh:
+                while True:
+                    block = await file.read(UPLOAD_READ_BYTES)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > UPLOAD_MAX_MB * 1024 * 1024:
+                        raise UploadRejected(413, f"Uploads are limited to {UPLOAD_MAX_MB:g} MB.")
+                    sha.update(block)
+                    fh.write(block)
+            os.replace(path + ".part", path)  # scans only ever see complete files
+        except BaseException:
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+            raise
+        job = {"job_id": job_id, "filename": file.filename, "path": path, "bytes": size, "sha256": sha.hexdigest(),
+               "doc_type": doc_type, "status": "queued", "created_at": time.time()}
+        with self._lock:
+            self._seen.add(path)
+        self._save(job)
+        self._queue.put((path, job, True))
+        self.start()
+        return dict(job)
+
+    def status(self, job_id):
+        # the saved status first: another process may be the one indexing the upload
+        job = load_job(job_id) or self.jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def _save(self, job):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        job["updated_at"] = time.time()
+        self.jobs.put(job["job_id"], job)
+        tmp = f"{_job_path(job['job_id'])}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(job, fh)
+        os.replace(tmp, _job_path(job["job_id"]))
+
+    def _scan(self):
+        """Queue uploads this process has not seen: accepted by another worker, or before a restart"""
+        for root, dirs, files in os.walk(UPLOAD_DIR):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.lower().endswith(UPLOAD_TYPES) or path in self._seen:
+                    continue
+                with self._lock:
+                    self._seen.add(path)
+                job = load_job(name.split("-", 1)[0])
+                if job is not None and job.get("status") == "failed":
+                    continue  # would fail here too
+                # a job another process has already finished is only loaded here, not reported again
+                self._queue.put((path, job, job is not None and job.get("status") not in FINAL))
+
+    def _run(self):
+        state.ready.wait()
+        last_scan = 0.0
+        while True:
+            if time.monotonic() - last_scan >= UPLOAD_SCAN_S:
+                self._scan()
+                last_scan = time.monotonic()
+            try:
+                path, job, report = self._queue.get(timeout=UPLOAD_SCAN_S)
+            except queue.Empty:
+                continue
+            try:
+                self._process(path, job, report)
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Upload {path} could not be indexed: {e}")
+                if report:
+                    self._save(dict(job, status="failed", error=str(e)))
+
+    def _extract(self, path, sha):
+        import ingest
+        if self._extractor is None:
+            self._extractor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return self._extractor.submit(ingest.extract_text, path, sha).result()
+
+    def _process(self, path, job, report):
+        import ingest
+        t0 = time.perf_counter()
+        job = dict(job or {})
+
+        def update(**fields):
+            job.update(fields)
+            if report:
+                self._save(job)
+
+        sha = job.get("sha256") or ingest.file_sha256(path)
+        if sha in state.snapshot.sources or sha in uploaded:
+            if sha in state.snapshot.sources:
+                uploaded.remove_saved(sha)
+            update(status="indexed", already_indexed=True)
+            return
+        if self._load(sha):
+            return
+        with _claim(sha) as claimed:
+            if not claimed:
+                # another process is indexing it; the next scan loads what it saves
+                with self._lock:
+                    self._seen.discard(path)
+                return
+            if self._load(sha):
+                return
+            self._index(path, sha, job, update, t0)
+
+    def _load(self, sha):
+        """Add the chunks another process (or this one before a restart) saved for the document"""
+        saved = uploaded.load(sha)
+        if saved is None:
+            return False
+        rows, vectors = saved
+        uploaded.add(sha, rows, vectors)
+        self.loaded += 1
+        return True
+
+    def _index(self, path, sha, job, update, t0):
+        import ingest
+        if state.embedder is None:
+            raise RuntimeError("the embedding model is not loaded")
+        update(status="extracting")
+        _, doc, n_words, attrs = self._extract(path, sha)
+        if doc is None:
+            raise ValueError(f"no text to index ({n_words} words extracted, at least 50 needed)")
+        buf = docstore.open_text(doc)
+        try:
+            spans = list(ingest.iter_chunk_spans(buf, chunk_size=ingest.CHUNK_WORDS, overlap=ingest.CHUNK_OVERLAP))
+            chunks = [buf[start:end].decode("utf-8", errors="replace") for start, end in spans]
+        finally:
+            buf.close()
+        update(status="embedding", words=n_words, attributes=attrs, chunks_total=len(chunks), chunks_done=0)
+        vectors = []
+        for b in range(0, len(chunks), UPLOAD_EMBED_BATCH):
+            vectors.append(state.embedder.encode(chunks[b:b + UPLOAD_EMBED_BATCH], show_progress_bar=False, convert_to_numpy=True))
+            update(chunks_done=min(b + UPLOAD_EMBED_BATCH, len(chunks)))
+        # the text goes in the row: the offline ingest may remove it from the text store
+        rows = [{"id": str(uuid.uuid4()), "source_path": path, "doc": doc, "start": start, "end": end, **attrs,
+                 "text": chunk[:2000], "upload": job.get("job_id")} for (start, end), chunk in zip(spans, chunks)]
+        vectors = np.concatenate(vectors)
+        uploaded.save(sha, rows, vectors)
+        uploaded.add(sha, rows, vectors)
+        self.indexed += 1
+        update(status="indexed", vectors=len(rows), indexed_at=time.time(), index_s=round(time.perf_counter() - t0, 3))
+        print(f"✅ Indexed upload {path}: {len(rows)} chunks, searchable now")
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "indexed": self.indexed, "loaded": self.loaded, "failed": self.failed,
+                **uploaded.stats()}
+
+upload_worker = UploadWorker()
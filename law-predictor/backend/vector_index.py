@@ -0,0 +1,337 @@
+import os
+import re
+import glob
+import faiss
+import numpy as np
+
+# Index layout used by ingest.py and the search-time knobs used by main.py
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")  # flat | ivf_flat | ivf_pq | hnsw | sq8 | sq_fp16 | pq
+IVF_NLIST = int(os.getenv("FAISS_NLIST", "1024"))
+PQ_M = int(os.getenv("FAISS_PQ_M", "48"))  # sub-quantizers, must divide the dimension
+PQ_NBITS = int(os.getenv("FAISS_PQ_NBITS", "8"))
+HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# Exact float32 vectors kept on disk next to the index, used to re-rank compressed-index candidates
+VECTORS_PATH = os.getenv("FAISS_VECTORS_PATH", "./faiss_index/vectors.f32")
+RERANK_FACTOR = int(os.getenv("FAISS_RERANK_FACTOR", "4"))  # candidates fetched per result; 0 disables re-ranking
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "sq_fp16", "pq")
+COMPRESSED_TYPES = ("ivf_pq", "sq8", "sq_fp16", "pq")
+
+def index_spec(kind=INDEX_TYPE, nlist=IVF_NLIST, pq_m=PQ_M, pq_nbits=PQ_NBITS, hnsw_m=HNSW_M):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}, expected one of {', '.join(INDEX_TYPES)}")
+    spec = {"type": kind}
+    if kind.startswith("ivf"):
+        spec["nlist"] = nlist
+    if kind in ("ivf_pq", "pq"):
+        spec.update(pq_m=pq_m, pq_nbits=pq_nbits)
+    if kind == "hnsw":
+        spec["hnsw_m"] = hnsw_m
+    return spec
+
+def factory_string(spec):
+    kind = spec["type"]
+    if kind == "ivf_flat":
+        return f"IVF{spec['nlist']},Flat"
+    if kind == "ivf_pq":
+        return f"IVF{spec['nlist']},PQ{spec['pq_m']}x{spec['pq_nbits']}"
+    if kind == "hnsw":
+        return f"HNSW{spec['hnsw_m']}"
+    if kind == "pq":
+        return f"PQ{spec['pq_m']}x{spec['pq_nbits']}"
+    if kind == "sq8":
+        return "SQ8"
+    if kind == "sq_fp16":
+        return "SQfp16"
+    return "Flat"
+
+def build_index(dimension, spec):
+    # ID-mapped so vectors of changed/deleted sources can be removed by their vector ID
+    return faiss.index_factory(dimension, "IDMap2," + factory_string(spec))
+
+def train_size(spec):
+    """Vectors to collect before training (faiss wants ~39 points per centroid)"""
+    if spec["type"] == "ivf_flat":
+        return spec["nlist"] * 39
+    if spec["type"] == "ivf_pq":
+        return max(spec["nlist"], 1 << spec["pq_nbits"]) * 39
+    if spec["type"] == "pq":
+        return (1 << spec["pq_nbits"]) * 39
+    if spec["type"] == "sq8":
+        return 10000  # per-dimension min/max only
+    return 0
+
+def fit_spec(spec, n):
+    """Shrink the IVF/PQ parameters of `spec` so `n` training vectors are enough"""
+    spec = dict(spec)
+    if spec["type"].startswith("ivf"):
+        spec["nlist"] = max(1, min(spec["nlist"], n // 39))
+    if spec["type"] in ("ivf_pq", "pq"):
+        spec["pq_nbits"] = max(1, min(spec["pq_nbits"], int(np.log2(max(2, n // 39)))))
+    return spec
+
+class IndexWriter:
+    """
+    Adds vectors to an index. For types that need training (IVF, PQ, SQ8) the vectors
+    are buffered until there are enough to train on, then added in bulk.
+    """
+    def __init__(self, index, spec, dimension, train_on=None):
+        self.index, self.spec, self.dimension = index, spec, dimension
+        self.train_on = train_on or train_size(spec)
+        self._vecs, self._ids = [], []
+        self._buffered = 0
+
+    @property
+    def trained(self):
+        return self.index.is_trained
+
+    @property
+    def buffered(self):
+        """Vectors waiting for the index to be trained"""
+        return self._buffered
+
+    def add(self, emb, ids):
+        if self.index.is_trained:
+            self.index.add_with_ids(emb, ids)
+            return
+        self._vecs.append(emb)
+        self._ids.append(ids)
+        self._buffered += len(ids)
+        if self._buffered >= self.train_on:
+            self._train()
+
+    def finish(self):
+        """Train on whatever is buffered if the corpus never reached the training size"""
+        if not self.index.is_trained and self._buffered:
+            spec = fit_spec(self.spec, self._buffered)
+            if spec != self.spec:
+                print(f"⚠️ Only {self._buffered} vectors to train on; using {factory_string(spec)} instead of {factory_string(self.spec)}")
+                self.spec, self.index = spec, build_index(self.dimension, spec)
+            self._train()
+        return self.index
+
+    def _train(self):
+        vecs, ids = np.concatenate(self._vecs), np.concatenate(self._ids)
+        print(f"🏋️ Training {factory_string(self.spec)} on {len(ids)} vectors")
+        self.index.train(vecs)
+        self.index.add_with_ids(vecs, ids)
+        self._vecs, self._ids, self._buffered = [], [], 0
+
+class VectorStore:
+    """
+    Exact float32 vectors on disk, one row per vector ID (row = vid * dimension floats).
+    Written by ingest.py, read through a read-only memory map so they never sit in RAM.
+    """
+    def __init__(self, path=VECTORS_PATH, dimension=384):
+        self.path, self.dimension = path, dimension
+        self.row_bytes = dimension * 4
+        self._fh = None
+
+    def write(self, ids, vecs):
+        if self._fh is None:
+            self._fh = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        ids = np.asarray(ids, dtype="int64")
+        if len(ids) and ids[-1] - ids[0] == len(ids) - 1:  # one contiguous run, the usual case
+            self._fh.seek(int(ids[0]) * self.row_bytes)
+            self._fh.write(vecs.tobytes())
+            return
+        for vid, vec in zip(ids.tolist(), vecs):
+            self._fh.seek(vid * self.row_bytes)
+            self._fh.write(vec.tobytes())
+
+    def sync(self):
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def truncate(self, n_rows=0):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if n_rows == 0:
+            os.remove(self.path)  # servers and snapshots mapping the old file keep it
+            return
+        with open(self.path, "r+b") as fh:
+            fh.truncate(n_rows * self.row_bytes)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def reader(self):
+        """Read-only memmap of shape (rows, dimension), or None if nothing was stored"""
+        if not os.path.exists(self.path):
+            return None
+        rows = os.path.getsize(self.path) // self.row_bytes
+        if rows == 0:
+            return None
+        return np.memmap(self.path, dtype="float32", mode="r", shape=(rows, self.dimension))
+
+def exact_rerank(vectors, queries, I, k):
+    """Re-order candidate IDs `I` by exact L2 distance to `queries`, keeping the best k"""
+    out_D = np.full((len(queries), k), np.inf, dtype="float32")
+    out_I = np.full((len(queries), k), -1, dtype="int64")
+    for qi, cand in enumerate(I):
+        cand = np.sort(cand[(cand >= 0) & (cand < len(vectors))])  # sorted rows read sequentially
+        if len(cand) == 0:
+            continue
+        dist = ((np.asarray(vectors[cand]) - queries[qi]) ** 2).sum(axis=1)
+        order = np.argsort(dist)[:k]
+        out_D[qi, :len(order)] = dist[order]
+        out_I[qi, :len(order)] = cand[order]
+    return out_D, out_I
+
+def search(index, queries, k, vectors=None, rerank_factor=RERANK_FACTOR, params=None):
+    """
+    Search the index. With exact `vectors` (a VectorStore memmap) and a compressed
+    index, k * rerank_factor candidates are fetched and re-ranked exactly.
+    """
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    if vectors is None or rerank_factor <= 0 or describe(index) not in COMPRESSED_TYPES:
+        return index.search(queries, k, params=params)
+    D, I = index.search(queries, k * rerank_factor, params=params)
+    if I.max(initial=-1) >= len(vectors):
+        # vectors written before the store existed: keep the index's own ranking
+        return D[:, :k], I[:, :k]
+    return exact_rerank(vectors, queries, I, k)
+
+def exact_knn(vectors, ids, queries, k, block=65536):
+    """Ground-truth k-NN of `queries` among the rows `ids` of a memmap, scanned block by block"""
+    best_D = np.full((len(queries), k), np.inf, dtype="float32")
+    best_I = np.full((len(queries), k), -1, dtype="int64")
+    ids = np.sort(np.asarray(ids, dtype="int64"))
+    for b in range(0, len(ids), block):
+        block_ids = ids[b:b + block]
+        D, I = faiss.knn(queries, np.ascontiguousarray(vectors[block_ids]), min(k, len(block_ids)))
+        D = np.concatenate([best_D, D], axis=1)
+        I = np.concatenate([best_I, np.where(I >= 0, block_ids[np.maximum(I, 0)], -1)], axis=1)
+        order = np.argsort(D, axis=1)[:, :k]
+        best_D, best_I = np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+    return best_D, best_I
+
+def bytes_per_vector(index):
+    """Size of the index per stored vector (codes, ID map and graph/lists)"""
+    if index.ntotal == 0:
+        return 0.0
+    if describe(index) == "flat":
+        return index.d * 4 + 8
+    return faiss.serialize_index(index).nbytes / index.ntotal
+
+def recall_at_k(I, truth):
+    k = truth.shape[1]
+    return sum(len(set(a.tolist()) & set(t.tolist())) for a, t in zip(I, truth)) / (len(truth) * k)
+
+def stored_ids(index):
+    return faiss.vector_to_array(index.id_map)
+
+def remove_ids(index, ids):
+    """
+    Remove vectors by ID. Index types without removal support (HNSW) are rebuilt
+    from their remaining vectors. Returns the index to use from now on.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    if len(ids) == 0:
+        return index
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        pass
+    keep_ids = stored_ids(index)
+    sub = faiss.downcast_index(index.index)
+    vecs = sub.reconstruct_n(0, sub.ntotal)
+    mask = ~np.isin(keep_ids, ids)
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    rebuilt.add_with_ids(vecs[mask], keep_ids[mask])
+    return rebuilt
+
+def read_index(path, mmap=False):
+    """Read an index; with mmap=True read-only, its codes left in the file and paged in on demand"""
+    if not mmap:
+        return faiss.read_index(path)
+    # IVF lists stay in the file with IO_FLAG_MMAP, flat/SQ/PQ/HNSW codes with IO_FLAG_MMAP_IFC;
+    # an IVF index refuses IO_FLAG_MMAP_IFC, so it is read again without it
+    flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if ifc:
+        try:
+            return faiss.read_index(path, flags | ifc)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path, flags)
+
+def shard_paths(index_path, n):
+    """Index file of each of n shards: index_path itself when unsharded, else index.shardI-of-N.faiss"""
+    if n <= 1:
+        return [index_path]
+    root, ext = os.path.splitext(index_path)
+    return [f"{root}.shard{i}-of-{n}{ext}" for i in range(n)]
+
+def find_shards(index_path):
+    """Shard files of the index ingest.py last wrote (missing shards included), or [] if there is none"""
+    if os.path.exists(index_path):
+        return [index_path]
+    root, ext = os.path.splitext(index_path)
+    counts = set()
+    for path in glob.glob(glob.escape(root) + ".shard*-of-*" + glob.escape(ext)):
+        m = re.search(r"\.shard\d+-of-(\d+)" + re.escape(ext) + "$", path)
+        if m:
+            counts.add(int(m.group(1)))
+    return shard_paths(index_path, max(counts)) if counts else []
+
+def merge_results(results, k):
+    """Merge per-shard (D, I) top-k lists of the same queries into the overall top-k by distance"""
+    D = np.concatenate([d for d, _ in results], axis=1)
+    I = np.concatenate([i for _, i in results], axis=1)
+    D = np.where(I >= 0, D, np.inf)  # padding of shards with fewer than k vectors sorts last
+    order = np.argsort(D, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+
+def search_shards(indexes, queries, k, vectors=None):
+    """search() over several shard indexes, one after the other, merged by distance"""
+    results = [search(index, queries, k, vectors=vectors) for index in indexes if index.ntotal > 0]
+    if not results:
+        return np.full((len(queries), k), np.inf, dtype="float32"), np.full((len(queries), k), -1, dtype="int64")
+    return merge_results(results, k)
+
+def supports_selector(index):
+    """Whether a search of this index can be restricted to an ID selector (IndexPQ cannot)"""
+    return describe(index) != "pq"
+
+def selector_params(index, selector):
+    """SearchParameters restricting a search to `selector`, with the index's own nprobe / efSearch"""
+    sub = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    ivf = faiss.try_extract_index_ivf(sub)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(sub, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=sub.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def set_search_params(index, nprobe=NPROBE, ef_search=EF_SEARCH):
+    """Apply the search-time knobs that exist for this index type"""
+    ps = faiss.ParameterSpace()
+    if faiss.try_extract_index_ivf(index) is not None:
+        ps.set_index_parameter(index, "nprobe", nprobe)
+    if describe(index) == "hnsw":
+        ps.set_index_parameter(index, "efSearch", ef_search)
+    return index
+
+def describe(index):
+    """Index type name of a (possibly ID-mapped) index"""
+    sub = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(sub, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(sub)
+    if ivf is not None:
+        ivf = faiss.downcast_index(ivf)  # try_extract_index_ivf returns the IndexIVF base class
+        return "ivf_pq" if isinstance(ivf, faiss.IndexIVFPQ) else "ivf_flat"
+    if isinstance(sub, faiss.IndexPQ):
+        return "pq"
+    if isinstance(sub, faiss.IndexScalarQuantizer):
+        return "sq_fp16" if sub.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"